@@ -1,19 +1,18 @@
+import hashlib
+import io
 import os
-import matplotlib
-import numpy as np
 import pandas as pd
-import geopandas as gpd
-import folium
-import matplotlib.colors as colors
-import matplotlib.pyplot as plt
 import streamlit as st
-from streamlit_folium import st_folium
-from pathlib import Path
-from shapely.geometry import Polygon
-from shapely.geometry import mapping
-from folium.plugins import BeautifyIcon
-from branca.element import Template, MacroElement
 import streamlit.components.v1 as components
+import data_store
+import fare_engine
+import fare_maps
+import fare_scenarios
+import journey_planner
+import render_cache
+import route_geometry
+import timing
+import vector_tiles
 
 st.set_page_config(layout="wide")
 
@@ -30,10 +29,6 @@ margins_css = """
 
 st.markdown(margins_css, unsafe_allow_html=True)
 
-# Map settings
-map_centre = (53.33985783249015, -6.273211120984975)
-zoom = 9
-
 main_path = os.path.dirname(__file__)
 data_path = os.path.join(main_path, '..', 'data')
 gis_path = os.path.join(main_path, "GIS") 
@@ -41,245 +36,157 @@ gis_path = os.path.join(main_path, "GIS")
 logo_image_path = os.path.join(main_path,'..', 'pics', "logo2.png")
 st.sidebar.image(logo_image_path, width = 300)
 
-def zones(m):
-    city_zone = gpd.read_file(os.path.join(main_path, '..', 'GIS', "City_Zone_Boundary.shp"), encoding='unicode_escape')
-    commuter_zone = gpd.read_file(os.path.join(main_path, '..', 'GIS', "Commuter_Zone_Boundary.shp"), encoding='unicode_escape')
-    zone_2 = gpd.read_file(os.path.join(main_path, '..', 'GIS', "33km_Boundary.shp"), encoding='unicode_escape')
-    zone_3 = gpd.read_file(os.path.join(main_path, '..', 'GIS', "43km_Boundary.shp"), encoding='unicode_escape')
-
-    #Polygon shapes for city and commuter zones.
-    folium.GeoJson(city_zone, style_function=lambda x:{
-        'fillColor' : '#db078d',
-        'color' : '#db078d',
-        'weight': 2,
-        'fillOpacity': 0.05
-    }).add_to(m)
-
-    folium.GeoJson(commuter_zone, style_function=lambda x:{
-        'fillColor' : '#5b0896',
-        'color' : '#5b0896',
-        'weight': 2,
-        'fillOpacity': 0.05
-    }).add_to(m)
-
-    folium.GeoJson(zone_2, style_function=lambda x:{
-        'color' : 'green',
-        'weight': 2,
-        'dashArray': '5, 5',
-        'fillOpacity': 0
-    }).add_to(m)
-
-    folium.GeoJson(zone_3, style_function=lambda x:{
-        'color' : 'green',
-        'weight': 2,
-        'dashArray': '5, 5',
-        'fillOpacity': 0
-    }).add_to(m)
-
-    zones = [{'Name': 'Zone 1', 'coords': [53.32247450706408, -6.107001714337153]},
-            {'Name': 'Zone 2', 'coords': [53.3220643646633, -5.8913950198858664]},
-            {'Name': 'Zone 3', 'coords': [53.3220643646633, -5.749946052328708]},
-            {'Name': 'Zone 4', 'coords': [53.322884645929506, -5.593390884352822]}]
-
-    from folium.features import DivIcon
-
-    for zone in zones:
-        folium.Marker(
-            location=zone['coords'],
-            icon=DivIcon(
-                icon_size=(150,36),
-                icon_anchor=(0,0),
-                html= f'<div style="font-size: 6pt">{zone["Name"]}</div>'
-            )
-        ).add_to(m)
+# GIS layers each view's maps are drawn on, and the live fare data they show;
+# the view's cached maps are dropped when any of it changes. Without the bus
+# routes shapefile the bus maps are drawn without route lines.
+zone_sources = [path for zone_path in data_store.zone_paths.values() for path in data_store.shapefile_paths(zone_path)]
+route_sources = data_store.shapefile_paths(data_store.bus_routes_path) if os.path.exists(data_store.bus_routes_path) else []
+view_sources = {
+    'rail': zone_sources,
+    'bus': zone_sources + route_sources,
+    'journey': zone_sources,
+    'scenarios': zone_sources,
+    'landscape': zone_sources,
+}
 
 def transport_type():
-    return st.sidebar.selectbox("Select Transport Mode", ["Rail", "Bus"])
+    return st.sidebar.selectbox("Select Transport Mode", ["Rail", "Bus", "Bus + Rail", "Fare Scenarios", "Fare Landscape"])
+
+def timing_panel(trace):
+    # Opt-in with ?debug=timings in the URL
+    with st.sidebar.expander("Timings", expanded=True):
+        st.write(f"Total: {trace.total * 1000:.0f} ms")
+        st.dataframe(trace.table().style.format({'ms': '{:.1f}', '%': '{:.0f}%'}), hide_index=True)
+        st.caption(f"Data cache: {data_store.cache_stats()}")
+        st.caption(f"Render cache: {render_cache.shared.stats()}")
+
+def data_versions(*lives):
+    # Which version of the fare data is live, and the last change applied to it
+    for live in lives:
+        caption = f"{live.name.title()} fare data: {live.version()}"
+        update = live.last_update
+        if update:
+            if update['changes'] is None:
+                applied = "reloaded"
+            else:
+                applied = f"{update['changes']['od']} OD and {update['changes']['fares']} fare changes applied"
+            caption += f" (updated {update['at']}: {applied} in {update['ms']:.0f} ms)"
+        st.sidebar.caption(caption)
+
+def cached_map(view, fare_versions, selection, layer, legend=None):
+    # Base map and selection layer serialized for st_folium, from the render cache
+    # shared by all sessions; layer() and legend() only run on a miss
+    version = (data_store.version(view_sources[view]), vector_tiles.version()) + tuple(fare_versions)
+    base = render_cache.shared.get_or_render((view, 'base'), version,
+                                             lambda: render_cache.map_payload(fare_maps.base_map()))
+    selected = render_cache.shared.get_or_render((view,) + selection, version, lambda: dict(
+        render_cache.layer_payload(layer()), legend=legend() if legend else None))
+    return base, selected
+
+def spatial_index():
+    # Zone and nearest-stop lookups; shapely and pyproj load with the first map click
+    import spatial
+    return spatial.spatial_index()
+
+def map_click(map_key, origin_key, nearest):
+    # A new click on the map selects the nearest stop as the origin.
+    # Must run before the origin selectbox is created.
+    clicked = (st.session_state.get(map_key) or {}).get('last_clicked')
+    if not clicked:
+        return None
+    stop, distance = nearest(clicked['lat'], clicked['lng'])
+    if clicked != st.session_state.get(map_key + '_click'):
+        st.session_state[map_key + '_click'] = clicked
+        st.session_state[origin_key] = stop
+    import spatial
+    zone = spatial_index().zone(clicked['lat'], clicked['lng'])
+    zone_label = f"Zone {zone}" if zone != spatial.NO_ZONE else "outside the fare zones"
+    return f"Map click: {zone_label}, {distance:,.0f} m from {stop}"
 
 def rail():
-    # Read in data for OD pairs and fares, filter for the ticket selection
-    fare_zone_data = pd.read_csv(os.path.join(data_path, 'rail', "ODPairs(withZones).csv"), encoding='unicode_escape')
-    fares_df = pd.read_csv(os.path.join(data_path, 'rail', "Fares.csv"), encoding='unicode_escape')
-    period_fares_df = pd.read_csv(os.path.join(data_path, 'rail', "PeriodFares2.csv"), encoding='unicode_escape')
+    # Compiled OD/fare index; a patched copy replaces it when the rail data files change
+    with timing.span('index'):
+        index, version = fare_engine.current('rail')
 
-    payment_list = list(fares_df["PaymentMeans"].unique())
+    payment_list = list(index.payment_means)
     payment_list.append('Period ')
+    payment_list.append('Cheapest Ticket')
     chosen_payment_type = st.sidebar.selectbox("Select a Payment Type:", payment_list, index=1)
 
     if chosen_payment_type == 'Period ':
-        ticket_list = list(period_fares_df["TicketType"].unique())
+        ticket_list = index.period_ticket_types
         chosen_ticket_type = st.sidebar.selectbox("Select a Ticket Type:", ticket_list, index=0)
-        period_fares_df = period_fares_df[(period_fares_df['TicketType']==chosen_ticket_type)].reset_index(drop=True)
+        band_fares = {}
+    elif chosen_payment_type == 'Cheapest Ticket':
+        # Travel pattern for the cheapest-ticket optimizer; the passenger type stands in for the ticket type
+        chosen_ticket_type = st.sidebar.selectbox("Select a Passenger Type:", list(fare_engine.rail_passenger_types), index=0)
+        days_per_week = st.sidebar.slider("Travel Days per Week:", 1, 7, 5)
+        trips_per_day = st.sidebar.number_input("Return Trips per Travel Day:", min_value=1, max_value=4, value=1)
+        optimizer = fare_engine.cheapest_tickets(chosen_ticket_type, index)
+        band_fares = {}
     else:
-        fares_df = fares_df[(fares_df['PaymentMeans']==chosen_payment_type)].reset_index(drop=True)
-        ticket_list = list(fares_df["TicketType"].unique())
+        ticket_list = index.ticket_types_for(chosen_payment_type)
         chosen_ticket_type = st.sidebar.selectbox("Select a Ticket Type:", ticket_list, index=0)
-        fares_df = fares_df[(fares_df['TicketType']==chosen_ticket_type)].reset_index(drop=True)
-        fares_df = fares_df.sort_values(["Fare", "FareZone"])
+        band_fares = fare_engine.band_fares(chosen_payment_type, chosen_ticket_type, index)
 
-    station_list = sorted(list(fare_zone_data["Origin"].unique()))
-    chosen_station = st.sidebar.selectbox("Select an Origin Station:", station_list, index=0)
+    click = map_click('rail_map', 'rail_origin', lambda lat, lon: spatial_index().nearest_station(lat, lon))
 
-    # Read in shape files for stations, zones
-    rail_nodes = gpd.read_file(os.path.join(main_path, '..', 'GIS', "Irish_Rail_Stations.shp"), encoding='unicode_escape')
+    station_list = index.origins
+    chosen_station = st.sidebar.selectbox("Select an Origin Station:", station_list, index=0, key='rail_origin')
+    if click:
+        st.sidebar.caption(click)
 
-    # Join pair data with rail nodes shape data, fare data
-    fares_from_chosen_station = fare_zone_data.loc[fare_zone_data["Origin"]==chosen_station]
-    fares_from_chosen_station = fares_from_chosen_station.merge(rail_nodes, left_on="Destination", right_on="stop_name")
-
-    if chosen_payment_type == 'Period ':
-        fares_from_chosen_station = fares_from_chosen_station.merge(period_fares_df, left_on="Zone", right_on="FareZone")
-    else:
-        fares_from_chosen_station = fares_from_chosen_station.merge(fares_df, left_on="Value", right_on="FareZone")
-
-    unique_fares = fares_df.drop_duplicates(subset=['Fare'])
-    fare_num = len(fares_df)
-    cm  = plt.get_cmap('viridis_r')
-    indices = np.linspace(0, 1, fare_num)
-
-    colour_dict2 = {
-        "D1": (252, 137, 5),
-        "D2": (245, 225, 2),
-        "D10": (136, 245, 2),
-        "D14": (3, 166, 6),
-        "D11": (2, 242, 238),
-        "D90": (2, 242, 238),
-        "D12": (2, 110, 242),
-        "D91": (2, 110, 242),
-        "D13": (1, 31, 138),
-        "D92": (1, 31, 138),
-        "D93": (112, 4, 201),
-        "D94": (247, 2, 231),
-        "D95": (184, 4, 79),
-    }
-
-    colour_dict2 = {k: tuple(v/255 for v in rgb) for k, rgb in colour_dict2.items()}
-
-    # Create map
-    m = folium.Map(
-        location=map_centre,
-        zoom_start=zoom,
-        control_scale=True,
-        tiles="CartoDB positron",
-    )
-
-    # Add zones to map
-    zones(m)
-
-    destination_list = sorted(list(fare_zone_data["Destination"].unique()))
+    destination_list = list(index.destinations)
     destination_list.insert(0, "Any")
     destination_station = st.sidebar.selectbox("Select a Destination Station:", destination_list, index=0)
 
     if destination_station == chosen_station:
         st.sidebar.write("WARNING! The selected origin and destination stations are the same.")
 
-    if destination_station != chosen_station and destination_station !="Any":
-        for i, row in fares_from_chosen_station.iterrows():
-            if row['Origin'] == chosen_station and row['Destination'] == destination_station:
-                fare_type = fares_from_chosen_station.iloc[i]['Value']
-                fare_cost = fares_from_chosen_station.iloc[i]['Fare']
+    timing.annotate(payment_means=chosen_payment_type.strip(), ticket_type=chosen_ticket_type,
+                    origin=chosen_station, destination=destination_station)
+
+    if chosen_payment_type == 'Cheapest Ticket':
+        timing.annotate(days_per_week=days_per_week, trips_per_day=trips_per_day)
+        options = None
+        if destination_station != chosen_station and destination_station != "Any":
+            with timing.span('quote'):
+                options = optimizer.compare(chosen_station, destination_station, days_per_week, trips_per_day)
+            if len(options):
+                best = options.iloc[0]
+                singles = options.loc[options['Kind'] == 'Single', 'Weekly'].min()
+                st.sidebar.markdown('### Cheapest Ticket:')
+                st.sidebar.write(f"Travelling from {chosen_station} to {destination_station} {days_per_week} days a week, "
+                                 f"the cheapest option is {best['Ticket']} at €{best['Weekly']:.2f} a week "
+                                 f"(€{best['Yearly']:.2f} a year), saving €{singles - best['Weekly']:.2f} a week on single tickets.")
+    elif destination_station != chosen_station and destination_station !="Any":
+        with timing.span('quote'):
+            fare_zone, fare_cost = fare_engine.quote(chosen_station, destination_station, chosen_ticket_type, chosen_payment_type.strip(), index=index)
         st.sidebar.markdown('### You Have Selected:')
         st.sidebar.write(f" A {chosen_payment_type[:-1]} - {chosen_ticket_type} Ticket from {chosen_station} to {destination_station}, which costs €{fare_cost:.2f}.")
 
-    if destination_station == "Any" and chosen_payment_type != 'Period ':
-        #Loop through unique stations to add marker on map
-        for i, row in fares_from_chosen_station.iterrows():
-            coords = [row["geometry"].xy[1][0], row["geometry"].xy[0][0]]
-            fare_zone = row['Value']
-            origin = fares_from_chosen_station.iloc[i]['Origin']
-            destination = fares_from_chosen_station.iloc[i]['Destination']
-            fare = "€" +  f"{fares_from_chosen_station.iloc[i]['Fare']:.2f}"
-            tool_tip = f"<b>Origin:</b> {origin}<br> <b>Destination:</b> {destination}<br> <b>Fare:</b> {fare}<br> <b>Fare Zone:</b> {fare_zone}"
-
-            folium.CircleMarker(
-                            location=coords,
-                            radius=6,
-                            color="#4e4e4e",
-                            opacity=0.6,
-                            weight=1,
-                            fill_color=colors.rgb2hex(colour_dict2[fare_zone], keep_alpha=True),
-                            fill_opacity=1,
-                            tooltip=tool_tip,
-                        ).add_to(m)
-    elif destination_station != chosen_station  and destination_station != 'Any':
-        coords = [rail_nodes.loc[rail_nodes['stop_name'] == destination_station, 'stop_lat'].iloc[0], 
-                    rail_nodes.loc[rail_nodes['stop_name'] == destination_station, 'stop_lon'].iloc[0]]
-        if chosen_payment_type == 'Period ':
-            fare_zone = fares_from_chosen_station.loc[fares_from_chosen_station['Destination'] == destination_station, 'Zone'].values[0]
-            d_zone = fares_from_chosen_station.loc[fares_from_chosen_station['Destination'] == destination_station, 'Value'].values[0]
-            colour = colors.rgb2hex(colour_dict2[d_zone], keep_alpha=True)
-        else:
-            fare_zone = fares_from_chosen_station.loc[fares_from_chosen_station['Destination'] == destination_station, 'Value'].values[0]
-            colour = colors.rgb2hex(colour_dict2[fare_zone], keep_alpha=True)
-        origin = chosen_station
-        destination = destination_station
-        fare = "€" +  f"{fares_from_chosen_station.loc[fares_from_chosen_station['Destination'] == destination_station, 'Fare'].values[0]:.2f}"
-        tool_tip = f"<b>Origin:</b> {origin}<br> <b>Destination:</b> {destination}<br> <b>Fare:</b> {fare}<br> <b>Fare Zone:</b> {fare_zone}"
-
-        folium.CircleMarker(
-                        location=coords,
-                        radius=6,
-                        color="#4e4e4e",
-                        opacity=0.6,
-                        weight=1,
-                        fill_color=colour,
-                        fill_opacity=1,
-                        tooltip=tool_tip,
-                    ).add_to(m)
-    
-    # Star marker for origin station
-    icon_star = BeautifyIcon(
-    icon='diamond',
-    inner_icon_style='color:red;font-size:12px;',
-    background_color='transparent',
-    border_color='transparent',
-    )
-
-    origin_coords = [rail_nodes.loc[rail_nodes['stop_name'] == chosen_station, 'stop_lat'].iloc[0], 
-                    rail_nodes.loc[rail_nodes['stop_name'] == chosen_station, 'stop_lon'].iloc[0]]
-    folium.Marker(location=origin_coords, tooltip=f'Origin Station: {chosen_station}', icon=icon_star).add_to(m)
-    colour_map_dict = {key: tuple(int(255* value)for value in rgb) for key, rgb in colour_dict2.items()}
-
-    fare_zone_html_string = ""
-    fare_price_html_string = ""
-    colour_html_string = ""
-    for fare_key, x in colour_map_dict.items():
-        rgb_str = 'rgb' + str(x)
-        formatted_price = f"{fares_df.loc[fares_df['FareZone'] == fare_key, 'Fare'].iloc[0]:.2f}"
-        fare_zone_html_string += f"<td>{fare_key}</td>"
-        fare_price_html_string += f"<td>€{formatted_price}</td>"
-        colour_html_string += "<td style=" + f'"background-color: {rgb_str};"' + "></td>"   
-
-    legend_table_html = '''
-    <!doctype html>
-    <html lang="en">
-    <head><style>
-    @import url('https://fonts.googleapis.com/css2?family=Prompt:ital,wght@0,100;0,200;0,300;0,400;0,500;0,600;0,700;0,800;0,900;1,100;1,200;1,300;1,400;1,500;1,600;1,700;1,800;1,900&display=swap');
-    table{
-    border: 1px solid black;
-    font-family: "Prompt";
-    }
-    th, td {
-    padding:8px;windows move 
-    text-align: center;
-    }
-    </style></head>
-    <body>
-        <table cellspacing="0">
-            <tbody>
-            <tr>   
-    '''+fare_zone_html_string
-
-    legend_html_end = "</tr><tr>" + fare_price_html_string + "</tr><tr>" + colour_html_string + "</tr></tbody></table></body></html>"
-    legend_table_html += legend_html_end
+    # The base map is the same on every rerun, so st_folium keeps it in the
+    # browser and only swaps in the layer for the current selection. Both come
+    # serialized from the render cache, built here only on a miss
+    if chosen_payment_type == 'Cheapest Ticket':
+        selection = (chosen_payment_type, chosen_ticket_type, days_per_week, trips_per_day, chosen_station, destination_station)
+        layer = lambda: fare_maps.cheapest_layer(optimizer, chosen_station, days_per_week, trips_per_day, destination_station)
+        legend = lambda: fare_maps.cheapest_legend_html(set(optimizer.options['Kind']))
+    else:
+        selection = (chosen_payment_type.strip(), chosen_ticket_type, chosen_station, destination_station)
+        layer = lambda: fare_maps.rail_layer(index, chosen_station, chosen_payment_type.strip(), chosen_ticket_type, destination_station)
+        legend = lambda: fare_maps.rail_legend_html(band_fares)
+    with timing.span('map'):
+        base, selected = cached_map('rail', [version], selection, layer, legend)
 
     map_col, legend_col = st.columns([0.8,0.2])
     with map_col:
         if chosen_payment_type != 'Period ':
-            components.html(legend_table_html,height=100,)
+            components.html(selected['legend'],height=100,)
         else:
             st.header("")
-        st_data = st_folium(m, width=1200, returned_objects=[])
+        with timing.span('st_folium'):
+            st_data = render_cache.st_folium(base, selected, key='rail_map', width=1200, returned_objects=['last_clicked'])
         
     with legend_col:
         st.header("")
@@ -290,7 +197,13 @@ def rail():
         legend_image_path = os.path.join(main_path,'..', 'pics', "legend2.png")
         st.image(legend_image_path, width = 250)
 
+        # Every ticket for the selected journey, cheapest first
         buffer = 6
+        if chosen_payment_type == 'Cheapest Ticket' and options is not None and len(options):
+            output_options = options[['Ticket', 'Tickets', 'Weekly', 'Yearly']]
+            st.dataframe(output_options.style.format({'Tickets': '{:.2f}', 'Weekly': '€{:.2f}', 'Yearly': '€{:.2f}'}),
+                         hide_index=True, use_container_width=True)
+            buffer = max(0, buffer - len(options))
         for i in range(buffer):
             st.header("")
         st.text("")
@@ -298,36 +211,22 @@ def rail():
         st.image(systra_image_path, width = 120)
 
 def bus():
-    # Read in data for OD pairs and fares, filter for the ticket selection
-    fare_zone_data = pd.read_csv(os.path.join(data_path, 'bus', "20250314_Route_OD_FareCode_v1.0.csv"))
-    od_coords = pd.read_csv(os.path.join(data_path, 'bus', "20250314_Stage_Coords_v1.0.csv"))
-    fares_df = pd.read_csv(os.path.join(data_path, 'bus', "Fares.csv"), encoding='unicode_escape')
+    # Compiled OD/fare index; a patched copy replaces it when the bus data files change
+    with timing.span('index'):
+        index, version = fare_engine.current('bus')
 
-    passenger_type = ['Adult', 'Young Adult', 'Child']
+    passenger_type = list(fare_engine.bus_passenger_ticket_types)
     chosen_passenger_type = st.sidebar.selectbox("Select a Passenger Type:", passenger_type, index=1)
-    if chosen_passenger_type == 'Adult':
-        fares_df = fares_df[(fares_df['TicketType'].isin(['Adult Single', 'Adult Return']))].reset_index(drop=True)
-    elif chosen_passenger_type == 'Young Adult':
-        fares_df = fares_df[(fares_df['TicketType'].isin(['Young Adult / Child Single', 'Young Adult Single (TF)', 'Adult Single', 'Adult Return']))].reset_index(drop=True)
-    elif chosen_passenger_type == 'Child':
-        fares_df = fares_df[(fares_df['TicketType'].isin(['Young Adult / Child Single', 'Child Return', 'Child Single', 'Child Single (TF)']))].reset_index(drop=True)
-
+    ticket_types = fare_engine.bus_passenger_ticket_types[chosen_passenger_type]
 
-    # Create map
-    m = folium.Map(
-        location=map_centre,
-        zoom_start=zoom,
-        control_scale=True,
-        tiles="CartoDB positron",
-    )
+    # Route lines simplified for the zoom the user last left the map at; not
+    # needed when they come from the vector tiles
+    with timing.span('geometry'):
+        route_lines = route_geometry.route_geometry_cache() if vector_tiles.version() is None else None
+    map_view = st.session_state.get('bus_map') or {}
+    map_zoom = map_view.get('zoom') or fare_maps.zoom
 
-    # Add zones to map
-    zones(m)
-
-    # Shapefile for bus routes
-    bus_routes = gpd.read_file(os.path.join(main_path, '..', 'GIS', 'Routes', "BE_Dublin_Commuter_Routes.shp"), encoding='unicode_escape')
-
-    route_list = list(fare_zone_data["Route"].unique())
+    route_list = list(index.routes)
     route_list.insert(0, "Any")
 
     if "chosen_route" not in st.session_state:
@@ -335,66 +234,18 @@ def bus():
 
     # Single route selection using selectbox
     chosen_route = st.sidebar.selectbox("Select a Route:", route_list, index=0)
-    if chosen_route != 'Any':
-        fare_zone_data = fare_zone_data[(fare_zone_data['Route']==chosen_route)].reset_index(drop=True)
-        selected_route = bus_routes[bus_routes['route_name'] == chosen_route]
 
-        for _, row in selected_route.iterrows():
-                folium.GeoJson(row.geometry, name=f"Route {row['route_name']}", style_function=lambda x:{
-            'weight': 2}, tooltip=f"<b>Route:</b> {chosen_route}").add_to(m)
+    click = map_click('bus_map', 'bus_origin',
+                      lambda lat, lon: spatial_index().nearest_stage(lat, lon, chosen_route))
 
-    station_list = sorted(list(fare_zone_data["Origin"].unique()))
-    chosen_station = st.sidebar.selectbox("Select an Origin Station:", station_list, index=0)
+    station_list = index.origins(chosen_route)
+    chosen_station = st.sidebar.selectbox("Select an Origin Station:", station_list, index=0, key='bus_origin')
+    if click:
+        st.sidebar.caption(click)
 
-    # Multiple route selection from origin selectbox
-    if chosen_station != "Any":
-        route_list = fare_zone_data.loc[fare_zone_data["Origin"]==chosen_station, 'Route'].unique()
-        
-        # Generate equally spaced colours for multiple routes
-        route_colours = plt.cm.viridis(np.linspace(0, 1, len(route_list)))
-        route_colour_dict = {route: matplotlib.colors.rgb2hex(route_colours[i]) for i, route in enumerate(route_list)}
-        
-        for i in range(len(route_list)):
-            selected_route = bus_routes[bus_routes['route_name'] == route_list[i]]
-
-            for _, row in selected_route.iterrows():
-                route_colour = route_colour_dict.get(selected_route['route_name'].iloc[0])
-
-                for line in row.geometry.geoms:
-                    coords = [(point[1], point[0]) for point in line.coords]
-                    folium.PolyLine(coords, color=route_colour, weight=2, tooltip=f"<b>Route:</b> {selected_route['route_name'].iloc[0]}").add_to(m)
-
-    # Df for all destinations from selected origin station
-    fares_from_chosen_station = fare_zone_data.loc[fare_zone_data["Origin"]==chosen_station]
-    fares_from_chosen_station = fares_from_chosen_station.merge(od_coords, left_on="Destination", right_on="Stage")
-    fares_from_chosen_station = fares_from_chosen_station.merge(fares_df, left_on="Fare Band", right_on="FareZone")
-
-    # Df for all bus stops, not filtered by chosen station
-    all_stations = fare_zone_data.merge(od_coords, left_on="Destination", right_on="Stage")
-    all_stations = all_stations.merge(fares_df, left_on="Fare Band", right_on="FareZone")
-
-    unique_fares = fares_df.drop_duplicates(subset=['Fare'])
-    fare_num = len(fares_df)
-    cm  = plt.get_cmap('viridis_r')
-    indices = np.linspace(0, 1, fare_num)
-
-    colour_dict2 = {
-        "D1": (252, 137, 5),
-        "D2": (245, 225, 2),
-        "D10": (136, 245, 2),
-        "D14": (3, 166, 6),
-        "D11": (2, 242, 238),
-        "D90": (2, 242, 238),
-        "D12": (2, 110, 242),
-        "D91": (2, 110, 242),
-        "D13": (1, 31, 138),
-        "D92": (1, 31, 138),
-        "D93": (112, 4, 201),
-        "D94": (247, 2, 231),
-        "D95": (184, 4, 79),
-    }
-
-    colour_dict2 = {k: tuple(v/255 for v in rgb) for k, rgb in colour_dict2.items()}
+    # Df for all destinations from selected origin station, sliced from the index
+    with timing.span('fares'):
+        fares_from_chosen_station = fare_engine.fares_from(chosen_station, ticket_types, mode='bus', route=chosen_route, index=index)
 
     destination_list = sorted(list(fares_from_chosen_station["Destination"].unique()))
     destination_list.insert(0, "Any")
@@ -403,75 +254,21 @@ def bus():
     if destination_station == chosen_station:
         st.sidebar.write("WARNING! The selected origin and destination stations are the same.")
 
-    if destination_station != chosen_station and destination_station !="Any":
-        for i, row in fares_from_chosen_station.iterrows():
-            if row['Origin'] == chosen_station and row['Destination'] == destination_station:
-                fare_type = fares_from_chosen_station.iloc[i]['FareZone']
-                fare_cost = fares_from_chosen_station.iloc[i]['Fare']
-
-    if destination_station == "Any":
-        #Loop through unique stations to add marker on map
-        for i, row in fares_from_chosen_station.iterrows():
-            coords = [row["Lat"], row["Long"]]
-            fare_zone = row['FareZone']
-            origin = fares_from_chosen_station.iloc[i]['Origin']
-            destination = fares_from_chosen_station.iloc[i]['Destination']
-            fare = "€" +  f"{fares_from_chosen_station.iloc[i]['Fare']:.2f}"
-            tool_tip = f"<b>Origin:</b> {origin}<br> <b>Destination:</b> {destination}<br> <b>Fare:</b> {fare}<br> <b>Fare Zone:</b> {fare_zone}"
-
-            if 'TF' in fare_zone_data[fare_zone_data['Destination'] == row['Destination']]['Fare Band'].to_list():
-                colour = 'purple'
-            else:
-                colour = 'blue'
-            folium.CircleMarker(
-                            location=coords,
-                            radius=4,
-                            color="#4e4e4e",
-                            opacity=0.6,
-                            weight=1,
-                            fill_color=colour,
-                            fill_opacity=1,
-                            tooltip=tool_tip,
-                        ).add_to(m)
-    elif destination_station != chosen_station  and destination_station != 'Any':
-        coords = [od_coords.loc[od_coords['Stage'] == destination_station, 'Lat'].iloc[0], 
-                    od_coords.loc[od_coords['Stage'] == destination_station, 'Long'].iloc[0]]
-
-        fare_zone = fares_from_chosen_station.loc[fares_from_chosen_station['Destination'] == destination_station, 'FareZone'].iloc[0]
-        colour = 'green'
-        origin = chosen_station
-        destination = destination_station
-        fare = "€" +  f"{fares_from_chosen_station.loc[fares_from_chosen_station['Destination'] == destination_station, 'Fare'].iloc[0]:.2f}"
-        tool_tip = f"<b>Origin:</b> {origin}<br> <b>Destination:</b> {destination}<br> <b>Fare:</b> {fare}<br> <b>Fare Zone:</b> {fare_zone}"
-
-        folium.CircleMarker(
-                        location=coords,
-                        radius=6,
-                        color="#4e4e4e",
-                        opacity=0.6,
-                        weight=1,
-                        fill_color=colour,
-                        fill_opacity=1,
-                        tooltip=tool_tip,
-                    ).add_to(m)
-    
-    # Star marker for origin station
-    icon_star = BeautifyIcon(
-    icon='diamond',
-    inner_icon_style='color:red;font-size:12px;',
-    background_color='transparent',
-    border_color='transparent',
-    )
-
-    origin_coords = [od_coords.loc[od_coords['Stage'] == chosen_station, 'Lat'].iloc[0], 
-                    od_coords.loc[od_coords['Stage'] == chosen_station, 'Long'].iloc[0]]
-    folium.Marker(location=origin_coords, tooltip=f'Origin Station: {chosen_station}', icon=icon_star).add_to(m)
-    colour_map_dict = {key: tuple(int(255* value)for value in rgb) for key, rgb in colour_dict2.items()}
+    timing.annotate(passenger_type=chosen_passenger_type, route=chosen_route, origin=chosen_station,
+                    destination=destination_station, zoom=map_zoom)
+
+    # Persistent base map with a selection layer, as in rail()
+    with timing.span('map'):
+        base, selected = cached_map('bus', [version], (chosen_passenger_type, chosen_route, chosen_station, destination_station, map_zoom),
+                                    lambda: fare_maps.bus_layer(index, route_lines, ticket_types, chosen_route, chosen_station, destination_station, map_zoom))
 
     map_col, legend_col = st.columns([0.7,0.3])
     with map_col:
         st.header("")
-        st_data = st_folium(m, width=1200, returned_objects=[])
+        map_center = map_view.get('center')
+        with timing.span('st_folium'):
+            st_data = render_cache.st_folium(base, selected, key='bus_map', width=1200, returned_objects=['zoom', 'center', 'last_clicked'], zoom=map_zoom,
+                                             center=(map_center['lat'], map_center['lng']) if map_center else None)
         
     with legend_col:
         st.header("")
@@ -503,8 +300,197 @@ def bus():
         systra_image_path = os.path.join(main_path,'..', 'pics', "Systra.png")
         st.image(systra_image_path, width = 120)
 
+def journey():
+    # Cheapest combination of bus and rail tickets between any two stops
+    passenger_types = list(fare_engine.rail_passenger_types)
+    chosen_passenger_type = st.sidebar.selectbox("Select a Passenger Type:", passenger_types, index=0)
+
+    # Combined bus + rail fare graph, built once per passenger type and shared by all sessions
+    with timing.span('index'):
+        versions = [fare_engine.live('rail').version(), fare_engine.live('bus').version()]
+        planner = journey_planner.journey_planner(chosen_passenger_type)
+
+    chosen_station = st.sidebar.selectbox("Select an Origin Station:", planner.labels, index=0, key='journey_origin')
+
+    destination_list = list(planner.labels)
+    destination_list.insert(0, "Any")
+    destination_station = st.sidebar.selectbox("Select a Destination Station:", destination_list, index=0)
+
+    if destination_station == chosen_station:
+        st.sidebar.write("WARNING! The selected origin and destination stations are the same.")
+
+    timing.annotate(passenger_type=chosen_passenger_type, origin=chosen_station, destination=destination_station)
+
+    legs = None
+    if destination_station != chosen_station and destination_station != "Any":
+        with timing.span('journey'):
+            legs = planner.journey(chosen_station, destination_station)
+        st.sidebar.markdown('### You Have Selected:')
+        if len(legs):
+            tickets = (legs['Mode'] != 'Walk').sum()
+            st.sidebar.write(f"The cheapest journey from {chosen_station} to {destination_station} takes {tickets} "
+                             f"{'ticket' if tickets == 1 else 'tickets'} and costs €{legs['Fare'].sum():.2f}.")
+        else:
+            st.sidebar.write(f"There is no priced journey from {chosen_station} to {destination_station}.")
+
+    with timing.span('map'):
+        base, selected = cached_map('journey', versions, (chosen_passenger_type, chosen_station, destination_station),
+                                    lambda: fare_maps.journey_layer(planner, chosen_station, destination_station),
+                                    fare_maps.journey_legend_html)
+
+    map_col, legend_col = st.columns([0.7,0.3])
+    with map_col:
+        components.html(selected['legend'], height=100,)
+        with timing.span('st_folium'):
+            render_cache.st_folium(base, selected, key='journey_map', width=1200, returned_objects=[])
+
+    with legend_col:
+        st.header("")
+        st.text("")
+        legend_image_path = os.path.join(main_path,'..', 'pics', "legend2.png")
+        st.image(legend_image_path, width = 250)
+
+        # Legs of the selected journey
+        if legs is not None and len(legs):
+            output_legs = legs[['From', 'To', 'Mode', 'Detail', 'Fare']]
+            st.dataframe(output_legs.style.format({'Fare': '€{:.2f}'}), hide_index=True, use_container_width=True)
+
+        st.text("")
+        systra_image_path = os.path.join(main_path,'..', 'pics', "Systra.png")
+        st.image(systra_image_path, width = 120)
+
+def scenarios():
+    # Revenue impact of fare change scenarios over an uploaded demand matrix
+    network = st.sidebar.selectbox("Select a Network:", ["Rail", "Bus"], index=0)
+    demand_file = st.sidebar.file_uploader("Demand Matrix (CSV):", type='csv')
+    scenario_file = st.sidebar.file_uploader("Fare Scenarios (CSV):", type='csv')
+    elasticity = st.sidebar.number_input("Fare Elasticity of Demand:", min_value=-3.0, max_value=0.0, value=0.0, step=0.1)
+
+    map_col, legend_col = st.columns([0.7,0.3])
+    if demand_file is None or scenario_file is None:
+        with map_col:
+            st.header("")
+            st.write("Upload a demand matrix and a set of fare scenarios to see their revenue impact. "
+                     "The file formats are described at the top of fare_scenarios.py.")
+        return
+
+    with timing.span('index'):
+        index, version = fare_engine.current(network.lower())
+
+    # The sweep is kept in the session until the network, data or uploads change
+    uploads = hashlib.sha256(demand_file.getvalue() + b'\0' + scenario_file.getvalue()).hexdigest()[:16]
+    sweep_key = (network, version, uploads, elasticity)
+    stored = st.session_state.get('scenario_sweep')
+    if stored is None or stored[0] != sweep_key:
+        try:
+            with timing.span('sweep'):
+                engine = fare_engine.scenario_engine(pd.read_csv(io.BytesIO(demand_file.getvalue())), network.lower(), index)
+                sweep = fare_scenarios.sweep(engine, fare_scenarios.read_scenarios(io.BytesIO(scenario_file.getvalue())),
+                                             elasticity)
+        except (ValueError, KeyError, pd.errors.ParserError) as error:
+            st.sidebar.error(f"Cannot evaluate the scenarios: {error}")
+            return
+        st.session_state['scenario_sweep'] = stored = (sweep_key, sweep)
+    sweep = stored[1]
+
+    chosen_scenario = st.sidebar.selectbox("Select a Scenario:", sweep.names, index=0)
+    timing.annotate(network=network, scenarios=len(sweep.names), scenario=chosen_scenario)
+
+    totals = sweep.totals.loc[chosen_scenario]
+    st.sidebar.markdown('### Revenue Impact:')
+    st.sidebar.write(f"{chosen_scenario} changes revenue by €{totals['Change']:,.2f} ({totals['%']:+.2f}%), "
+                     f"from €{totals['Revenue']:,.2f} to €{totals['New Revenue']:,.2f}.")
+    if sweep.engine.dropped:
+        st.sidebar.caption(f"{sweep.engine.dropped:,} demand rows ({sweep.engine.dropped_journeys:,.0f} journeys) "
+                           f"are not priced in the fare tables and were skipped.")
+
+    with timing.span('map'):
+        base, selected = cached_map('scenarios', [version], (network, uploads, elasticity, chosen_scenario),
+                                    lambda: fare_maps.scenario_layer(sweep, chosen_scenario),
+                                    fare_maps.scenario_legend_html)
+
+    with map_col:
+        components.html(selected['legend'], height=100,)
+        with timing.span('st_folium'):
+            render_cache.st_folium(base, selected, key='scenario_map', width=1200, returned_objects=[])
+
+    with legend_col:
+        st.header("")
+        # Every scenario, then the chosen one by zone and by ticket
+        st.dataframe(sweep.totals[['Change', '%']].style.format({'Change': '€{:,.2f}', '%': '{:+.2f}%'}),
+                     use_container_width=True)
+        zones = sweep.zones.loc[chosen_scenario].rename('Change').to_frame()
+        st.dataframe(zones.style.format({'Change': '€{:,.2f}'}), use_container_width=True)
+        products = sweep.products.loc[chosen_scenario].rename('Change').to_frame()
+        st.dataframe(products[products['Change'] != 0].style.format({'Change': '€{:,.2f}'}), use_container_width=True)
+
+def landscape():
+    # Fares to or from one hub from every station or stage, for any ticket type
+    network = st.sidebar.selectbox("Select a Network:", ["Rail", "Bus"], index=0)
+    with timing.span('index'):
+        version = fare_engine.live(network.lower()).version()
+    # Every ticket type's fare matrix, built once per data version
+    with timing.span('matrices'):
+        matrices = fare_engine.fare_matrices(network.lower())
+
+    chosen_ticket = st.sidebar.selectbox("Select a Ticket Type:", matrices.product_labels, index=0)
+    hub = st.sidebar.selectbox("Select a Hub:", matrices.hubs(), index=0)
+    direction = st.sidebar.radio("Direction:", ["To hub", "From hub"], horizontal=True)
+    display = st.sidebar.radio("Show As:", ["Heat", "Isolines"], horizontal=True)
+    max_fare = st.sidebar.number_input("Fare Threshold (€):", min_value=0.0, value=3.0, step=0.5)
+    cell_km = st.sidebar.slider("Heat Cell Size (km):", 1, 10, 3) if display == 'Heat' else None
+    direction = 'to' if direction == "To hub" else 'from'
+    timing.annotate(network=network, ticket_type=chosen_ticket, hub=hub, direction=direction, display=display)
+
+    with timing.span('summary'):
+        summary = matrices.hub_summary(hub, direction, max_fare)
+    chosen = summary.loc[chosen_ticket]
+    places = 'stages' if network == 'Bus' else 'stations'
+    st.sidebar.markdown('### Within Threshold:')
+    st.sidebar.write(f"{chosen['Within']:.0f} of {chosen['Places']:.0f} {places} "
+                     f"{'reach' if direction == 'to' else 'are reached from'} {hub} for €{max_fare:.2f} or less "
+                     f"with {chosen_ticket}.")
+
+    with timing.span('map'):
+        base, selected = cached_map('landscape', [version], (network, chosen_ticket, hub, direction, display, max_fare, cell_km),
+                                    lambda: fare_maps.landscape_layer(matrices, chosen_ticket, hub, direction, display,
+                                                                      max_fare, cell_km),
+                                    lambda: fare_maps.landscape_legend_html(matrices.levels(chosen_ticket)))
+
+    map_col, legend_col = st.columns([0.7,0.3])
+    with map_col:
+        components.html(selected['legend'], height=100,)
+        with timing.span('st_folium'):
+            render_cache.st_folium(base, selected, key='landscape_map', width=1200, returned_objects=[])
+
+    with legend_col:
+        st.header("")
+        # Every ticket type to or from the hub at once
+        summary = summary.rename(columns={'Within': f"≤ €{max_fare:.2f}"})
+        st.dataframe(summary.style.format({'Median': '€{:.2f}', 'Max': '€{:.2f}'}, na_rep='-'),
+                     use_container_width=True)
+
+show_timings = st.query_params.get('debug') == 'timings'
+
 mode = transport_type()
+with timing.trace(mode.lower().replace(' + ', '_').replace(' ', '_'), enabled=show_timings) as trace:
+    if mode == 'Rail':
+        rail()
+    elif mode == 'Bus':
+        bus()
+    elif mode == 'Bus + Rail':
+        journey()
+    elif mode == 'Fare Scenarios':
+        scenarios()
+    else:
+        landscape()
+
 if mode == 'Rail':
-    rail()
+    data_versions(fare_engine.live('rail'))
+elif mode == 'Bus':
+    data_versions(fare_engine.live('bus'))
 else:
-    bus()
+    data_versions(fare_engine.live('rail'), fare_engine.live('bus'))
+
+if show_timings:
+    timing_panel(trace)
@@ -0,0 +1,279 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+import shapely
+import data_store
+import fare_index
+import fare_maps
+import route_geometry
+
+# Headless benchmarks for the dashboard's data load, fare lookup, map build and
+# payload size. Each case builds a map the way rail() / bus() / zones() do and
+# records, cold (empty data cache) and warm:
+#   per-stage latency (load, index, lookup, build, render), peak traced memory,
+#   folium object count and rendered HTML bytes.
+# --scale multiplies the OD tables (every origin reaches k copies of each
+# destination) to show where things stop scaling; each scale runs in its own
+# process so one that runs out of memory is recorded rather than fatal.
+#
+#   python benchmark.py [--scale 1 10 100] [--out results.json] [--compare old.json]
+
+main_path = os.path.dirname(__file__)
+default_output_path = os.path.join(main_path, '..', 'outputs', 'benchmarks')
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=main_path, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Synthetic scale-up
+def _replicate_destinations(od_pairs, coords, name_column, scale):
+    # Every origin also reaches scale-1 renamed copies of each destination,
+    # placed a little north of the original
+    od_copies, coord_copies = [od_pairs], [coords]
+    for j in range(1, scale):
+        od_copy = od_pairs.copy()
+        od_copy['Destination'] = od_copy['Destination'] + f' #{j}'
+        od_copies.append(od_copy)
+        coord_copy = coords.copy()
+        coord_copy[name_column] = coord_copy[name_column] + f' #{j}'
+        coord_copies.append(coord_copy)
+    return pd.concat(od_copies, ignore_index=True), pd.concat(coord_copies, ignore_index=True)
+
+def _build_scaled_rail_index(scale):
+    od_pairs, stations = _replicate_destinations(data_store.rail_od_pairs(), data_store.rail_stations(),
+                                                 'stop_name', scale)
+    offset = np.repeat(np.arange(scale) * 0.001, len(stations) // scale)
+    stations = stations.set_geometry(shapely.points(stations.geometry.x, stations.geometry.y + offset),
+                                     crs=stations.crs)
+    return fare_index.RailFareIndex(od_pairs, data_store.rail_fares(), data_store.rail_period_fares(), stations)
+
+def _build_scaled_bus_index(scale):
+    od_pairs, coords = _replicate_destinations(data_store.bus_od_pairs(), data_store.bus_stage_coords(), 'Stage', scale)
+    coords['Lat'] += np.repeat(np.arange(scale) * 0.001, len(coords) // scale)
+    return fare_index.BusFareIndex(od_pairs, data_store.bus_fares(), coords)
+
+def scaled_rail_index(scale):
+    if scale == 1:
+        return fare_index.rail_fare_index()
+    paths = [data_store.rail_od_path, data_store.rail_fares_path, data_store.rail_period_fares_path]
+    return data_store.cached(('benchmark', 'rail', scale), paths, lambda: _build_scaled_rail_index(scale))
+
+def scaled_bus_index(scale):
+    if scale == 1:
+        return fare_index.bus_fare_index()
+    paths = [data_store.bus_od_path, data_store.bus_fares_path, data_store.bus_stage_coords_path]
+    return data_store.cached(('benchmark', 'bus', scale), paths, lambda: _build_scaled_bus_index(scale))
+
+# Cases
+central_station = 'Dublin Connolly'
+
+def rail_cases(index):
+    if central_station not in index.origins:
+        raise ValueError(f"Benchmark origin {central_station!r} is not a rail origin")
+    origins = [index.origins[0], central_station, index.origins[-1]]
+    products = index.products[:1] + [product for product in index.products if product[1] == 'Child Single'][:1]
+    products += [('Period', index.period_ticket_types[0])]
+    for origin in dict.fromkeys(origins):
+        for payment_means, ticket_type in products:
+            destinations = index.fares_from(origin, payment_means, ticket_type)['Destination']
+            for destination in ['Any'] + list(destinations[destinations != origin][:1]):
+                yield {'mode': 'rail', 'origin': origin, 'payment_means': payment_means,
+                       'ticket_type': ticket_type, 'destination': destination}
+
+def bus_cases(index):
+    for passenger_type in ['Adult', 'Child']:
+        ticket_types = fare_index.bus_passenger_ticket_types[passenger_type]
+        for route in ['Any', index.routes[0]]:
+            origin = index.origins(route)[0]
+            destinations = index.fares_from(origin, ticket_types, route)['Destination']
+            for destination in ['Any'] + list(destinations[destinations != origin][:1]):
+                yield {'mode': 'bus', 'passenger_type': passenger_type, 'route': route, 'origin': origin,
+                       'destination': destination}
+
+def _load(case):
+    if case['mode'] == 'rail':
+        data_store.rail_od_pairs(), data_store.rail_fares(), data_store.rail_period_fares(), data_store.rail_stations()
+    elif case['mode'] == 'bus':
+        data_store.bus_od_pairs(), data_store.bus_fares(), data_store.bus_stage_coords()
+        if os.path.exists(data_store.bus_routes_path):
+            data_store.bus_routes()
+    data_store.zone_layers()
+
+def _run(case, scale):
+    # One pass over the stages of case; returns ({stage: seconds}, map, html)
+    timings = {}
+
+    def timed(stage, fn):
+        start = time.perf_counter()
+        value = fn()
+        timings[stage] = time.perf_counter() - start
+        return value
+
+    timed('load', lambda: _load(case))
+    if case['mode'] == 'rail':
+        index = timed('index', lambda: scaled_rail_index(scale))
+        timed('lookup', lambda: index.fares_from(case['origin'], case['payment_means'], case['ticket_type']))
+        m = timed('build', lambda: fare_maps.rail_map(index, case['origin'], case['payment_means'],
+                                                      case['ticket_type'], case['destination']))
+    elif case['mode'] == 'bus':
+        ticket_types = fare_index.bus_passenger_ticket_types[case['passenger_type']]
+        index = timed('index', lambda: (scaled_bus_index(scale), route_geometry.route_geometry_cache()))
+        timed('lookup', lambda: index[0].fares_from(case['origin'], ticket_types, case['route']))
+        m = timed('build', lambda: fare_maps.bus_map(index[0], index[1], ticket_types, case['route'],
+                                                     case['origin'], case['destination']))
+    else:
+        m = timed('build', fare_maps.base_map)
+    html = timed('render', lambda: m.get_root().render())
+    return timings, m, html
+
+def folium_object_count(element):
+    return 1 + sum(folium_object_count(child) for child in element._children.values())
+
+def cold_start():
+    # Drop everything a new process would load again: the data cache (which also
+    # holds the fare bundle, scaled indexes and geometry) and the live fare indexes
+    data_store.clear_cache()
+    fare_index.rail_live.reset()
+    fare_index.bus_live.reset()
+    gc.collect()
+
+def run_case(case, scale):
+    result = dict(case)
+    try:
+        # Cold: files are read and indexes rebuilt
+        cold_start()
+        cold, m, html = _run(case, scale)
+        warm, m, html = _run(case, scale)
+
+        # Peak traced memory of a cold pass, measured separately since tracing slows it down
+        cold_start()
+        tracemalloc.start()
+        _run(case, scale)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    except Exception as error:
+        tracemalloc.stop()
+        result['error'] = f"{type(error).__name__}: {error}"
+        return result
+
+    result.update({
+        'cold_s': sum(cold.values()),
+        'warm_s': sum(warm.values()),
+        'cold_stages_s': cold,
+        'warm_stages_s': warm,
+        'peak_memory_bytes': peak,
+        'folium_objects': folium_object_count(m.get_root()),
+        'html_bytes': len(html.encode('utf-8')),
+    })
+    return result
+
+def cases_for(modes, scale):
+    cases = []
+    if 'zones' in modes:
+        cases.append({'mode': 'zones'})
+    if 'rail' in modes:
+        cases += list(rail_cases(fare_index.rail_fare_index()))
+    if 'bus' in modes:
+        try:
+            cases += list(bus_cases(fare_index.bus_fare_index()))
+        except Exception as error:
+            cases.append({'mode': 'bus', 'error': f"{type(error).__name__}: {error}"})
+    return cases
+
+def run_scale(modes, scale):
+    results = []
+    for case in cases_for(modes, scale):
+        results.append(case if 'error' in case else run_case(case, scale))
+        _print_result(results[-1], scale)
+    return {'scale': scale, 'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'cases': results}
+
+def run(modes=('zones', 'rail', 'bus'), scales=(1,)):
+    runs = []
+    for scale in scales:
+        if scale == 1:
+            runs.append(run_scale(modes, scale))
+            continue
+        # Fresh process per scale-up, so one that exhausts memory does not take the rest down
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                runs.append(executor.submit(run_scale, modes, scale).result())
+            except BrokenProcessPool as error:
+                print(f"x{scale}: worker died ({error})", file=sys.stderr)
+                runs.append({'scale': scale, 'error': f"worker died: {error}", 'cases': []})
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': runs,
+    }
+
+def _case_label(case):
+    return ' / '.join(str(value) for key, value in case.items() if key in
+                      ('mode', 'origin', 'payment_means', 'ticket_type', 'passenger_type', 'route', 'destination'))
+
+def _print_result(result, scale):
+    label = f"x{scale} {_case_label(result)}"
+    if 'error' in result:
+        print(f"{label}: {result['error']}", file=sys.stderr)
+    else:
+        print(f"{label}: cold {result['cold_s'] * 1000:.0f}ms, warm {result['warm_s'] * 1000:.0f}ms, "
+              f"peak {result['peak_memory_bytes'] / 2**20:.1f}MB, {result['folium_objects']} objects, "
+              f"{result['html_bytes'] / 1024:.0f}KB", file=sys.stderr)
+
+def compare(old, new):
+    # Per-case new/old ratios for cases present in both result files
+    def keyed(results):
+        return {(run['scale'], _case_label(case)): case for run in results['runs'] for case in run['cases']
+                if 'error' not in case}
+
+    old_cases, new_cases = keyed(old), keyed(new)
+    rows = []
+    for key in new_cases.keys() & old_cases.keys():
+        row = {'scale': key[0], 'case': key[1]}
+        for metric in ['cold_s', 'warm_s', 'peak_memory_bytes', 'folium_objects', 'html_bytes']:
+            row[metric] = new_cases[key][metric] / old_cases[key][metric] if old_cases[key][metric] else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows).sort_values(['scale', 'case']).reset_index(drop=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark data load, fare lookup, map build and payload size.")
+    parser.add_argument('--mode', nargs='+', choices=['zones', 'rail', 'bus'], default=['zones', 'rail', 'bus'])
+    parser.add_argument('--scale', nargs='+', type=int, default=[1], help="OD table multipliers, e.g. 1 10 100")
+    parser.add_argument('--out', help="JSON results file (default: outputs/benchmarks/<commit>-<time>.json)")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    results = run(args.mode, args.scale)
+    output_path = args.out
+    if output_path is None:
+        os.makedirs(default_output_path, exist_ok=True)
+        output_path = os.path.join(default_output_path,
+                                   f"{results['commit'] or 'benchmark'}-{results['timestamp'].replace(':', '')}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {output_path}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            with pd.option_context('display.width', 200, 'display.max_columns', 10, 'display.max_colwidth', 70):
+                print(compare(json.load(f), results).to_string(float_format='{:.2f}'.format))
+
+if __name__ == '__main__':
+    main()
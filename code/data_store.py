@@ -0,0 +1,150 @@
+import os
+import re
+import threading
+import pandas as pd
+import timing
+
+# Process-wide cache for every CSV and shapefile the dashboard reads.
+# Each source is loaded once and shared by all sessions; entries are keyed on
+# the file path plus the mtime/size of the file(s), so a replaced fare file is
+# picked up on the next rerun without restarting the server.
+# Cached frames are shared - callers must treat them as read-only.
+# Bus OD pairs and stage coordinates are published as dated, versioned files
+# (20250314_Route_OD_FareCode_v1.0.csv); bus_od_path and bus_stage_coords_path
+# name the newest version in data/bus each time they are read, so dropping in a
+# new version switches to it. Copy a new version in under another name and
+# rename it into place, so it is never read half-written.
+
+main_path = os.path.dirname(__file__)
+data_path = os.path.join(main_path, '..', 'data')
+gis_path = os.path.join(main_path, '..', 'GIS')
+
+_cache = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+def _signature(paths):
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def version(paths):
+    # Version of a set of source files, for caches of things derived from them
+    return _signature(paths)
+
+def cached(key, paths, loader):
+    # Return loader() for key, reusing the stored value while none of paths has changed
+    signature = _signature(paths)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == signature:
+            _stats['hits'] += 1
+            return entry[1]
+
+    with timing.span('load ' + os.path.basename(str(key[1]))):
+        value = loader()
+
+    with _lock:
+        _stats['misses'] += 1
+        if key in _cache:
+            _stats['reloads'] += 1
+        _cache[key] = (signature, value)
+    return value
+
+def read_csv(path, **kwargs):
+    key = ('csv', os.path.abspath(path), tuple(sorted(kwargs.items())))
+    return cached(key, [path], lambda: pd.read_csv(path, **kwargs))
+
+def shapefile_paths(path):
+    # The attribute table and index live in sidecar files, so watch those too
+    stem = os.path.splitext(path)[0]
+    return [path] + [stem + ext for ext in ('.dbf', '.shx') if os.path.exists(stem + ext)]
+
+def read_shapefile(path, **kwargs):
+    # geopandas is only imported once a shapefile is actually read
+    import geopandas as gpd
+    key = ('shp', os.path.abspath(path), tuple(sorted(kwargs.items())))
+    return cached(key, shapefile_paths(path), lambda: gpd.read_file(path, **kwargs))
+
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['entries'] = len(_cache)
+    return stats
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+        for key in _stats:
+            _stats[key] = 0
+
+# Named sources used by the dashboard
+rail_od_path = os.path.join(data_path, 'rail', "ODPairs(withZones).csv")
+rail_fares_path = os.path.join(data_path, 'rail', "Fares.csv")
+rail_period_fares_path = os.path.join(data_path, 'rail', "PeriodFares2.csv")
+rail_stations_path = os.path.join(gis_path, "Irish_Rail_Stations.shp")
+versioned_sources = {
+    'bus_od_path': (os.path.join(data_path, 'bus'), 'Route_OD_FareCode'),
+    'bus_stage_coords_path': (os.path.join(data_path, 'bus'), 'Stage_Coords'),
+}
+bus_fares_path = os.path.join(data_path, 'bus', "Fares.csv")
+bus_routes_path = os.path.join(gis_path, 'Routes', "BE_Dublin_Commuter_Routes.shp")
+zone_paths = {
+    'city': os.path.join(gis_path, "City_Zone_Boundary.shp"),
+    'commuter': os.path.join(gis_path, "Commuter_Zone_Boundary.shp"),
+    '33km': os.path.join(gis_path, "33km_Boundary.shp"),
+    '43km': os.path.join(gis_path, "43km_Boundary.shp"),
+}
+
+_versioned_name = re.compile(r'(\d{8})_(.+)_v(\d+(?:\.\d+)*)\.csv$')
+
+def file_version(path):
+    # (date, version) of a versioned file name, e.g. ('20250314', '1.0'); None for other files
+    match = _versioned_name.match(os.path.basename(path))
+    return (match[1], match[3]) if match else None
+
+def latest_version(directory, name):
+    # Path of the newest <date>_<name>_v<version>.csv in directory, by date then version
+    candidates = []
+    for filename in os.listdir(directory):
+        match = _versioned_name.match(filename)
+        if match and match[2] == name:
+            candidates.append(((match[1], tuple(int(part) for part in match[3].split('.'))), filename))
+    if not candidates:
+        raise FileNotFoundError(f"No {name} file in {directory}")
+    return os.path.join(directory, max(candidates)[1])
+
+def __getattr__(name):
+    # bus_od_path and bus_stage_coords_path resolve to the newest version on every access
+    if name in versioned_sources:
+        return latest_version(*versioned_sources[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def rail_od_pairs():
+    return read_csv(rail_od_path, encoding='unicode_escape')
+
+def rail_fares():
+    return read_csv(rail_fares_path, encoding='unicode_escape')
+
+def rail_period_fares():
+    return read_csv(rail_period_fares_path, encoding='unicode_escape')
+
+def rail_stations():
+    return read_shapefile(rail_stations_path, encoding='unicode_escape')
+
+def bus_od_pairs():
+    return read_csv(latest_version(*versioned_sources['bus_od_path']))
+
+def bus_stage_coords():
+    return read_csv(latest_version(*versioned_sources['bus_stage_coords_path']))
+
+def bus_fares():
+    return read_csv(bus_fares_path, encoding='unicode_escape')
+
+def bus_routes():
+    return read_shapefile(bus_routes_path, encoding='unicode_escape')
+
+def zone_layers():
+    return {name: read_shapefile(path, encoding='unicode_escape') for name, path in zone_paths.items()}
@@ -0,0 +1,193 @@
+import argparse
+import ast
+import hashlib
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import shapely
+import folium
+import data_store
+import fare_index
+import fare_maps
+import route_geometry
+
+# Offline export of every rail and bus map to static HTML, without Streamlit.
+# Only the "Any destination" map of each selection is exported: one page per
+# origin, with the fare to every destination on it. Bus pages are skipped when
+# the bus routes shapefile is missing.
+# Pages are content-addressed: each file is named after a hash of everything
+# that goes into the map (selection, fares, geometry and the map-building code),
+# so re-exporting only renders pages whose inputs changed. A manifest.json and
+# an index.html listing every page are written next to the maps.
+#
+#   python export_maps.py [--out DIR] [--workers N] [--mode rail|bus|all]
+
+main_path = os.path.dirname(__file__)
+default_output_path = os.path.join(main_path, '..', 'outputs', 'site')
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            digest.update(','.join(map(str, part.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        elif isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:24]
+
+def code_files(name='export_maps.py'):
+    # name and every module next to it that it imports, directly or through
+    # another such module, sorted
+    files, pending = set(), [name]
+    while pending:
+        name = pending.pop()
+        if name in files:
+            continue
+        files.add(name)
+        with open(os.path.join(main_path, name), 'rb') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) \
+                else [node.module] if isinstance(node, ast.ImportFrom) and node.module else []
+            pending += [f"{module.split('.')[0]}.py" for module in modules
+                        if os.path.exists(os.path.join(main_path, f"{module.split('.')[0]}.py"))]
+    return sorted(files)
+
+def _code_digest():
+    sources = []
+    for name in code_files():
+        with open(os.path.join(main_path, name), 'rb') as f:
+            sources.append(f.read())
+    return _digest(*sources)
+
+def _zones_digest():
+    return _digest(*(b''.join(shapely.to_wkb(layer.geometry.to_numpy())) + layer.crs.to_wkt().encode()
+                     for layer in data_store.zone_layers().values()))
+
+def rail_pages(base_digest):
+    # (selection, page key) for every origin x payment means x ticket type
+    index = fare_index.rail_fare_index()
+    products = list(index.products) + [('Period', ticket_type) for ticket_type in index.period_ticket_types]
+    for payment_means, ticket_type in products:
+        band_fares = {} if payment_means == 'Period' else index.band_fares(payment_means, ticket_type)
+        for origin in index.origins:
+            selection = {'mode': 'rail', 'payment_means': payment_means, 'ticket_type': ticket_type, 'origin': origin}
+            key = _digest(base_digest, selection, index.fares_from(origin, payment_means, ticket_type),
+                          band_fares, index.coords(origin))
+            yield selection, key
+
+def bus_pages(base_digest):
+    # (selection, page key) for every passenger type x route (or Any) x origin on that route
+    index = fare_index.bus_fare_index()
+    route_lines = route_geometry.route_geometry_cache()
+    route_digests = {route: _digest(route_lines.lines(route, fare_maps.zoom)) for route in index.routes}
+    for passenger_type, ticket_types in fare_index.bus_passenger_ticket_types.items():
+        for route in ['Any'] + list(index.routes):
+            for origin in index.origins(route):
+                selection = {'mode': 'bus', 'passenger_type': passenger_type, 'route': route, 'origin': origin}
+                fares_from_origin = index.fares_from(origin, ticket_types, route)
+                destinations = fares_from_origin['Destination'].unique()
+                routes = index.routes_serving(origin, route)
+                key = _digest(base_digest, selection, fares_from_origin,
+                              index.arrives_with_band(destinations, 'TF', route).tolist(),
+                              [route_digests.get(r) for r in routes + [route]], index.coords(origin))
+                yield selection, key
+
+def page_html(selection):
+    if selection['mode'] == 'rail':
+        index = fare_index.rail_fare_index()
+        m = fare_maps.rail_map(index, selection['origin'], selection['payment_means'], selection['ticket_type'])
+        if selection['payment_means'] != 'Period':
+            legend = fare_maps.rail_legend_html(index.band_fares(selection['payment_means'], selection['ticket_type']))
+            m.get_root().html.add_child(folium.Element(
+                f'<iframe srcdoc="{html.escape(legend)}" style="position: fixed; top: 10px; left: 60px; '
+                f'z-index: 1000; width: 90%; height: 100px; border: 0;"></iframe>'))
+    else:
+        m = fare_maps.bus_map(fare_index.bus_fare_index(), route_geometry.route_geometry_cache(),
+                              fare_index.bus_passenger_ticket_types[selection['passenger_type']],
+                              selection['route'], selection['origin'])
+    return m.get_root().render()
+
+def _inline_geometry():
+    # Exported pages are opened without a vector tile server, so the workers
+    # draw routes and zones inline
+    os.environ['FARECALC_VECTOR_TILES'] = '0'
+
+def _render(job):
+    selection, path = job
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(page_html(selection))
+    os.replace(tmp_path, path)
+    return path
+
+def _index_html(manifest):
+    rows = []
+    for entry in manifest:
+        label = ' / '.join(str(value) for key, value in entry.items() if key != 'file')
+        rows.append(f'<li><a href="{html.escape(entry["file"])}">{html.escape(label)}</a></li>')
+    return '<!doctype html>\n<html lang="en"><head><meta charset="utf-8"><title>Fare maps</title></head>\n' \
+           '<body><ul>\n' + '\n'.join(rows) + '\n</ul></body></html>\n'
+
+def export(output_path=default_output_path, workers=None, modes=('rail', 'bus'), log=print):
+    start = time.perf_counter()
+    maps_path = os.path.join(output_path, 'maps')
+    os.makedirs(maps_path, exist_ok=True)
+
+    base_digest = _digest(_code_digest(), _zones_digest())
+    pages = []
+    if 'rail' in modes:
+        pages += list(rail_pages(base_digest))
+    if 'bus' in modes:
+        if os.path.exists(data_store.bus_routes_path):
+            pages += list(bus_pages(base_digest))
+        else:
+            log(f"Skipping bus pages: {data_store.bus_routes_path} not found")
+
+    manifest = [dict(selection, file=f"maps/{key}.html") for selection, key in pages]
+    jobs = [(selection, os.path.join(output_path, entry['file']))
+            for (selection, _), entry in zip(pages, manifest)
+            if not os.path.exists(os.path.join(output_path, entry['file']))]
+    jobs = list({path: (selection, path) for selection, path in jobs}.values())
+
+    render_start = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_inline_geometry) as executor:
+            for _ in executor.map(_render, jobs, chunksize=max(1, len(jobs) // (8 * (workers or os.cpu_count() or 1)))):
+                pass
+    render_time = time.perf_counter() - render_start
+
+    # Drop pages no longer referenced by any selection
+    referenced = {os.path.basename(entry['file']) for entry in manifest}
+    removed = 0
+    for name in os.listdir(maps_path):
+        if name.endswith('.html') and name not in referenced:
+            os.remove(os.path.join(maps_path, name))
+            removed += 1
+
+    with open(os.path.join(output_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    with open(os.path.join(output_path, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(_index_html(manifest))
+
+    elapsed = time.perf_counter() - start
+    log(f"{len(manifest)} pages: {len(jobs)} rendered, {len(manifest) - len(jobs)} unchanged, {removed} removed")
+    log(f"Total {elapsed:.1f}s, rendering {render_time:.1f}s ({len(jobs) / max(render_time, 1e-9):.1f} pages/s)")
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export every rail and bus fare map to static HTML.")
+    parser.add_argument('--out', default=default_output_path, help="Output directory")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--mode', choices=['rail', 'bus', 'all'], default='all')
+    args = parser.parse_args(argv)
+    export(args.out, args.workers, ('rail', 'bus') if args.mode == 'all' else (args.mode,))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import warnings
+import numpy as np
+import data_store
+
+# Compiled, memory-mapped bundle of everything the dashboard reads from data/
+# and GIS/. `python fare_bundle.py build` parses the CSVs and shapefiles once
+# and writes data/fare_bundle.bin:
+#   FAREBNDL | header length (uint64) | JSON header | arrays, 64-byte aligned
+# The header holds the name vocabularies, the sha256 of every source file and
+# the offset/dtype/shape of each array. Arrays are integer-coded indexes, float
+# coordinates, fares in fixed-point cents and pre-serialized geometry blobs.
+# Loading maps the file read-only and wraps the arrays without copying, so
+# server processes share the pages. A bundle whose sources have changed since it
+# was built is ignored (with a warning) and the sources are parsed instead.
+
+format_version = 1
+magic = b'FAREBNDL'
+alignment = 64
+fare_scale = 100
+missing_fare = np.iinfo(np.int32).min
+default_bundle_path = os.path.join(data_store.data_path, 'fare_bundle.bin')
+
+def sources():
+    # Source files the bundle is compiled from, as they exist in this checkout
+    paths = [data_store.rail_od_path, data_store.rail_fares_path, data_store.rail_period_fares_path,
+             data_store.bus_od_path, data_store.bus_fares_path, data_store.bus_stage_coords_path]
+    for shapefile in [data_store.rail_stations_path, data_store.bus_routes_path, *data_store.zone_paths.values()]:
+        if os.path.exists(shapefile):
+            paths += data_store.shapefile_paths(shapefile)
+    return paths
+
+def _source_key(path):
+    return os.path.relpath(path, os.path.join(data_store.main_path, '..')).replace(os.sep, '/')
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def source_hashes():
+    return {_source_key(path): _sha256(path) for path in sources()}
+
+def to_fixed_point(fares):
+    # Float fares (NaN = not priced) as int32 cents; refuses fares that do not round-trip
+    cents = np.where(np.isnan(fares), missing_fare, np.round(np.nan_to_num(fares) * fare_scale)).astype(np.int32)
+    if not np.array_equal(from_fixed_point(cents), fares, equal_nan=True):
+        raise ValueError("Fares are not whole cents and cannot be stored as fixed point")
+    return cents
+
+def from_fixed_point(cents):
+    return np.where(cents == missing_fare, np.nan, cents / fare_scale)
+
+class Bundle:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(magic)] != magic:
+            raise ValueError(f"{path} is not a fare bundle")
+        (header_length,) = struct.unpack_from('<Q', self._map, len(magic))
+        start = len(magic) + 8
+        self.header = json.loads(self._map[start:start + header_length].decode('utf-8'))
+        if self.header['format'] != format_version:
+            raise ValueError(f"{path} has bundle format {self.header['format']}, expected {format_version}")
+        self.version = self.header['version']
+        self._memo = {}
+
+    def __contains__(self, name):
+        return name in self.header['arrays'] or name in self.header['lists']
+
+    def array(self, name):
+        # Read-only view onto the mapped file; fixed-point fares are decoded to floats
+        entry = self.header['arrays'][name]
+        array = np.frombuffer(self._map, dtype=entry['dtype'], count=int(np.prod(entry['shape'])),
+                              offset=entry['offset']).reshape(entry['shape'])
+        if entry.get('encoding') == 'fixed_point':
+            return from_fixed_point(array)
+        return array
+
+    def json(self, name):
+        return self.memo(('json', name), lambda: json.loads(self.array(name).tobytes().decode('utf-8')))
+
+    def section(self, prefix):
+        # {attribute: array or list} for every entry named prefix/attribute
+        names = [name for name in [*self.header['arrays'], *self.header['lists']] if name.startswith(prefix + '/')]
+        return {name[len(prefix) + 1:]: self.array(name) if name in self.header['arrays'] else self.header['lists'][name]
+                for name in names}
+
+    def memo(self, key, build):
+        # Objects derived from this bundle, built once per loaded bundle
+        if key not in self._memo:
+            self._memo[key] = build()
+        return self._memo[key]
+
+    def is_current(self):
+        return self.header['sources'] == source_hashes()
+
+def write(path, arrays, lists, meta):
+    # arrays: {name: ndarray, bytes blob or ('fixed_point', float fares)};
+    # lists: {name: JSON-serialisable list}
+    entries, blocks, offset = {}, [], 0
+    for name, value in arrays.items():
+        entry = {}
+        if isinstance(value, bytes):
+            value = np.frombuffer(value, dtype=np.uint8)
+            entry['encoding'] = 'blob'
+        elif isinstance(value, tuple) and value[0] == 'fixed_point':
+            value = to_fixed_point(value[1])
+            entry['encoding'] = 'fixed_point'
+        value = np.ascontiguousarray(value)
+        offset += -offset % alignment
+        entry.update({'dtype': value.dtype.str, 'shape': list(value.shape)})
+        entries[name] = entry
+        blocks.append((offset, value))
+        offset += value.nbytes
+
+    # Array offsets are absolute, so grow the data start until the header fits in front of it
+    header = dict(meta, format=format_version, arrays=entries, lists=lists)
+    data_start = 0
+    while True:
+        for entry, (block_offset, _) in zip(entries.values(), blocks):
+            entry['offset'] = data_start + block_offset
+        header_bytes = json.dumps(header).encode('utf-8')
+        needed = len(magic) + 8 + len(header_bytes)
+        needed += -needed % alignment
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(magic + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for block_offset, value in blocks:
+            f.seek(data_start + block_offset)
+            f.write(value.tobytes())
+    os.replace(tmp_path, path)
+    return header
+
+def build(path=default_bundle_path):
+    # Parse every source and write the bundle; returns its header.
+    # The builders import this module, so they are imported here rather than at the top
+    import fare_index
+    import fare_maps
+    import route_geometry
+
+    hashes = source_hashes()
+    arrays, lists = {}, {}
+
+    def add_section(section, attributes, fare_arrays=()):
+        for name, value in attributes.items():
+            if isinstance(value, np.ndarray):
+                arrays[f'{section}/{name}'] = ('fixed_point', value) if name in fare_arrays else value
+            else:
+                lists[f'{section}/{name}'] = value
+
+    rail = fare_index.RailFareIndex(data_store.rail_od_pairs(), data_store.rail_fares(),
+                                    data_store.rail_period_fares(), data_store.rail_stations())
+    add_section('rail', rail.to_arrays(), rail.fare_arrays)
+    bus = fare_index.BusFareIndex(data_store.bus_od_pairs(), data_store.bus_fares(), data_store.bus_stage_coords())
+    add_section('bus', bus.to_arrays(), bus.fare_arrays)
+    arrays['zones/geojson'] = json.dumps(fare_maps._zone_geojson()).encode('utf-8')
+    if os.path.exists(data_store.bus_routes_path):
+        add_section('routes', route_geometry.RouteGeometryCache(data_store.bus_routes()).to_arrays())
+
+    meta = {
+        'version': hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()[:12],
+        'built': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sources': hashes,
+    }
+    return write(path, arrays, lists, meta)
+
+_stale_warned = set()
+
+def _open_current(path):
+    bundle = Bundle(path)
+    if bundle.is_current():
+        return bundle
+    if path not in _stale_warned:
+        _stale_warned.add(path)
+        warnings.warn(f"{path} is out of date with the source files and is ignored; "
+                      f"rebuild it with `python fare_bundle.py build`")
+    return None
+
+def load(path=default_bundle_path):
+    # The bundle at path if it exists and matches the sources, else None.
+    # Reopened whenever the bundle or any source file changes.
+    if not os.path.exists(path):
+        return None
+    return data_store.cached(('bundle', os.path.abspath(path)), [path] + sources(), lambda: _open_current(path))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the fare tables and GIS layers into a memory-mapped bundle.")
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--path', default=default_bundle_path)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        header = build(args.path)
+        print(f"Built {args.path} version {header['version']} ({os.path.getsize(args.path):,} bytes) "
+              f"in {time.perf_counter() - start:.2f}s")
+    else:
+        bundle = Bundle(args.path)
+        print(f"{args.path}: version {bundle.version}, built {bundle.header['built']}, "
+              f"{'current' if bundle.is_current() else 'OUT OF DATE'}")
+        for name, entry in bundle.header['arrays'].items():
+            print(f"  {name:28} {entry['dtype']:6} {str(entry['shape']):20} {entry.get('encoding', '')}")
+
+if __name__ == '__main__':
+    sys.exit(main())
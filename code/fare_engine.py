@@ -0,0 +1,223 @@
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+import fare_index
+import fare_matrix
+import fare_scenarios
+import ticket_optimizer
+
+# Headless fare quoting on whole arrays of journeys, shared by the dashboard
+# and the command line. Run `python fare_engine.py --help` for the CLI, which
+# streams a CSV of journeys through quote_many() in fixed-size chunks.
+# The dashboard's views get all their fares here. A view takes one snapshot of
+# a network's live index per rerun with current() and passes it back as index=,
+# so the whole page shows one version of the fare data; without it, the live
+# index is used.
+
+bus_passenger_ticket_types = fare_index.bus_passenger_ticket_types
+rail_passenger_types = ticket_optimizer.rail_passenger_types
+
+def live(mode='rail'):
+    # The network's fare index, kept in step with its data files
+    if mode == 'rail':
+        return fare_index.rail_live
+    elif mode == 'bus':
+        return fare_index.bus_live
+    raise ValueError(f"Unknown mode: {mode!r}")
+
+def current(mode='rail'):
+    # (index, version) of the network's fare data as it is now
+    index, version, _ = live(mode).current()
+    return index, version
+
+def _index(mode, index):
+    return live(mode).index() if index is None else index
+
+def _ids(values, vocabulary, what):
+    # Integer ids for a scalar or array of names; unknown names map to -1
+    if np.ndim(values) == 0:
+        if values not in vocabulary:
+            raise ValueError(f"Unknown {what}: {values!r}")
+        return np.int64(vocabulary.index(values))
+    return pd.Index(vocabulary).get_indexer(pd.Index(np.asarray(values, dtype=object))).astype(np.int64)
+
+def _take(table, *ids):
+    # table[ids] element-wise, NaN wherever any id is negative
+    ids = np.broadcast_arrays(*ids)
+    valid = np.logical_and.reduce([i >= 0 for i in ids])
+    safe = tuple(np.where(valid, i, 0) for i in ids)
+    return np.where(valid, table[safe], np.nan)
+
+def _take_codes(table, *ids):
+    # Integer table[ids] element-wise, -1 wherever any id is negative
+    ids = np.broadcast_arrays(*ids)
+    valid = np.logical_and.reduce([i >= 0 for i in ids])
+    safe = tuple(np.where(valid, i, 0) for i in ids)
+    return np.where(valid, table[safe], -1).astype(np.int64)
+
+def _result(codes, fares, labels):
+    return pd.DataFrame({
+        'fare_band': pd.Categorical.from_codes(np.where(codes < 0, -1, codes), categories=labels),
+        'fare': fares,
+    })
+
+def _rail_zones(index, o, d, ticket_type):
+    # (zone codes, fares) of period tickets, which are priced by zone
+    tt = _ids(ticket_type, index.period_ticket_types, 'period ticket type')
+    zones = _take_codes(index.od_zone, o, d)
+    return zones, _take(index.period_fares, tt, zones)
+
+def _rail_bands(index, o, d, ticket_type, payment_means):
+    pm = _ids(payment_means, index.payment_means, 'payment means')
+    tt = _ids(ticket_type, index.ticket_types, 'ticket type')
+    bands = _take_codes(index.od_band, o, d)
+    return bands, _take(index.fares, pm, tt, bands)
+
+def quote_rail(origins, destinations, ticket_type, payment_means, index=None):
+    index = _index('rail', index)
+    o = np.atleast_1d(_ids(origins, index.stations, 'station'))
+    d = np.atleast_1d(_ids(destinations, index.stations, 'station'))
+    zone_labels = [str(zone) for zone in range(index.period_fares.shape[1])]
+    if np.ndim(payment_means) == 0:
+        if payment_means == 'Period':
+            # fare_band holds the zone
+            return _result(*_rail_zones(index, o, d, ticket_type), zone_labels)
+        return _result(*_rail_bands(index, o, d, ticket_type, payment_means), index.bands)
+
+    # Per-row payment means: 'Period' rows are priced by zone, the rest by band,
+    # with fare_band holding the zone or the band
+    payment_means = np.asarray(payment_means, dtype=object)
+    period = payment_means == 'Period'
+    o, d = np.broadcast_to(o, period.shape), np.broadcast_to(d, period.shape)
+    rows = lambda values, mask: values if np.ndim(values) == 0 else np.asarray(values, dtype=object)[mask]
+    labels = list(dict.fromkeys(index.bands + zone_labels))
+    codes, fares = np.full(len(period), -1, dtype=np.int64), np.full(len(period), np.nan)
+    if (~period).any():
+        codes[~period], fares[~period] = _rail_bands(index, o[~period], d[~period], rows(ticket_type, ~period),
+                                                     payment_means[~period])
+    if period.any():
+        zones, fares[period] = _rail_zones(index, o[period], d[period], rows(ticket_type, period))
+        zone_codes = np.array([labels.index(zone) for zone in zone_labels])
+        codes[period] = np.where(zones >= 0, zone_codes[np.maximum(zones, 0)], -1)
+    return _result(codes, fares, labels)
+
+def quote_bus(origins, destinations, ticket_type, payment_means, routes=None, index=None):
+    # With no routes given, each journey is priced at the cheapest route serving it
+    index = _index('bus', index)
+    o = np.atleast_1d(_ids(origins, index.stages, 'stage'))
+    d = np.atleast_1d(_ids(destinations, index.stages, 'stage'))
+    pm = _ids(payment_means, index.payment_means, 'payment means')
+    tt = _ids(ticket_type, index.ticket_types, 'ticket type')
+    if routes is not None:
+        r = np.atleast_1d(_ids(routes, index.routes, 'route'))
+        bands = _take_codes(index.od_band, r, o, d)
+        return _result(bands, _take(index.fares, pm, tt, bands), index.bands)
+
+    r = np.arange(len(index.routes))[:, None]
+    bands = _take_codes(index.od_band, r, o[None, :], d[None, :])
+    fares = _take(index.fares, pm, tt, bands)
+    priced = ~np.isnan(fares).all(axis=0)
+    best = np.argmin(np.where(np.isnan(fares), np.inf, fares), axis=0)
+    columns = np.arange(fares.shape[1])
+    return _result(np.where(priced, bands[best, columns], -1),
+                   np.where(priced, fares[best, columns], np.nan), index.bands)
+
+def quote_many(origins, destinations, ticket_type, payment_means, mode='rail', routes=None, index=None):
+    # Fare band and fare for every origin/destination pair. ticket_type and
+    # payment_means may be scalars or arrays aligned with origins; unpriced or
+    # unknown journeys get a NaN fare. Rail period tickets use payment_means='Period',
+    # for every journey or per row.
+    if mode == 'rail':
+        return quote_rail(origins, destinations, ticket_type, payment_means, index)
+    elif mode == 'bus':
+        return quote_bus(origins, destinations, ticket_type, payment_means, routes, index)
+    raise ValueError(f"Unknown mode: {mode!r}")
+
+def quote(origin, destination, ticket_type, payment_means, mode='rail', route=None, index=None):
+    # Single journey as (band, fare), (None, nan) when not priced
+    result = quote_many([origin], [destination], ticket_type, payment_means, mode,
+                        None if route in (None, 'Any') else [route], index)
+    band = result['fare_band'].iloc[0]
+    return (None if pd.isna(band) else band), result['fare'].iloc[0]
+
+def band_fares(payment_means, ticket_type, index=None):
+    # {band: fare} of a rail ticket
+    return _index('rail', index).band_fares(payment_means, ticket_type)
+
+def fares_from(origin, ticket_type, payment_means=None, mode='rail', route=None, index=None):
+    # Every priced destination from origin that has a location on the map. For bus,
+    # ticket_type is a list of ticket types and route a route or 'Any'
+    if mode == 'rail':
+        return _index('rail', index).fares_from(origin, payment_means, ticket_type)
+    elif mode == 'bus':
+        return _index('bus', index).fares_from(origin, ticket_type, route)
+    raise ValueError(f"Unknown mode: {mode!r}")
+
+def cheapest_tickets(passenger_type, index=None):
+    # Cheapest-ticket optimizer over the rail tickets open to passenger_type
+    return ticket_optimizer.TicketOptimizer(_index('rail', index), passenger_type)
+
+def scenario_engine(demand, mode='rail', index=None):
+    # A demand table priced for fare_scenarios.sweep()
+    return fare_scenarios.ScenarioEngine(_index(mode, index), demand)
+
+def fare_matrices(mode='rail'):
+    # Whole-network fare matrices of the live fare data, shared by all sessions
+    return fare_matrix.fare_matrices(mode)
+
+def _column_or_value(chunk, column, value):
+    return chunk[column].to_numpy(dtype=object) if column else value
+
+def quote_csv(input_path, output_path, mode, ticket_type=None, payment_means=None, origin_column='Origin',
+              destination_column='Destination', route_column=None, ticket_type_column=None,
+              payment_means_column=None, chunksize=100_000, log=sys.stderr):
+    # Stream input_path through quote_many() chunk by chunk, appending fare_band
+    # and fare columns, so memory stays bounded by chunksize
+    rows = 0
+    start = time.perf_counter()
+    with open(output_path, 'w', newline='', encoding='utf-8') as output:
+        for i, chunk in enumerate(pd.read_csv(input_path, chunksize=chunksize, encoding='utf-8-sig')):
+            quoted = quote_many(
+                chunk[origin_column].to_numpy(dtype=object),
+                chunk[destination_column].to_numpy(dtype=object),
+                _column_or_value(chunk, ticket_type_column, ticket_type),
+                _column_or_value(chunk, payment_means_column, payment_means),
+                mode,
+                chunk[route_column].astype(str).to_numpy(dtype=object) if route_column else None,
+            )
+            chunk['fare_band'] = quoted['fare_band'].to_numpy()
+            chunk['fare'] = quoted['fare'].to_numpy()
+            chunk.to_csv(output, header=(i == 0), index=False)
+            rows += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"{rows} rows, {rows / elapsed:,.0f} rows/s", file=log)
+    elapsed = time.perf_counter() - start
+    print(f"Quoted {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)", file=log)
+    return rows, elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Price a CSV of journeys with the rail/bus fare tables.")
+    parser.add_argument('input', help="CSV with origin and destination columns")
+    parser.add_argument('output', help="CSV written with fare_band and fare columns appended")
+    parser.add_argument('--mode', choices=['rail', 'bus'], default='rail')
+    parser.add_argument('--ticket-type', help="Ticket type for every row, e.g. 'Adult Single'")
+    parser.add_argument('--payment-means', help="Payment means for every row, e.g. 'Leap Fares' or 'Period'")
+    parser.add_argument('--ticket-type-column', help="Column holding a per-row ticket type")
+    parser.add_argument('--payment-means-column', help="Column holding per-row payment means")
+    parser.add_argument('--origin-column', default='Origin')
+    parser.add_argument('--destination-column', default='Destination')
+    parser.add_argument('--route-column', help="Bus route column; cheapest route is used when omitted")
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    if not (args.ticket_type or args.ticket_type_column) or not (args.payment_means or args.payment_means_column):
+        parser.error("a ticket type and payment means (value or column) are required")
+
+    quote_csv(args.input, args.output, args.mode, args.ticket_type, args.payment_means, args.origin_column,
+              args.destination_column, args.route_column, args.ticket_type_column,
+              args.payment_means_column, args.chunksize)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,548 @@
+import hashlib
+import threading
+import time
+import warnings
+import numpy as np
+import pandas as pd
+import data_store
+import fare_bundle
+import timing
+
+# Compiled fare lookups for the dashboard.
+# Station/stage names, fare bands, payment means and ticket types are mapped to
+# dense integer ids. Each index holds an origin x destination array of fare band
+# ids (one per route for bus) and a (payment means, ticket type, band) -> fare
+# array, so a single quote is an array lookup and every destination from an
+# origin is one slice.
+# The live index of each network follows the data files: when they change, the
+# OD and fare rows that differ are applied to a copy of the index, which then
+# replaces it in one assignment. Indexes are never modified once built, so a
+# rerun holding the previous index keeps a consistent table.
+
+NO_PAIR = -1   # origin/destination pair not in the OD table
+NO_BAND = -2   # pair listed but without a priced fare band
+
+# Bus ticket types offered to each passenger type
+bus_passenger_ticket_types = {
+    'Adult': ['Adult Single', 'Adult Return'],
+    'Young Adult': ['Young Adult / Child Single', 'Young Adult Single (TF)', 'Adult Single', 'Adult Return'],
+    'Child': ['Young Adult / Child Single', 'Child Return', 'Child Single', 'Child Single (TF)'],
+}
+
+def _codes(values, categories):
+    # Position of each value in categories, -1 for values (or NaN) not among them
+    return pd.Index(categories).get_indexer(pd.Index(values)).astype(np.int64)
+
+def _band_codes(values, bands):
+    codes = _codes(values, bands)
+    return np.where(codes < 0, NO_BAND, codes)
+
+def _fare_table(fares_df, bands):
+    payment_means = list(pd.unique(fares_df['PaymentMeans']))
+    ticket_types = list(pd.unique(fares_df['TicketType']))
+    fares = np.full((len(payment_means), len(ticket_types), len(bands)), np.nan)
+    fares[_codes(fares_df['PaymentMeans'], payment_means),
+          _codes(fares_df['TicketType'], ticket_types),
+          _codes(fares_df['FareZone'], bands)] = fares_df['Fare'].to_numpy(dtype=float)
+    # (payment means, ticket type) in the order they appear in the fare file
+    products = list(dict.fromkeys(zip(fares_df['PaymentMeans'], fares_df['TicketType'])))
+    return payment_means, ticket_types, fares, products
+
+def _od_changes(od_band, od_zone, cells, bands, zones):
+    # OD table rows whose band (or zone) differs from the index, and index arrays
+    # of the cells no longer in the table; cells is a tuple of id arrays, one row each
+    listed = np.zeros(od_band.shape, dtype=bool)
+    listed[cells] = True
+    changed = od_band[cells] != bands
+    if od_zone is not None:
+        changed |= od_zone[cells] != zones
+    return np.flatnonzero(changed), np.nonzero((od_band != NO_PAIR) & ~listed)
+
+def _patched(array, cells, values, fill=None, removed=None):
+    # Copy of array with values written at cells (and fill at removed); array itself when nothing changes
+    if not len(cells[0]) and (removed is None or not len(removed[0])):
+        return array
+    array = array.copy()
+    array[cells] = values
+    if removed is not None:
+        array[removed] = fill
+    return array
+
+def _fare_changes(old, new):
+    # Number of fares that differ between two fare arrays; every fare when their layouts differ
+    if old.shape != new.shape:
+        return int(np.count_nonzero(~np.isnan(new)))
+    return int(np.count_nonzero(~((old == new) | (np.isnan(old) & np.isnan(new)))))
+
+def _covers(cells, n):
+    # Whether every id in cells is known and each of 0..n-1 appears in some cell
+    present = np.zeros(n, dtype=bool)
+    for ids in cells:
+        if (ids < 0).any():
+            return False
+        present[ids] = True
+    return present.all()
+
+def _band_presence(bands, n_bands):
+    # bool[..., n_bands]: whether each band id appears along the last axis of bands
+    return (bands[..., None] == np.arange(n_bands)).any(axis=-2)
+
+def _lookup(fares, bands):
+    # fares[..., band] with NaN where the band is missing
+    safe = np.where(bands >= 0, bands, 0)
+    return np.where(bands >= 0, fares[..., safe], np.nan)
+
+class RailFareIndex:
+    # Attributes saved to / restored from a fare bundle; the rest are derived
+    bundle_attributes = ['stations', 'origins', 'destinations', 'bands', 'od_band', 'od_zone', 'payment_means',
+                         'ticket_types', 'fares', 'products', 'period_ticket_types', 'period_fares', 'lat', 'lon']
+    fare_arrays = ['fares', 'period_fares']
+
+    def __init__(self, od_pairs, fares_df, period_fares_df, stations_gdf):
+        self.stations = sorted(set(od_pairs['Origin']) | set(od_pairs['Destination']))
+        self.station_ids = {name: i for i, name in enumerate(self.stations)}
+        self.origins = sorted(od_pairs['Origin'].unique())
+        self.destinations = sorted(od_pairs['Destination'].unique())
+        self.bands = list(pd.unique(pd.concat([od_pairs['Value'], fares_df['FareZone']]).dropna()))
+        self.band_ids = {band: i for i, band in enumerate(self.bands)}
+
+        n = len(self.stations)
+        origin = _codes(od_pairs['Origin'], self.stations)
+        destination = _codes(od_pairs['Destination'], self.stations)
+        self.od_band = np.full((n, n), NO_PAIR, dtype=np.int16)
+        self.od_band[origin, destination] = _band_codes(od_pairs['Value'], self.bands)
+        self.od_zone = np.full((n, n), NO_PAIR, dtype=np.int16)
+        self.od_zone[origin, destination] = od_pairs['Zone'].fillna(NO_BAND).to_numpy(dtype=np.int16)
+
+        self.payment_means, self.ticket_types, self.fares, self.products = _fare_table(fares_df, self.bands)
+
+        # Period fares are priced by zone rather than band
+        zones = period_fares_df['FareZone'].astype(int).to_numpy()
+        self.period_ticket_types = list(pd.unique(period_fares_df['TicketType']))
+        self.period_fares = np.full((len(self.period_ticket_types), zones.max() + 1), np.nan)
+        self.period_fares[_codes(period_fares_df['TicketType'], self.period_ticket_types), zones] = \
+            period_fares_df['Fare'].to_numpy(dtype=float)
+
+        # Station coordinates, NaN for stations without geometry
+        coords = pd.DataFrame({'lat': stations_gdf.geometry.y, 'lon': stations_gdf.geometry.x})
+        coords.index = stations_gdf['stop_name']
+        coords = coords[~coords.index.duplicated()].reindex(self.stations)
+        self.lat = coords['lat'].to_numpy()
+        self.lon = coords['lon'].to_numpy()
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.bundle_attributes}
+
+    def updated(self, od_pairs=None, fares_df=None, period_fares_df=None):
+        # (index, changes) with the rows of the given tables that differ from this
+        # index applied to a copy, sharing every unchanged array; tables passed as
+        # None are unchanged. None when the tables name stations or bands this index
+        # does not have, or leave a station out
+        index = self.__class__.__new__(self.__class__)
+        index.__dict__.update(self.__dict__)
+        changes = {'od': 0, 'fares': 0}
+
+        if od_pairs is not None:
+            od_pairs = od_pairs.drop_duplicates(['Origin', 'Destination'], keep='last')
+            cells = (_codes(od_pairs['Origin'], self.stations), _codes(od_pairs['Destination'], self.stations))
+            band = _band_codes(od_pairs['Value'], self.bands)
+            if not _covers(cells, len(self.stations)) or (_codes(od_pairs['Value'].dropna(), self.bands) < 0).any():
+                return None
+            zone = od_pairs['Zone'].fillna(NO_BAND).to_numpy(dtype=np.int16)
+            rows, removed = _od_changes(self.od_band, self.od_zone, cells, band, zone)
+            changed = tuple(ids[rows] for ids in cells)
+            index.origins = sorted(od_pairs['Origin'].unique())
+            index.destinations = sorted(od_pairs['Destination'].unique())
+            index.od_band = _patched(self.od_band, changed, band[rows], NO_PAIR, removed)
+            index.od_zone = _patched(self.od_zone, changed, zone[rows], NO_PAIR, removed)
+            changes['od'] = len(rows) + len(removed[0])
+
+        # The fare tables are a few hundred rows, so they are rebuilt and compared whole
+        if fares_df is not None:
+            if (_codes(fares_df['FareZone'].dropna(), self.bands) < 0).any():
+                return None
+            index.payment_means, index.ticket_types, fares, index.products = _fare_table(fares_df, self.bands)
+            fare_changes = _fare_changes(self.fares, fares)
+            if fare_changes:
+                index.fares = fares
+            changes['fares'] += fare_changes
+        if period_fares_df is not None:
+            zones = period_fares_df['FareZone'].astype(int).to_numpy()
+            index.period_ticket_types = list(pd.unique(period_fares_df['TicketType']))
+            period_fares = np.full((len(index.period_ticket_types), zones.max() + 1), np.nan)
+            period_fares[_codes(period_fares_df['TicketType'], index.period_ticket_types), zones] = \
+                period_fares_df['Fare'].to_numpy(dtype=float)
+            fare_changes = _fare_changes(self.period_fares, period_fares)
+            if fare_changes:
+                index.period_fares = period_fares
+            changes['fares'] += fare_changes
+        return index, changes
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # Restore an index saved with to_arrays(), without the source tables
+        index = cls.__new__(cls)
+        index.__dict__.update(arrays)
+        index.products = [tuple(product) for product in index.products]
+        index.station_ids = {name: i for i, name in enumerate(index.stations)}
+        index.band_ids = {band: i for i, band in enumerate(index.bands)}
+        return index
+
+    def ticket_types_for(self, payment_means):
+        return [tt for pm, tt in self.products if pm == payment_means]
+
+    def band_fares(self, payment_means, ticket_type):
+        # Fare for every band as a {band: fare} dict, e.g. for the legend
+        row = self.fares[self.payment_means.index(payment_means), self.ticket_types.index(ticket_type)]
+        return {band: row[i] for i, band in enumerate(self.bands) if not np.isnan(row[i])}
+
+    def destination_fares(self, origin, payment_means, ticket_type):
+        # Band id and fare to every station from origin, NaN where not priced
+        bands = self.od_band[self.station_ids[origin]].astype(np.int64)
+        fares = self.fares[self.payment_means.index(payment_means), self.ticket_types.index(ticket_type)]
+        return bands, _lookup(fares, bands)
+
+    def destination_period_fares(self, origin, ticket_type):
+        zones = self.od_zone[self.station_ids[origin]].astype(np.int64)
+        fares = self.period_fares[self.period_ticket_types.index(ticket_type)]
+        return zones, _lookup(fares, zones)
+
+    def band(self, origin, destination):
+        band = int(self.od_band[self.station_ids[origin], self.station_ids[destination]])
+        return self.bands[band] if band >= 0 else None
+
+    def quote(self, origin, destination, payment_means, ticket_type):
+        # (band, fare) for a single journey, (None, nan) when not priced
+        o, d = self.station_ids[origin], self.station_ids[destination]
+        band = int(self.od_band[o, d])
+        if band < 0:
+            return None, np.nan
+        return self.bands[band], self.fares[self.payment_means.index(payment_means),
+                                            self.ticket_types.index(ticket_type), band]
+
+    def quote_period(self, origin, destination, ticket_type):
+        o, d = self.station_ids[origin], self.station_ids[destination]
+        zone = int(self.od_zone[o, d])
+        if zone < 0:
+            return None, np.nan
+        return zone, self.period_fares[self.period_ticket_types.index(ticket_type), zone]
+
+    def fares_from(self, origin, payment_means, ticket_type):
+        # All priced destinations from origin that have a location on the map
+        o = self.station_ids[origin]
+        if payment_means == 'Period':
+            zones, fares = self.destination_period_fares(origin, ticket_type)
+        else:
+            zones = self.od_zone[o].astype(np.int64)
+            _, fares = self.destination_fares(origin, payment_means, ticket_type)
+        bands = self.od_band[o].astype(np.int64)
+        keep = np.flatnonzero(~np.isnan(fares) & ~np.isnan(self.lat) & (bands >= 0))
+        return pd.DataFrame({
+            'Origin': origin,
+            'Destination': np.asarray(self.stations, dtype=object)[keep],
+            'Value': np.asarray(self.bands, dtype=object)[bands[keep]],
+            'Zone': zones[keep],
+            'Fare': fares[keep],
+            'lat': self.lat[keep],
+            'lon': self.lon[keep],
+        })
+
+    def coords(self, station):
+        i = self.station_ids.get(station)
+        if i is None or np.isnan(self.lat[i]):
+            return None
+        return [self.lat[i], self.lon[i]]
+
+class BusFareIndex:
+    bundle_attributes = ['stages', 'routes', 'bands', 'od_band', 'stage_routes', 'arrival_bands', 'departure_bands',
+                         'payment_means', 'ticket_types', 'fares', 'products', 'lat', 'lon']
+    fare_arrays = ['fares']
+
+    def __init__(self, od_pairs, fares_df, stage_coords):
+        self.stages = sorted(set(od_pairs['Origin']) | set(od_pairs['Destination']))
+        self.stage_ids = {name: i for i, name in enumerate(self.stages)}
+        self.routes = list(pd.unique(od_pairs['Route']))
+        self.route_ids = {route: i for i, route in enumerate(self.routes)}
+        self.bands = list(pd.unique(pd.concat([od_pairs['Fare Band'], fares_df['FareZone']]).dropna()))
+        self.band_ids = {band: i for i, band in enumerate(self.bands)}
+
+        n = len(self.stages)
+        route = _codes(od_pairs['Route'], self.routes)
+        origin = _codes(od_pairs['Origin'], self.stages)
+        destination = _codes(od_pairs['Destination'], self.stages)
+        band = _band_codes(od_pairs['Fare Band'], self.bands)
+        self.od_band = np.full((len(self.routes), n, n), NO_PAIR, dtype=np.int16)
+        self.od_band[route, origin, destination] = band
+
+        # Stage attributes per route: served as an origin, and the fare bands
+        # arriving at / departing from each stage
+        self.stage_routes = np.zeros((len(self.routes), n), dtype=bool)
+        self.stage_routes[route, origin] = True
+        priced = band >= 0
+        self.arrival_bands = np.zeros((len(self.routes), n, len(self.bands)), dtype=bool)
+        self.arrival_bands[route[priced], destination[priced], band[priced]] = True
+        self.departure_bands = np.zeros((len(self.routes), n, len(self.bands)), dtype=bool)
+        self.departure_bands[route[priced], origin[priced], band[priced]] = True
+
+        self.payment_means, self.ticket_types, self.fares, self.products = _fare_table(fares_df, self.bands)
+
+        coords = stage_coords.drop_duplicates('Stage').set_index('Stage').reindex(self.stages)
+        self.lat = coords['Lat'].to_numpy(dtype=float)
+        self.lon = coords['Long'].to_numpy(dtype=float)
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.bundle_attributes}
+
+    def updated(self, od_pairs=None, fares_df=None):
+        # (index, changes) as RailFareIndex.updated(); None when the tables name
+        # stages or bands this index does not have, leave a stage out, or list
+        # other routes (or the same routes in another order) than this index
+        index = self.__class__.__new__(self.__class__)
+        index.__dict__.update(self.__dict__)
+        changes = {'od': 0, 'fares': 0}
+
+        if od_pairs is not None:
+            if list(pd.unique(od_pairs['Route'])) != self.routes:
+                return None
+            od_pairs = od_pairs.drop_duplicates(['Route', 'Origin', 'Destination'], keep='last')
+            cells = (_codes(od_pairs['Route'], self.routes), _codes(od_pairs['Origin'], self.stages),
+                     _codes(od_pairs['Destination'], self.stages))
+            if (cells[0] < 0).any() or not _covers(cells[1:], len(self.stages)) \
+                    or (_codes(od_pairs['Fare Band'].dropna(), self.bands) < 0).any():
+                return None
+            band = _band_codes(od_pairs['Fare Band'], self.bands)
+            rows, removed = _od_changes(self.od_band, None, cells, band, None)
+            changed = tuple(ids[rows] for ids in cells)
+            index.od_band = _patched(self.od_band, changed, band[rows], NO_PAIR, removed)
+            changes['od'] = len(rows) + len(removed[0])
+
+            # Stage attributes are recomputed only for the route/stage pairs touched
+            route = np.concatenate([changed[0], removed[0]])
+            if len(route):
+                departures = np.unique(np.stack([route, np.concatenate([changed[1], removed[1]])]), axis=1)
+                arrivals = np.unique(np.stack([route, np.concatenate([changed[2], removed[2]])]), axis=1)
+                from_stage = index.od_band[departures[0], departures[1]]
+                to_stage = index.od_band[arrivals[0], :, arrivals[1]]
+                index.stage_routes = _patched(self.stage_routes, tuple(departures),
+                                              (from_stage != NO_PAIR).any(axis=-1))
+                index.departure_bands = _patched(self.departure_bands, tuple(departures),
+                                                 _band_presence(from_stage, len(self.bands)))
+                index.arrival_bands = _patched(self.arrival_bands, tuple(arrivals),
+                                               _band_presence(to_stage, len(self.bands)))
+
+        if fares_df is not None:
+            if (_codes(fares_df['FareZone'].dropna(), self.bands) < 0).any():
+                return None
+            index.payment_means, index.ticket_types, fares, index.products = _fare_table(fares_df, self.bands)
+            changes['fares'] = _fare_changes(self.fares, fares)
+            if changes['fares']:
+                index.fares = fares
+        return index, changes
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        index.__dict__.update(arrays)
+        index.products = [tuple(product) for product in index.products]
+        index.stage_ids = {name: i for i, name in enumerate(index.stages)}
+        index.route_ids = {route: i for i, route in enumerate(index.routes)}
+        index.band_ids = {band: i for i, band in enumerate(index.bands)}
+        return index
+
+    def _route_slice(self, route):
+        if route is None or route == 'Any':
+            return slice(None)
+        return [self.route_ids[route]]
+
+    def origins(self, route=None):
+        served = self.stage_routes[self._route_slice(route)].any(axis=0)
+        return [self.stages[i] for i in np.flatnonzero(served)]
+
+    def routes_serving(self, origin, route=None):
+        routes = np.arange(len(self.routes))[self._route_slice(route)]
+        served = self.stage_routes[routes, self.stage_ids[origin]]
+        return [self.routes[r] for r in routes[served]]
+
+    def arrives_with_band(self, stages, band, route=None):
+        # Whether any journey on route (or any route) arrives at each stage with band
+        if band not in self.band_ids:
+            return np.zeros(len(stages), dtype=bool)
+        ids = np.array([self.stage_ids[stage] for stage in stages], dtype=np.int64)
+        arrivals = self.arrival_bands[self._route_slice(route), :, self.band_ids[band]].any(axis=0)
+        return arrivals[ids]
+
+    def reachable_bands(self, stage, route=None):
+        bands = self.departure_bands[self._route_slice(route), self.stage_ids[stage]].any(axis=0)
+        return {self.bands[b] for b in np.flatnonzero(bands)}
+
+    def quote(self, route, origin, destination, payment_means, ticket_type):
+        band = int(self.od_band[self.route_ids[route], self.stage_ids[origin], self.stage_ids[destination]])
+        if band < 0:
+            return None, np.nan
+        return self.bands[band], self.fares[self.payment_means.index(payment_means),
+                                            self.ticket_types.index(ticket_type), band]
+
+    def fares_from(self, origin, ticket_types, route=None):
+        # One row per (route, destination, payment means, ticket type) priced from
+        # origin, restricted to ticket_types and to stages with coordinates
+        routes = np.arange(len(self.routes))[self._route_slice(route)]
+        bands = self.od_band[routes, self.stage_ids[origin]].astype(np.int64)
+        r, d = np.nonzero((bands >= 0) & ~np.isnan(self.lat)[None, :])
+        pair_bands = bands[r, d]
+
+        products = [(pm, tt) for pm, tt in self.products if tt in ticket_types]
+        pm = np.array([self.payment_means.index(p) for p, _ in products], dtype=np.int64)
+        tt = np.array([self.ticket_types.index(t) for _, t in products], dtype=np.int64)
+        pair_fares = self.fares[pm[None, :], tt[None, :], pair_bands[:, None]]
+        pair, product = np.nonzero(~np.isnan(pair_fares))
+
+        return pd.DataFrame({
+            'Route': np.asarray(self.routes, dtype=object)[routes[r[pair]]],
+            'Origin': origin,
+            'Destination': np.asarray(self.stages, dtype=object)[d[pair]],
+            'Fare Band': np.asarray(self.bands, dtype=object)[pair_bands[pair]],
+            'PaymentMeans': np.asarray([p for p, _ in products], dtype=object)[product],
+            'TicketType': np.asarray([t for _, t in products], dtype=object)[product],
+            'Fare': pair_fares[pair, product],
+            'Lat': self.lat[d[pair]],
+            'Long': self.lon[d[pair]],
+        })
+
+    def coords(self, stage):
+        i = self.stage_ids.get(stage)
+        if i is None or np.isnan(self.lat[i]):
+            return None
+        return [self.lat[i], self.lon[i]]
+
+class LiveIndex:
+    # The current fare index of one network, kept in step with its data files.
+    # sources() lists every file the index is built from. When only fare_sources()
+    # have changed, update(index, changed paths) -> (index, changes) patches the
+    # live index (or returns None when it cannot), else build() makes a new one
+    # from scratch. The live state
+    # is replaced in one assignment, so readers see the old or the new version,
+    # never a mix. A version that fails to load is reported and the previous
+    # one stays live.
+    def __init__(self, name, sources, fare_sources, build, update):
+        self.name = name
+        self.sources = sources
+        self.fare_sources = fare_sources
+        self.build = build
+        self.update = update
+        self.last_update = None
+        self._live = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        # (index, version, signature) live for the data files as they are now
+        signature = self._signature()
+        live = self._live
+        if live is not None and live[2] == signature:
+            return live
+        with self._lock:
+            live = self._live
+            if live is None or live[2] != signature:
+                self._reload(live, signature)
+            return self._live
+
+    def index(self):
+        return self.current()[0]
+
+    def reset(self):
+        # Forget the live index, so the next read loads it as a new process would
+        with self._lock:
+            self._live = None
+            self.last_update = None
+
+    def version(self):
+        return self.current()[1]
+
+    def _signature(self):
+        paths = self.sources()
+        return tuple(zip(paths, data_store.version(paths)))
+
+    def _reload(self, live, signature):
+        # Caller holds the lock
+        start = time.perf_counter()
+        with timing.span(f'reload {self.name}'):
+            try:
+                version = data_version([path for path, _ in signature])
+                previous = dict(live[2]) if live is not None else {}
+                changed = {path for path, stat in signature if previous.get(path) != stat}
+                result = None
+                if live is not None and changed <= set(self.fare_sources()):
+                    result = self.update(live[0], changed)
+                if result is None:
+                    index, changes = self.build(initial=live is None), None
+                else:
+                    index, changes = result
+            except Exception as error:
+                if live is None:
+                    raise
+                warnings.warn(f"Keeping {self.name} fare data {live[1]}: loading the changed files failed: {error}")
+                # Retried when the files change again
+                self._live = (live[0], live[1], signature)
+                return
+        self._live = (index, version, signature)
+        if live is not None:
+            self.last_update = {'version': version, 'previous': live[1], 'changes': changes,
+                                'ms': (time.perf_counter() - start) * 1000,
+                                'at': time.strftime('%H:%M:%S')}
+
+def data_version(paths):
+    # Label of a set of data files: the newest date and version among versioned
+    # files plus a digest of all their contents, e.g. '20250314 v1.0 #3f1c0a9e'
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    label = '#' + digest.hexdigest()[:8]
+    versions = [version for version in map(data_store.file_version, paths) if version]
+    if versions:
+        date, version = max(versions, key=lambda v: (v[0], tuple(int(part) for part in v[1].split('.'))))
+        label = f"{date} v{version} {label}"
+    return label
+
+def _rail_sources():
+    return [data_store.rail_od_path, data_store.rail_fares_path, data_store.rail_period_fares_path] \
+        + data_store.shapefile_paths(data_store.rail_stations_path)
+
+def _build_rail(initial=False):
+    # From the compiled bundle when there is a current one, else from the sources
+    bundle = fare_bundle.load() if initial else None
+    if bundle is not None:
+        return RailFareIndex.from_arrays(bundle.section('rail'))
+    return RailFareIndex(data_store.rail_od_pairs(), data_store.rail_fares(), data_store.rail_period_fares(),
+                         data_store.rail_stations())
+
+def _bus_sources():
+    return [data_store.bus_od_path, data_store.bus_fares_path, data_store.bus_stage_coords_path]
+
+def _build_bus(initial=False):
+    bundle = fare_bundle.load() if initial else None
+    if bundle is not None:
+        return BusFareIndex.from_arrays(bundle.section('bus'))
+    return BusFareIndex(data_store.bus_od_pairs(), data_store.bus_fares(), data_store.bus_stage_coords())
+
+def _update_rail(index, changed):
+    return index.updated(
+        data_store.rail_od_pairs() if data_store.rail_od_path in changed else None,
+        data_store.rail_fares() if data_store.rail_fares_path in changed else None,
+        data_store.rail_period_fares() if data_store.rail_period_fares_path in changed else None)
+
+def _update_bus(index, changed):
+    return index.updated(
+        data_store.bus_od_pairs() if data_store.bus_od_path in changed else None,
+        data_store.bus_fares() if data_store.bus_fares_path in changed else None)
+
+rail_live = LiveIndex(
+    'rail', _rail_sources, lambda: [data_store.rail_od_path, data_store.rail_fares_path, data_store.rail_period_fares_path],
+    _build_rail, _update_rail)
+bus_live = LiveIndex(
+    'bus', _bus_sources, lambda: [data_store.bus_od_path, data_store.bus_fares_path], _build_bus, _update_bus)
+
+def rail_fare_index():
+    return rail_live.index()
+
+def bus_fare_index():
+    return bus_live.index()
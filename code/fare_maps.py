@@ -0,0 +1,490 @@
+import json
+import numpy as np
+import folium
+from folium.features import DivIcon
+from folium.plugins import BeautifyIcon
+import data_store
+import fare_bundle
+import fare_matrix
+import map_layers
+import palettes
+import timing
+import vector_tiles
+
+# Builders for the fare maps, independent of Streamlit so the same maps can be
+# rendered by the dashboard and by offline tools (see export_maps.py)
+
+# Map settings
+map_centre = (53.33985783249015, -6.273211120984975)
+zoom = 9
+
+# Rail fare band colours
+colour_dict2 = {
+    "D1": "#fc8905",
+    "D2": "#f5e102",
+    "D10": "#88f502",
+    "D14": "#03a606",
+    "D11": "#02f2ee",
+    "D90": "#02f2ee",
+    "D12": "#026ef2",
+    "D91": "#026ef2",
+    "D13": "#011f8a",
+    "D92": "#011f8a",
+    "D93": "#7004c9",
+    "D94": "#f702e7",
+    "D95": "#b8044f",
+}
+
+def base_map(location=map_centre, zoom_start=zoom):
+    # Create map
+    m = folium.Map(
+        location=location,
+        zoom_start=zoom_start,
+        control_scale=True,
+        tiles="CartoDB positron",
+    )
+
+    # Add zones to map
+    with timing.span('zones'):
+        zones(m)
+    return m
+
+def _zone_geojson():
+    # WGS84 GeoJSON for each zone layer, coordinates rounded to about a metre
+    import shapely
+    geojson = {}
+    for name, layer in data_store.zone_layers().items():
+        layer = layer.to_crs('EPSG:4326')
+        layer = layer.set_geometry(shapely.transform(layer.geometry.to_numpy(), lambda xy: np.round(xy, 5)), crs=layer.crs)
+        geojson[name] = json.loads(json.dumps(layer.__geo_interface__))
+    return geojson
+
+def zone_geojson():
+    bundle = fare_bundle.load()
+    if bundle is not None:
+        return bundle.json('zones/geojson')
+    paths = [path for zone_path in data_store.zone_paths.values() for path in data_store.shapefile_paths(zone_path)]
+    return data_store.cached(('geojson', 'zones'), paths, _zone_geojson)
+
+# Zone boundary styles, by zone layer name
+zone_styles = {
+    'city': {'fillColor': '#db078d', 'color': '#db078d', 'weight': 2, 'fillOpacity': 0.05},
+    'commuter': {'fillColor': '#5b0896', 'color': '#5b0896', 'weight': 2, 'fillOpacity': 0.05},
+    '33km': {'color': 'green', 'weight': 2, 'dashArray': '5, 5', 'fillOpacity': 0},
+    '43km': {'color': 'green', 'weight': 2, 'dashArray': '5, 5', 'fillOpacity': 0},
+}
+
+def tile_layer(styles, tooltip=None):
+    # Layer over the current vector tiles (see map_layers.VectorTiles), or None
+    # when there are none and the geometry has to be drawn inline
+    current = vector_tiles.metadata()
+    url = vector_tiles.tile_url()
+    if current is None or url is None:
+        return None
+    return map_layers.VectorTiles(url, styles, current['layers'], current['min_zoom'], current['max_zoom'], tooltip)
+
+def zones(m):
+    # Zone boundaries from the vector tiles when the maps use them, else as inline GeoJSON
+    tiles = tile_layer({'zones': f"function(properties) {{ return {json.dumps(zone_styles)}[properties.zone]; }}"})
+    if tiles is not None:
+        tiles.add_to(m)
+    else:
+        # Cached GeoJSON is shared between maps; folium embeds it without modifying it
+        for name, geojson in zone_geojson().items():
+            folium.GeoJson(geojson, style_function=lambda x, style=zone_styles[name]: style).add_to(m)
+
+    zones = [{'Name': 'Zone 1', 'coords': [53.32247450706408, -6.107001714337153]},
+            {'Name': 'Zone 2', 'coords': [53.3220643646633, -5.8913950198858664]},
+            {'Name': 'Zone 3', 'coords': [53.3220643646633, -5.749946052328708]},
+            {'Name': 'Zone 4', 'coords': [53.322884645929506, -5.593390884352822]}]
+
+    for zone in zones:
+        folium.Marker(
+            location=zone['coords'],
+            icon=DivIcon(
+                icon_size=(150,36),
+                icon_anchor=(0,0),
+                html= f'<div style="font-size: 6pt">{zone["Name"]}</div>'
+            )
+        ).add_to(m)
+
+def rail_routes(m):
+    # Rail lines under the rail fare markers; only drawn from the vector tiles
+    tiles = tile_layer({'rail_routes': "function(properties) { return {color: '#4e4e4e', weight: 1.5, opacity: 0.5}; }"})
+    if tiles is not None:
+        tiles.add_to(m)
+
+def origin_marker(m, origin, coords, label='Origin Station'):
+    # Star marker for origin station
+    icon_star = BeautifyIcon(
+    icon='diamond',
+    inner_icon_style='color:red;font-size:12px;',
+    background_color='transparent',
+    border_color='transparent',
+    )
+    folium.Marker(location=coords, tooltip=f'{label}: {origin}', icon=icon_star).add_to(m)
+
+def destination_marker(m, coords, colour, origin, destination, fare, fare_zone):
+    tool_tip = f"<b>Origin:</b> {origin}<br> <b>Destination:</b> {destination}<br> <b>Fare:</b> €{fare:.2f}<br> <b>Fare Zone:</b> {fare_zone}"
+
+    folium.CircleMarker(
+                    location=coords,
+                    radius=6,
+                    color="#4e4e4e",
+                    opacity=0.6,
+                    weight=1,
+                    fill_color=colour,
+                    fill_opacity=1,
+                    tooltip=tool_tip,
+                ).add_to(m)
+
+def rail_layer(index, origin, payment_means, ticket_type, destination='Any'):
+    # Everything on the rail map that depends on the selection, as one layer over
+    # base_map(). payment_means is 'Period' for period tickets
+    layer = folium.FeatureGroup(name='Fares')
+    rail_routes(layer)
+    with timing.span('fares'):
+        fares_from_origin = index.fares_from(origin, payment_means, ticket_type)
+
+    if destination == "Any" and payment_means != 'Period' and len(fares_from_origin):
+        # All destination markers as one GeoJSON layer
+        with timing.span('markers'):
+            features = map_layers.destination_features(
+                origin,
+                fares_from_origin['Destination'],
+                fares_from_origin['Fare'],
+                fares_from_origin['Value'],
+                fares_from_origin['Value'].map(colour_dict2),
+                fares_from_origin['lat'],
+                fares_from_origin['lon'],
+            )
+            map_layers.destination_layer(features, radius=6).add_to(layer)
+    elif destination != origin and destination != 'Any' and index.coords(destination):
+        # Priced from index, like the all-destinations markers; unpriced pairs are left off
+        fare_band = index.band(origin, destination)
+        if payment_means == 'Period':
+            fare_zone, fare_cost = index.quote_period(origin, destination, ticket_type)
+        else:
+            fare_zone, fare_cost = index.quote(origin, destination, payment_means, ticket_type)
+        if fare_band is not None and not np.isnan(fare_cost):
+            destination_marker(layer, index.coords(destination), colour_dict2.get(fare_band), origin, destination,
+                               fare_cost, fare_zone)
+
+    origin_coords = index.coords(origin)
+    if origin_coords:
+        origin_marker(layer, origin, origin_coords)
+    return layer
+
+def rail_map(index, origin, payment_means, ticket_type, destination='Any', location=map_centre, zoom_start=zoom):
+    m = base_map(location, zoom_start)
+    rail_layer(index, origin, payment_means, ticket_type, destination).add_to(m)
+    return m
+
+def rail_legend_html(band_fares):
+    # Fare band / price / colour table shown above the rail map
+    colour_map_dict = {key: tuple(int(colour[i:i + 2], 16) for i in (1, 3, 5)) for key, colour in colour_dict2.items()}
+
+    fare_zone_html_string = ""
+    fare_price_html_string = ""
+    colour_html_string = ""
+    for fare_key, x in colour_map_dict.items():
+        if fare_key not in band_fares:
+            continue
+        rgb_str = 'rgb' + str(x)
+        formatted_price = f"{band_fares[fare_key]:.2f}"
+        fare_zone_html_string += f"<td>{fare_key}</td>"
+        fare_price_html_string += f"<td>€{formatted_price}</td>"
+        colour_html_string += "<td style=" + f'"background-color: {rgb_str};"' + "></td>"
+
+    return _legend_table([fare_zone_html_string, fare_price_html_string, colour_html_string])
+
+def _legend_table(rows):
+    # Legend table page around rows of <td> cells
+    legend_table_html = '''
+    <!doctype html>
+    <html lang="en">
+    <head><style>
+    @import url('https://fonts.googleapis.com/css2?family=Prompt:ital,wght@0,100;0,200;0,300;0,400;0,500;0,600;0,700;0,800;0,900;1,100;1,200;1,300;1,400;1,500;1,600;1,700;1,800;1,900&display=swap');
+    table{
+    border: 1px solid black;
+    font-family: "Prompt";
+    }
+    th, td {
+    padding:8px;windows move
+    text-align: center;
+    }
+    </style></head>
+    <body>
+        <table cellspacing="0">
+            <tbody>
+            <tr>
+    '''
+    return legend_table_html + "</tr><tr>".join(rows) + "</tr></tbody></table></body></html>"
+
+# Colour for each kind of ticket on the cheapest-ticket map
+ticket_kind_colours = {
+    'Single': '#fc8905',
+    'Day Return': '#f5e102',
+    'Daily': '#88f502',
+    'Weekly': '#03a606',
+    'Monthly': '#026ef2',
+    'Annual': '#7004c9',
+}
+
+def cheapest_layer(optimizer, origin, days_per_week, return_trips_per_day=1, destination='Any'):
+    # Destinations coloured by the cheapest kind of ticket for the travel pattern,
+    # as one layer over base_map(). optimizer is a ticket_optimizer.TicketOptimizer
+    layer = folium.FeatureGroup(name='Fares')
+    rail_routes(layer)
+    with timing.span('optimize'):
+        cheapest = optimizer.cheapest_from(origin, days_per_week, return_trips_per_day)
+    if destination != 'Any':
+        cheapest = cheapest[(cheapest['Destination'] == destination) & (cheapest['Destination'] != origin)]
+
+    if len(cheapest):
+        with timing.span('markers'):
+            features = map_layers.destination_features(
+                origin,
+                cheapest['Destination'],
+                cheapest['Weekly'],
+                cheapest['Ticket'],
+                cheapest['Kind'].map(ticket_kind_colours),
+                cheapest['lat'],
+                cheapest['lon'],
+            )
+            map_layers.destination_layer(features, radius=6, aliases=['Origin:', 'Destination:', 'Per week:',
+                                                                      'Cheapest ticket:']).add_to(layer)
+
+    origin_coords = optimizer.index.coords(origin)
+    if origin_coords:
+        origin_marker(layer, origin, origin_coords)
+    return layer
+
+def cheapest_legend_html(kinds):
+    # Ticket kind / colour table shown above the cheapest-ticket map
+    kinds = [kind for kind in ticket_kind_colours if kind in kinds]
+    return _legend_table([
+        "".join(f"<td>{kind}</td>" for kind in kinds),
+        "".join(f'<td style="background-color: {ticket_kind_colours[kind]};"></td>' for kind in kinds),
+    ])
+
+# Journey fare bands (upper bounds in euro) and their colours on the bus + rail map
+journey_fare_bounds = [2, 4, 6, 8, 10, 15]
+journey_fare_colours = ['#fc8905', '#f5e102', '#88f502', '#03a606', '#02f2ee', '#026ef2', '#011f8a']
+journey_leg_colours = {'Rail': '#026ef2', 'Bus': '#03a606', 'Walk': '#4e4e4e'}
+
+def journey_colours(fares):
+    return np.asarray(journey_fare_colours, dtype=object)[np.searchsorted(journey_fare_bounds, fares, side='left')]
+
+def journey_layer(planner, origin, destination='Any'):
+    # Cheapest bus + rail fares from origin, or the legs of the journey to one
+    # destination, as one layer over base_map(). planner is a journey_planner.JourneyPlanner
+    layer = folium.FeatureGroup(name='Fares')
+    if destination == 'Any':
+        with timing.span('search'):
+            fares_from_origin = planner.fares_from(origin)
+        if len(fares_from_origin):
+            with timing.span('markers'):
+                features = map_layers.destination_features(
+                    origin,
+                    fares_from_origin['Destination'],
+                    fares_from_origin['Fare'],
+                    fares_from_origin['Tickets'],
+                    journey_colours(fares_from_origin['Fare']),
+                    fares_from_origin['lat'],
+                    fares_from_origin['lon'],
+                )
+                map_layers.destination_layer(features, radius=5, aliases=['Origin:', 'Destination:', 'Fare:',
+                                                                          'Tickets:']).add_to(layer)
+    elif destination != origin:
+        with timing.span('search'):
+            legs = planner.journey(origin, destination)
+        for leg in legs.itertuples():
+            ends = [planner.coords(leg.From), planner.coords(leg.To)]
+            if None not in ends:
+                detail = f" {leg.Detail}" if leg.Detail else ""
+                folium.PolyLine(ends, color=journey_leg_colours[leg.Mode], weight=3,
+                                dash_array='6' if leg.Mode == 'Walk' else None,
+                                tooltip=f"<b>{leg.Mode}{detail}:</b> {leg.From} to {leg.To}, €{leg.Fare:.2f}").add_to(layer)
+        coords = planner.coords(destination)
+        if len(legs) and coords:
+            fare = legs['Fare'].sum()
+            destination_marker(layer, coords, journey_colours([fare])[0], origin, destination, fare,
+                               f"{(legs['Mode'] != 'Walk').sum()} tickets")
+
+    origin_coords = planner.coords(origin)
+    if origin_coords:
+        origin_marker(layer, origin, origin_coords)
+    return layer
+
+def fare_legend_html(bounds, colours=journey_fare_colours):
+    # Fare range / colour table for fares coloured by bounds
+    lower = [0] + list(bounds)
+    ranges = [f"€{low:g}-{high:g}" for low, high in zip(lower, bounds)] + [f"€{bounds[-1]:g}+"]
+    return _legend_table([
+        "".join(f"<td>{fare_range}</td>" for fare_range in ranges),
+        "".join(f'<td style="background-color: {colour};"></td>' for colour in colours),
+    ])
+
+def journey_legend_html():
+    # Fare range / colour table shown above the bus + rail map
+    return fare_legend_html(journey_fare_bounds)
+
+def landscape_colours(levels):
+    # One colour per fare range of levels, from the journey fare colours
+    return journey_fare_colours[:len(levels) + 1]
+
+def landscape_layer(matrices, product, hub, direction='to', display='Heat', max_fare=3.0, cell_km=3.0):
+    # Fares of one ticket type to or from hub across the network, as one layer
+    # over base_map(): the mean fare of each grid cell for 'Heat', else fare
+    # isolines over the places, with the max_fare isoline in black.
+    # matrices is a fare_matrix.FareMatrices
+    layer = folium.FeatureGroup(name='Fares')
+    with timing.span('fares'):
+        fares = matrices.hub_fares(product, hub, direction)
+    levels = matrices.levels(product)
+    colours = np.asarray(landscape_colours(levels), dtype=object)
+
+    if len(fares) and display == 'Heat':
+        with timing.span('grid'):
+            grid = fare_matrix.fare_grid(fares['lat'], fares['lon'], fares['Fare'], cell_km)
+            features = map_layers.cell_features(
+                grid['south'], grid['west'], grid['north'], grid['east'],
+                colours[np.searchsorted(levels, grid['Fare'], side='left')],
+                {'Places': grid['Places'], 'Fare': np.char.add('€', np.char.mod('%.2f', grid['Fare'].to_numpy()))},
+            )
+            map_layers.cell_layer(features, ['Places', 'Fare'], ['Places:', 'Mean fare:']).add_to(layer)
+    elif len(fares):
+        with timing.span('isolines'):
+            lines = fare_matrix.isolines(fares['lat'], fares['lon'], fares['Fare'], levels + [max_fare])
+            for level in levels:
+                for line in lines[level]:
+                    folium.PolyLine(line, color=colours[np.searchsorted(levels, level, side='left')], weight=3,
+                                    tooltip=f"€{level:.2f}").add_to(layer)
+            for line in lines[max_fare]:
+                folium.PolyLine(line, color='black', weight=3, dash_array='6',
+                                tooltip=f"€{max_fare:.2f}").add_to(layer)
+        with timing.span('markers'):
+            origins, destinations = (fares['Place'], hub) if direction == 'to' else (hub, fares['Place'])
+            features = map_layers.destination_features(
+                origins,
+                np.broadcast_to(np.asarray(destinations, dtype=object), len(fares)),
+                fares['Fare'],
+                np.full(len(fares), product, dtype=object),
+                colours[np.searchsorted(levels, fares['Fare'], side='left')],
+                fares['lat'],
+                fares['lon'],
+            )
+            map_layers.destination_layer(features, radius=4, aliases=['From:', 'To:', 'Fare:', 'Ticket:']).add_to(layer)
+
+    hub_coords = [matrices.lat[matrices.places.index(hub)], matrices.lon[matrices.places.index(hub)]]
+    origin_marker(layer, hub, hub_coords, label='Hub')
+    return layer
+
+def landscape_legend_html(levels):
+    # Fare range / colour table shown above the fare landscape map
+    if not levels:
+        return _legend_table(["<td>One fare throughout</td>"])
+    return fare_legend_html(levels, landscape_colours(levels))
+
+scenario_change_bounds = [-10, -5, -1, 1, 5, 10]
+scenario_change_colours = ['#b2182b', '#ef8a62', '#fddbc7', '#f7f7f7', '#d1e5f0', '#67a9cf', '#2166ac']
+
+def scenario_colours(changes):
+    return np.asarray(scenario_change_colours, dtype=object)[np.searchsorted(scenario_change_bounds, changes, side='left')]
+
+def scenario_layer(sweep, scenario):
+    # Revenue change per origin for one scenario of a fare_scenarios.Sweep, as one layer over base_map()
+    layer = folium.FeatureGroup(name='Fares')
+    impact = sweep.origin_impact(scenario)
+    if len(impact):
+        with timing.span('markers'):
+            features = map_layers.destination_features(
+                scenario,
+                impact['Origin'],
+                impact['Change'],
+                impact['%'].map('{:+.2f}%'.format),
+                scenario_colours(impact['%']),
+                impact['lat'],
+                impact['lon'],
+            )
+            map_layers.destination_layer(features, radius=7, aliases=['Scenario:', 'Origin:', 'Revenue change:',
+                                                                      'Change:']).add_to(layer)
+    return layer
+
+def scenario_legend_html():
+    # Revenue change range / colour table shown above the scenario impact map
+    lower = [None] + scenario_change_bounds
+    upper = scenario_change_bounds + [None]
+    ranges = [f"< {high}%" if low is None else f"{low}%+" if high is None else f"{low} to {high}%"
+              for low, high in zip(lower, upper)]
+    return _legend_table([
+        "".join(f"<td>{change_range}</td>" for change_range in ranges),
+        "".join(f'<td style="background-color: {colour};"></td>' for colour in scenario_change_colours),
+    ])
+
+def bus_route_colours(routes):
+    # Generate equally spaced colours for multiple routes
+    return dict(zip(routes, palettes.viridis(len(routes))))
+
+def bus_layer(index, route_lines, ticket_types, route, origin, destination='Any', map_zoom=zoom):
+    # Everything on the bus map that depends on the selection, as one layer over
+    # base_map(). Route lines come from the vector tiles when the maps use them, else
+    # from route_lines, a route_geometry.RouteGeometryCache, at the level for map_zoom
+    layer = folium.FeatureGroup(name='Fares')
+
+    with timing.span('routes'):
+        # Every route serving the origin, each in its own colour, over the selected route
+        route_list = index.routes_serving(origin, route)
+        route_colour_dict = bus_route_colours(route_list)
+        highlighted = ({route: '#3388ff'} if route != 'Any' else {}) | route_colour_dict
+        tiles = tile_layer({'routes': f"""function(properties) {{
+            var colour = {json.dumps(highlighted)}[properties.route];
+            return colour ? {{color: colour, weight: 2}} : [];
+        }}"""}, tooltip="'<b>Route:</b> ' + properties.route")
+        if tiles is not None:
+            # The lines come from the tiles; only the colours of the highlighted routes are sent
+            tiles.add_to(layer)
+        else:
+            if route != 'Any':
+                lines = route_lines.lines(route, map_zoom)
+                if lines:
+                    folium.PolyLine(lines, weight=2, tooltip=f"<b>Route:</b> {route}").add_to(layer)
+            for route_name in route_list:
+                lines = route_lines.lines(route_name, map_zoom)
+                if lines:
+                    folium.PolyLine(lines, color=route_colour_dict.get(route_name), weight=2,
+                                    tooltip=f"<b>Route:</b> {route_name}").add_to(layer)
+
+    with timing.span('fares'):
+        fares_from_origin = index.fares_from(origin, ticket_types, route)
+
+    if destination == "Any" and len(fares_from_origin):
+        # One marker per destination (the last fare row, which is the one on top
+        # when drawn row by row), all emitted as one GeoJSON layer
+        with timing.span('markers'):
+            destinations = fares_from_origin.drop_duplicates('Destination', keep='last')
+            has_tf = index.arrives_with_band(destinations['Destination'], 'TF', route)
+            features = map_layers.destination_features(
+                origin,
+                destinations['Destination'],
+                destinations['Fare'],
+                destinations['Fare Band'],
+                np.where(has_tf, 'purple', 'blue'),
+                destinations['Lat'],
+                destinations['Long'],
+            )
+            map_layers.destination_layer(features, radius=4).add_to(layer)
+    elif destination != origin and destination != 'Any':
+        fares_to_destination = fares_from_origin[fares_from_origin['Destination'] == destination]
+        destination_marker(layer, index.coords(destination), 'green', origin, destination,
+                           fares_to_destination['Fare'].iloc[0], fares_to_destination['Fare Band'].iloc[0])
+
+    origin_marker(layer, origin, index.coords(origin))
+    return layer
+
+def bus_map(index, route_lines, ticket_types, route, origin, destination='Any', map_zoom=zoom,
+            location=map_centre, zoom_start=zoom):
+    m = base_map(location, zoom_start)
+    bus_layer(index, route_lines, ticket_types, route, origin, destination, map_zoom).add_to(m)
+    return m
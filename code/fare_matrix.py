@@ -0,0 +1,203 @@
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+import data_store
+import fare_index
+
+# Whole-network fares: the origin x destination fare of every ticket product of
+# a network, gathered from the fare index in one pass, so fares to or from any
+# hub are a slice. Bus fares are for the cheapest route between each pair.
+# Matrices are built once per version of the data files and shared by all
+# sessions. The fares around a hub can be summarised as a grid of mean fares
+# (fare_grid) or as fare isolines interpolated over a triangulation of the
+# places (isolines); scipy and shapely are imported for the first isolines.
+#
+#   python fare_matrix.py rail HUB [--to | --from] [--max-fare 3]
+
+def fare_table(index):
+    # (products, columns, fares [products, columns]) of a fare index: band-priced
+    # products on the band columns, then rail period products on one column per zone
+    bus = isinstance(index, fare_index.BusFareIndex)
+    bands = list(index.bands)
+    products = [(pm, tt) for pm, tt in index.products]
+    rows = [index.fares[index.payment_means.index(pm), index.ticket_types.index(tt)] for pm, tt in products]
+    zones = index.period_fares.shape[1] if not bus else 0
+    columns = bands + [str(zone) for zone in range(zones)]
+    fares = np.full((len(products) + (len(index.period_ticket_types) if zones else 0), len(columns)), np.nan)
+    fares[:len(products), :len(bands)] = np.array(rows).reshape(len(products), len(bands))
+    if zones:
+        fares[len(products):, len(bands):] = index.period_fares
+        products += [('Period', tt) for tt in index.period_ticket_types]
+    return products, columns, fares
+
+class FareMatrices:
+    def __init__(self, index):
+        # index is a fare_index.RailFareIndex or BusFareIndex
+        self.index = index
+        self.bus = isinstance(index, fare_index.BusFareIndex)
+        self.places = list(index.stages if self.bus else index.stations)
+        self.products, self.columns, table = fare_table(index)
+        self.product_labels = [f"{tt} ({pm})" for pm, tt in self.products]
+        self.lat, self.lon = index.lat, index.lon
+
+        # Unpriced pairs (NO_PAIR or NO_BAND) read an extra all-NaN column
+        unpriced = table.shape[1]
+        table = np.column_stack([table, np.full(len(table), np.nan)])
+        products = np.arange(len(table))[:, None, None]
+        if self.bus:
+            # Cheapest route per pair, all products at once, one route at a time
+            table = np.where(np.isnan(table), np.inf, table)
+            self.fares = np.full((len(table), len(self.places), len(self.places)), np.inf)
+            for route_bands in index.od_band:
+                columns = np.where(route_bands >= 0, route_bands, unpriced)
+                np.minimum(self.fares, table[products, columns[None]], out=self.fares)
+            self.fares[np.isinf(self.fares)] = np.nan
+        else:
+            period = np.arange(len(table)) >= len(index.products)
+            band_columns = np.where(index.od_band >= 0, index.od_band, unpriced)
+            zone_columns = np.where(index.od_zone >= 0, len(index.bands) + index.od_zone, unpriced)
+            self.fares = table[products, np.where(period[:, None, None], zone_columns[None], band_columns[None])]
+
+    def levels(self, product, n=6):
+        # Up to n round fare levels evenly spread between the lowest and highest
+        # fare of product, for colours and isolines that stay the same whatever the hub
+        fares = self.fares[self.product_labels.index(product)]
+        fares = fares[~np.isnan(fares)]
+        if not len(fares) or fares.max() == fares.min():
+            return []
+        levels = np.linspace(fares.min(), fares.max(), n + 2)[1:-1]
+        step = 10 ** np.floor(np.log10((fares.max() - fares.min()) / (n + 1)))
+        return [round(float(level), 2) for level in np.unique(np.round(levels / step) * step)]
+
+    def hubs(self):
+        # Places that can be drawn on the map
+        return [place for place, lat in zip(self.places, self.lat) if not np.isnan(lat)]
+
+    def _hub_fares(self, hub, direction):
+        # Fares of every product between each place and hub, [products, places]
+        h = self.places.index(hub)
+        return self.fares[:, :, h] if direction == 'to' else self.fares[:, h, :]
+
+    def hub_fares(self, product, hub, direction='to'):
+        # Fare of product between every place with a location and hub; direction
+        # 'to' prices journeys into the hub, 'from' journeys out of it
+        fares = self._hub_fares(hub, direction)[self.product_labels.index(product)]
+        keep = np.flatnonzero(~np.isnan(fares) & ~np.isnan(self.lat) & (np.arange(len(fares)) != self.places.index(hub)))
+        return pd.DataFrame({
+            'Place': np.asarray(self.places, dtype=object)[keep],
+            'Fare': fares[keep],
+            'lat': self.lat[keep],
+            'lon': self.lon[keep],
+        })
+
+    def hub_summary(self, hub, direction='to', max_fare=3.0):
+        # Per product: places priced to or from hub, how many of them for max_fare
+        # or less, and the median and highest fare
+        fares = pd.DataFrame(np.delete(self._hub_fares(hub, direction), self.places.index(hub), axis=1).T,
+                             columns=pd.Index(self.product_labels, name='Ticket'))
+        return pd.DataFrame({
+            'Places': fares.count(),
+            'Within': (fares <= max_fare + 1e-9).sum(),
+            'Median': fares.median(),
+            'Max': fares.max(),
+        })
+
+def fare_matrices(network):
+    # 'rail' or 'bus' matrices for the live fare data
+    live = fare_index.bus_live if network == 'bus' else fare_index.rail_live
+    return data_store.cached(('index', 'matrices', network), live.sources(), lambda: FareMatrices(live.index()))
+
+def _km(lat, lon):
+    # Local flat coordinates in km, good enough over the extent of the network
+    scale = np.cos(np.radians(np.nanmean(lat)))
+    return np.column_stack([np.asarray(lon) * 111.32 * scale, np.asarray(lat) * 110.57])
+
+def fare_grid(lat, lon, fares, cell_km=3.0):
+    # Mean fare of the places in each square grid cell that has any, with the cell's
+    # south, west, north and east edges
+    lat, lon, fares = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float), np.asarray(fares, dtype=float)
+    if not len(fares):
+        return pd.DataFrame(columns=['south', 'west', 'north', 'east', 'Fare', 'Places'])
+    lat_step = cell_km / 110.57
+    lon_step = cell_km / (111.32 * np.cos(np.radians(lat.mean())))
+    cells, cell = np.unique(np.column_stack([np.floor(lat / lat_step), np.floor(lon / lon_step)]),
+                            axis=0, return_inverse=True)
+    cell = cell.ravel()
+    counts = np.bincount(cell)
+    return pd.DataFrame({
+        'south': cells[:, 0] * lat_step,
+        'west': cells[:, 1] * lon_step,
+        'north': (cells[:, 0] + 1) * lat_step,
+        'east': (cells[:, 1] + 1) * lon_step,
+        'Fare': np.bincount(cell, weights=fares) / counts,
+        'Places': counts,
+    })
+
+def isolines(lat, lon, fares, levels, max_edge_km=25.0):
+    # {level: [[(lat, lon), ...] line, ...]} where the fare surface crosses each
+    # level, interpolated linearly over a Delaunay triangulation of the places.
+    # Triangles with an edge longer than max_edge_km (across the bay, or beyond
+    # the ends of lines) are left out
+    from scipy.spatial import Delaunay, QhullError
+    import shapely
+    lat, lon, fares = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float), np.asarray(fares, dtype=float)
+    if len(fares) < 3:
+        return {level: [] for level in levels}
+    xy = _km(lat, lon)
+    try:
+        triangles = Delaunay(xy).simplices
+    except QhullError:
+        # All places on a line
+        return {level: [] for level in levels}
+    ends = np.roll(triangles, -1, axis=1)
+    triangles = triangles[(np.linalg.norm(xy[triangles] - xy[ends], axis=2) <= max_edge_km).all(axis=1)]
+    ends = np.roll(triangles, -1, axis=1)
+    start_fares, end_fares = fares[triangles], fares[ends]
+
+    lines = {}
+    for level in levels:
+        # Edges from vertex i to i + 1 whose ends lie on either side of the level;
+        # a triangle the level passes through has exactly two
+        above = start_fares >= level
+        crossing = above != np.roll(above, -1, axis=1)
+        hit = crossing.sum(axis=1) == 2
+        with np.errstate(all='ignore'):
+            share = np.where(crossing, (level - start_fares) / (end_fares - start_fares), 0)[hit]
+        starts, stops = triangles[hit], ends[hit]
+        points = np.stack([lat[starts] + share * (lat[stops] - lat[starts]),
+                           lon[starts] + share * (lon[stops] - lon[starts])], axis=2)
+        edges = np.argsort(~crossing[hit], axis=1, kind='stable')[:, :2]
+        segments = np.take_along_axis(points, edges[:, :, None], axis=1)
+        merged = shapely.line_merge(shapely.multilinestrings(segments)) if len(segments) else None
+        lines[level] = [shapely.get_coordinates(line).tolist()
+                        for line in getattr(merged, 'geoms', [merged] if merged is not None else [])]
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fares to or from a hub across the whole network, for every ticket type.")
+    parser.add_argument('network', choices=['rail', 'bus'])
+    parser.add_argument('hub', help="station or stage name")
+    direction = parser.add_mutually_exclusive_group()
+    direction.add_argument('--to', dest='direction', action='store_const', const='to', default='to',
+                           help="journeys into the hub (default)")
+    direction.add_argument('--from', dest='direction', action='store_const', const='from', help="journeys out of the hub")
+    parser.add_argument('--max-fare', type=float, default=3.0, help="count the places within this fare")
+    args = parser.parse_args(argv)
+
+    index = fare_index.bus_fare_index() if args.network == 'bus' else fare_index.rail_fare_index()
+    start = time.perf_counter()
+    matrices = FareMatrices(index)
+    elapsed = time.perf_counter() - start
+    print(f"{len(matrices.products)} ticket types x {len(matrices.places):,} x {len(matrices.places):,} fares "
+          f"in {elapsed * 1000:.0f} ms", file=sys.stderr)
+    if args.hub not in matrices.places:
+        parser.error(f"Unknown {'stage' if matrices.bus else 'station'} {args.hub}")
+
+    summary = matrices.hub_summary(args.hub, args.direction, args.max_fare)
+    summary = summary.rename(columns={'Within': f"Within €{args.max_fare:.2f}"})
+    print(summary.to_string(float_format='€{:.2f}'.format))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import fare_index
+import fare_matrix
+
+# Revenue impact of fare changes over a demand matrix. The fares of a network
+# are one (product x fare band) table, with rail period tickets priced on extra
+# zone columns, and every demand row is a (product, column, journeys) triple, so
+# a scenario's revenue is one gather from its edited fare table. Scenarios are
+# evaluated in chunks as (scenario x demand row) arrays and summed per OD pair,
+# origin, zone and ticket type; chunks run in parallel worker processes.
+#
+# Demand CSV: Origin, Destination, PaymentMeans, TicketType, Journeys, plus
+# Route for bus, named as in ODPairs(withZones).csv / Route_OD_FareCode.
+# Rail period tickets use PaymentMeans 'Period'.
+#
+# Scenario CSV, one edit per row, applied in order within each Scenario:
+#   Scenario, Action, PaymentMeans, TicketType, FareZone, Value, Target
+#   set / add / scale   the fares matched by PaymentMeans, TicketType and FareZone
+#                       become Value, or have Value added or multiplied in
+#   merge               journeys in FareZone are priced as band Target instead
+# Blank match columns match everything and 'a|b' matches either; edits only
+# touch fares that are sold. Period fare zones are numbers (FareZone 3).
+#
+#   python fare_scenarios.py rail DEMAND.csv SCENARIOS.csv [--elasticity -0.3] [--workers N] [--out DIR]
+
+actions = ['set', 'add', 'scale', 'merge']
+
+# Scenarios evaluated together as one array operation (and one worker task)
+chunk_size = 16
+
+def _matches(values, pattern):
+    # Bool mask of values matched by an edit column: blank matches all, 'a|b' either
+    values = np.asarray(values, dtype=object).astype(str)
+    if pd.isna(pattern) or str(pattern).strip() == '':
+        return np.ones(len(values), dtype=bool)
+    wanted = [part.strip() for part in str(pattern).split('|')]
+    unknown = set(wanted) - set(values)
+    if unknown:
+        raise ValueError(f"Unknown {', '.join(sorted(unknown))} in scenario edit")
+    return np.isin(values, wanted)
+
+def read_scenarios(path):
+    # {scenario name: edits DataFrame}, in file order
+    edits = pd.read_csv(path, dtype={'PaymentMeans': str, 'TicketType': str, 'FareZone': str, 'Target': str})
+    missing = {'Scenario', 'Action'} - set(edits.columns)
+    if missing:
+        raise ValueError(f"Scenario file has no {', '.join(sorted(missing))} column")
+    for column in ['PaymentMeans', 'TicketType', 'FareZone', 'Value', 'Target']:
+        if column not in edits:
+            edits[column] = np.nan
+    edits['Action'] = edits['Action'].str.strip().str.lower()
+    unknown = set(edits['Action']) - set(actions)
+    if unknown:
+        raise ValueError(f"Unknown scenario action {', '.join(sorted(unknown))}; expected one of {', '.join(actions)}")
+    return {name: group.reset_index(drop=True) for name, group in edits.groupby('Scenario', sort=False)}
+
+class ScenarioEngine:
+    def __init__(self, index, demand):
+        # index is a fare_index.RailFareIndex or BusFareIndex; demand as described above
+        self.index = index
+        self.bus = isinstance(index, fare_index.BusFareIndex)
+        places = index.stages if self.bus else index.stations
+
+        # Fare table of band-priced products, then rail period products on zone columns
+        bands = list(index.bands)
+        products, self.columns, self.fares = fare_matrix.fare_table(index)
+        self.products = products
+        self.product_labels = [f"{tt} ({pm})" for pm, tt in products]
+
+        # Demand rows as (product, fare column) ids; rows that cannot be priced are dropped
+        required = ['Origin', 'Destination', 'PaymentMeans', 'TicketType', 'Journeys'] + (['Route'] if self.bus else [])
+        missing = set(required) - set(demand.columns)
+        if missing:
+            raise ValueError(f"Demand has no {', '.join(sorted(missing))} column")
+        origin = fare_index._codes(demand['Origin'], places)
+        destination = fare_index._codes(demand['Destination'], places)
+        product = fare_index._codes(demand['PaymentMeans'].astype(str) + '\0' + demand['TicketType'].astype(str),
+                                    [f"{pm}\0{tt}" for pm, tt in products])
+        known = (origin >= 0) & (destination >= 0) & (product >= 0)
+        if self.bus:
+            route = fare_index._codes(demand['Route'].astype(str), [str(r) for r in index.routes])
+            known &= route >= 0
+            band = np.where(known, index.od_band[np.maximum(route, 0), origin, destination], fare_index.NO_PAIR)
+            column, zone = band, band
+        else:
+            band = np.where(known, index.od_band[origin, destination], fare_index.NO_PAIR)
+            zone = np.where(known, index.od_zone[origin, destination], fare_index.NO_PAIR)
+            period = product >= len(index.products)
+            column = np.where(period, np.where(zone >= 0, len(bands) + zone, fare_index.NO_PAIR), band)
+        journeys = demand['Journeys'].to_numpy(dtype=float)
+        keep = known & (column >= 0) & (journeys > 0)
+        keep[keep] = ~np.isnan(self.fares[product[keep], column[keep]])
+        unpriced = ~keep & (journeys > 0)
+        self.dropped = int(unpriced.sum())
+        self.dropped_journeys = float(journeys[unpriced].sum())
+
+        self.origin, self.destination = origin[keep], destination[keep]
+        self.product, self.column, self.journeys = product[keep], column[keep], journeys[keep]
+        self.revenue = self.fares[self.product, self.column] * self.journeys
+
+        # Groups the changes are summed over; zones are OD zones for rail, fare bands for bus
+        self.places = list(places)
+        self.pair, pairs = pd.factorize(pd.Series(self.origin * len(places) + self.destination), sort=True)
+        self.pairs = np.stack([pairs.to_numpy() // len(places), pairs.to_numpy() % len(places)], axis=1)
+        if self.bus:
+            self.zone, zone_labels = pd.factorize(pd.Series(np.asarray(bands, dtype=object)[self.column]), sort=False)
+            self.zone_labels = [str(label) for label in zone_labels]
+        else:
+            self.zone, zone_labels = pd.factorize(pd.Series(zone[keep]), sort=True)
+            self.zone_labels = [f"Zone {label}" if label >= 0 else 'No zone' for label in zone_labels]
+
+    def scenario_tables(self, edits):
+        # (fares [products, columns], column map) with edits applied in order; a journey
+        # in column c is priced at fares[product, column_map[c]]
+        fares, column_map = self.fares.copy(), np.arange(len(self.columns))
+        for edit in edits.itertuples():
+            if edit.Action == 'merge':
+                target = self.columns.index(str(edit.Target).strip()) if str(edit.Target).strip() in self.columns else None
+                if target is None:
+                    raise ValueError(f"Unknown merge target {edit.Target!r} in scenario {edit.Scenario!r}")
+                merged = _matches(self.columns, edit.FareZone)
+                column_map[merged[column_map]] = target
+                continue
+            rows = _matches([pm for pm, _ in self.products], edit.PaymentMeans) \
+                & _matches([tt for _, tt in self.products], edit.TicketType)
+            cells = np.ix_(rows, _matches(self.columns, edit.FareZone))
+            sold = ~np.isnan(fares[cells])
+            value = float(edit.Value)
+            if edit.Action == 'set':
+                fares[cells] = np.where(sold, value, np.nan)
+            elif edit.Action == 'add':
+                fares[cells] = fares[cells] + value
+            else:
+                fares[cells] = fares[cells] * value
+        return fares, column_map
+
+    def evaluate(self, tables, elasticity=0.0):
+        # Revenue changes for a list of scenario_tables(): {'total', 'pairs', 'origins',
+        # 'zones', 'products'} arrays with one row per scenario. With an elasticity, demand
+        # moves by (new fare / fare) ** elasticity; journeys on fares no longer sold are lost
+        fares = np.stack([table for table, _ in tables])
+        column_map = np.stack([columns for _, columns in tables])
+        k = len(tables)
+        new_fares = fares[np.arange(k)[:, None], self.product[None, :], column_map[:, self.column]]
+        journeys = self.journeys
+        if elasticity:
+            ratio = new_fares / self.fares[self.product, self.column]
+            journeys = journeys * np.where(ratio > 0, ratio, 1.0) ** elasticity
+        change = np.where(np.isnan(new_fares), 0.0, new_fares * journeys) - self.revenue
+        return {
+            'total': change.sum(axis=1),
+            'pairs': _group_sums(change, self.pair, len(self.pairs)),
+            'origins': _group_sums(change, self.origin, len(self.places)),
+            'zones': _group_sums(change, self.zone, len(self.zone_labels)),
+            'products': _group_sums(change, self.product, len(self.products)),
+        }
+
+    def base(self):
+        # Current revenue per group, shaped as one scenario of evaluate()
+        revenue = self.revenue[None, :]
+        return {
+            'total': revenue.sum(axis=1),
+            'pairs': _group_sums(revenue, self.pair, len(self.pairs)),
+            'origins': _group_sums(revenue, self.origin, len(self.places)),
+            'zones': _group_sums(revenue, self.zone, len(self.zone_labels)),
+            'products': _group_sums(revenue, self.product, len(self.products)),
+        }
+
+def _group_sums(values, groups, n):
+    # float[scenarios, n]: values [scenarios, rows] summed by group id, all scenarios in one bincount
+    k = len(values)
+    keys = (np.arange(k)[:, None] * n + groups[None, :]).ravel()
+    return np.bincount(keys, weights=values.ravel(), minlength=k * n).reshape(k, n)
+
+# Worker processes keep the engine from the pool initializer and are sent only fare tables
+_worker_engine = None
+
+def _init_worker(engine):
+    global _worker_engine
+    _worker_engine = engine
+
+def _evaluate_chunk(job):
+    tables, elasticity = job
+    return _worker_engine.evaluate(tables, elasticity)
+
+class Sweep:
+    # Revenue changes of many scenarios: one row per scenario in totals, and
+    # scenario x group frames for pairs, origins, zones and ticket products
+    def __init__(self, engine, names, results):
+        self.engine = engine
+        self.names = names
+        merged = {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+        base = engine.base()
+        self.base = base
+        self.totals = pd.DataFrame({
+            'Revenue': base['total'][0],
+            'Change': merged['total'],
+            'New Revenue': base['total'][0] + merged['total'],
+            '%': merged['total'] / base['total'][0] * 100 if base['total'][0] else np.nan,
+        }, index=pd.Index(names, name='Scenario'))
+        places = np.asarray(engine.places, dtype=object)
+        pair_labels = pd.MultiIndex.from_arrays([places[engine.pairs[:, 0]], places[engine.pairs[:, 1]]],
+                                                names=['Origin', 'Destination'])
+        index = pd.Index(names, name='Scenario')
+        self.pairs = pd.DataFrame(merged['pairs'], index=index, columns=pair_labels)
+        self.origins = pd.DataFrame(merged['origins'], index=index, columns=pd.Index(engine.places, name='Origin'))
+        self.zones = pd.DataFrame(merged['zones'], index=index, columns=pd.Index(engine.zone_labels, name='Zone'))
+        self.products = pd.DataFrame(merged['products'], index=index,
+                                     columns=pd.Index(engine.product_labels, name='Ticket'))
+
+    def origin_impact(self, scenario):
+        # Revenue change per origin with a location on the map, for the impact map
+        index = self.engine.index
+        base = self.base['origins'][0]
+        change = self.origins.loc[scenario].to_numpy()
+        keep = np.flatnonzero((base > 0) & ~np.isnan(index.lat))
+        return pd.DataFrame({
+            'Origin': np.asarray(self.engine.places, dtype=object)[keep],
+            'Revenue': base[keep],
+            'Change': change[keep],
+            '%': change[keep] / base[keep] * 100,
+            'lat': index.lat[keep],
+            'lon': index.lon[keep],
+        })
+
+def sweep(engine, scenarios, elasticity=0.0, workers=1):
+    # Sweep of {name: edits} scenarios; workers > 1 evaluates chunks in that many
+    # processes (None for one per CPU)
+    names = list(scenarios)
+    tables = [engine.scenario_tables(scenarios[name]) for name in names]
+    jobs = [(tables[i:i + chunk_size], elasticity) for i in range(0, len(tables), chunk_size)]
+    if workers == 1 or len(jobs) <= 1:
+        results = [engine.evaluate(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,)) as executor:
+            results = list(executor.map(_evaluate_chunk, jobs))
+    if not results:
+        raise ValueError("No scenarios to evaluate")
+    return Sweep(engine, names, results)
+
+def scenario_engine(network, demand):
+    index = fare_index.bus_fare_index() if network == 'bus' else fare_index.rail_fare_index()
+    return ScenarioEngine(index, demand)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revenue impact of fare change scenarios over a demand matrix.")
+    parser.add_argument('network', choices=['rail', 'bus'])
+    parser.add_argument('demand', help="demand CSV: Origin, Destination, [Route,] PaymentMeans, TicketType, Journeys")
+    parser.add_argument('scenarios', help="scenario CSV: Scenario, Action, PaymentMeans, TicketType, FareZone, Value, Target")
+    parser.add_argument('--elasticity', type=float, default=0.0, help="fare elasticity of demand (0 = fixed demand)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--out', help="write totals, origins, zones, products and pairs CSVs to this directory")
+    args = parser.parse_args(argv)
+
+    engine = scenario_engine(args.network, pd.read_csv(args.demand))
+    if engine.dropped:
+        print(f"Skipped {engine.dropped:,} demand rows ({engine.dropped_journeys:,.0f} journeys) "
+              f"that are not priced in the fare tables", file=sys.stderr)
+    scenarios = read_scenarios(args.scenarios)
+    start = time.perf_counter()
+    result = sweep(engine, scenarios, args.elasticity, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{len(scenarios)} scenarios x {len(engine.journeys):,} demand rows in {elapsed:.2f}s", file=sys.stderr)
+
+    print(result.totals.to_string(float_format='{:,.2f}'.format))
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for name in ['totals', 'origins', 'zones', 'products']:
+            getattr(result, name).to_csv(os.path.join(args.out, f'{name}.csv'))
+        result.pairs.T.to_csv(os.path.join(args.out, 'pairs.csv'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+import data_store
+import fare_index
+import ticket_optimizer
+
+# Cheapest-fare journeys across bus and rail. Rail stations and bus stages are
+# nodes of one directed graph; every priced OD pair is an edge costing the
+# cheapest single ticket for the passenger type (the cheapest route for bus),
+# and stages within walking distance of a station are linked both ways at no
+# fare. One Dijkstra run over the sparse graph prices every destination from
+# an origin, with each journey a chain of separately bought tickets.
+# Graphs are built once per passenger type and version of the data files;
+# scipy and shapely are imported when the first one is built.
+# Run `python journey_planner.py` for search timings.
+
+default_walk_metres = 500
+
+# Tiny extra cost per leg so that, between equal fares, the journey with fewer
+# legs and shorter walks wins; far below a cent over any realistic journey
+leg_penalty = 1e-5
+
+RAIL, BUS, WALK = 0, 1, 2
+leg_modes = ['Rail', 'Bus', 'Walk']
+
+def node_label(mode, name):
+    return f"{name} ({mode})"
+
+def _single_fares(index, fare_types, passenger_type_of):
+    # Cheapest single fare per band over the products open to the passenger
+    rows = [index.fares[index.payment_means.index(pm), index.ticket_types.index(tt)]
+            for pm, tt in index.products if passenger_type_of(tt) in fare_types]
+    rows = np.array(rows).reshape(len(rows), len(index.bands))
+    filled = np.where(np.isnan(rows), np.inf, rows).min(axis=0, initial=np.inf)
+    return np.where(np.isfinite(filled), filled, np.nan)
+
+def _rail_single_passenger(ticket_type):
+    # Passenger type of a rail single, None for other tickets
+    passenger, kind = ticket_optimizer.ticket_kind(ticket_type)
+    return passenger if kind == 'Single' else None
+
+def _walk_links(rail_index, bus_index, walk_metres):
+    # (station id, stage id, metres) for every stage within walk_metres of a station
+    import shapely
+    import spatial
+    stations = np.flatnonzero(~np.isnan(rail_index.lat))
+    stages = np.flatnonzero(~np.isnan(bus_index.lat))
+    station_points = shapely.points(*spatial.project(rail_index.lat[stations], rail_index.lon[stations]))
+    stage_points = shapely.points(*spatial.project(bus_index.lat[stages], bus_index.lon[stages]))
+    stage, station = shapely.STRtree(station_points).query(stage_points, predicate='dwithin', distance=walk_metres)
+    metres = shapely.distance(stage_points[stage], station_points[station])
+    return stations[station], stages[stage], metres
+
+class JourneyPlanner:
+    def __init__(self, rail_index, bus_index, passenger_type, walk_metres=default_walk_metres):
+        from scipy.sparse import csr_array
+        self.passenger_type = passenger_type
+        self.walk_metres = walk_metres
+        n_rail, n_bus = len(rail_index.stations), len(bus_index.stages)
+
+        # Nodes: rail stations, then bus stages
+        self.names = np.array(list(rail_index.stations) + list(bus_index.stages), dtype=object)
+        self.modes = np.repeat([RAIL, BUS], [n_rail, n_bus])
+        self.labels = [node_label(leg_modes[mode], name) for mode, name in zip(self.modes, self.names)]
+        self.node_ids = {label: i for i, label in enumerate(self.labels)}
+        self.lat = np.concatenate([rail_index.lat, bus_index.lat])
+        self.lon = np.concatenate([rail_index.lon, bus_index.lon])
+
+        # Rail edges: every priced OD pair at the cheapest single
+        rail_fares = _single_fares(rail_index, ticket_optimizer.rail_passenger_types[passenger_type],
+                                   _rail_single_passenger)
+        rail_o, rail_d = np.nonzero(rail_index.od_band >= 0)
+        rail_bands = rail_index.od_band[rail_o, rail_d].astype(np.int64)
+        rail_edge_fares = rail_fares[rail_bands]
+
+        # Bus edges: the cheapest route for each OD pair, at the cheapest single
+        single_types = [tt for tt in fare_index.bus_passenger_ticket_types[passenger_type] if 'Return' not in tt]
+        bus_fares = _single_fares(bus_index, single_types, lambda tt: tt)
+        best_fare = np.full((n_bus, n_bus), np.inf)
+        best_route = np.full((n_bus, n_bus), -1, dtype=np.int64)
+        for r in range(len(bus_index.routes)):
+            bands = bus_index.od_band[r].astype(np.int64)
+            fares = np.where(bands >= 0, bus_fares[np.where(bands >= 0, bands, 0)], np.nan)
+            cheaper = fares < best_fare
+            best_fare[cheaper], best_route[cheaper] = fares[cheaper], r
+        bus_o, bus_d = np.nonzero(np.isfinite(best_fare))
+
+        station, stage, metres = _walk_links(rail_index, bus_index, walk_metres)
+
+        # Edge table; 'detail' is the rail fare band or bus route of the leg
+        keep_rail = ~np.isnan(rail_edge_fares) & (rail_o != rail_d)
+        keep_bus = bus_o != bus_d
+        self.edges = pd.DataFrame({
+            'source': np.concatenate([rail_o[keep_rail], n_rail + bus_o[keep_bus], station, n_rail + stage]),
+            'target': np.concatenate([rail_d[keep_rail], n_rail + bus_d[keep_bus], n_rail + stage, station]),
+            'mode': np.repeat([RAIL, BUS, WALK], [keep_rail.sum(), keep_bus.sum(), 2 * len(station)]),
+            'fare': np.concatenate([rail_edge_fares[keep_rail], best_fare[bus_o, bus_d][keep_bus],
+                                    np.zeros(2 * len(station))]),
+            'metres': np.concatenate([np.full(keep_rail.sum() + keep_bus.sum(), np.nan), metres, metres]),
+            'detail': np.concatenate([
+                np.asarray(rail_index.bands, dtype=object)[rail_bands[keep_rail]],
+                np.asarray(bus_index.routes, dtype=object)[best_route[bus_o, bus_d][keep_bus]],
+                np.full(2 * len(station), '', dtype=object),
+            ]),
+        })
+
+        walk_share = np.nan_to_num(self.edges['metres'].to_numpy() / walk_metres)
+        weights = self.edges['fare'].to_numpy() + leg_penalty * (1 + walk_share)
+        source, target = self.edges['source'].to_numpy(), self.edges['target'].to_numpy()
+        n = len(self.names)
+        self.graph = csr_array((weights, (source, target)), shape=(n, n))
+        # Edge rows sorted by (source, target), to recover the legs a search took
+        self._edge_keys = source * n + target
+        self._edge_order = np.argsort(self._edge_keys)
+        self._edge_keys = self._edge_keys[self._edge_order]
+
+    def _edge(self, source, target):
+        # Edge rows for arrays of (source, target) nodes joined by an edge
+        keys = np.asarray(source, dtype=np.int64) * len(self.names) + target
+        return self._edge_order[np.searchsorted(self._edge_keys, keys)]
+
+    def search(self, origin):
+        # (total fare, paid legs, predecessor node) to every node from the origin label;
+        # NaN fare and -1 predecessor where unreachable
+        from scipy.sparse.csgraph import dijkstra
+        o = self.node_ids[origin]
+        _, predecessors = dijkstra(self.graph, directed=True, indices=o, return_predecessors=True)
+        reached = predecessors >= 0
+        edge = np.zeros(len(predecessors), dtype=np.int64)
+        edge[reached] = self._edge(predecessors[reached], np.flatnonzero(reached))
+        leg_fare = np.where(reached, self.edges['fare'].to_numpy()[edge], 0.0)
+        leg_paid = reached & (self.edges['mode'].to_numpy()[edge] != WALK)
+
+        # Sum the legs back along the shortest-path tree, one level per step
+        fare, legs, up = leg_fare.copy(), leg_paid.astype(np.int64), predecessors.copy()
+        while (up >= 0).any():
+            step = up >= 0
+            fare[step] += leg_fare[up[step]]
+            legs[step] += leg_paid[up[step]]
+            up[step] = predecessors[up[step]]
+        fare[~reached] = np.nan
+        fare[o] = 0.0
+        return fare, legs, predecessors
+
+    def fares_from(self, origin):
+        # Cheapest journey to every reachable node with coordinates
+        fare, legs, _ = self.search(origin)
+        o = self.node_ids[origin]
+        keep = np.flatnonzero(~np.isnan(fare) & ~np.isnan(self.lat) & (np.arange(len(fare)) != o))
+        return pd.DataFrame({
+            'Origin': origin,
+            'Destination': np.asarray(self.labels, dtype=object)[keep],
+            'Mode': np.asarray(leg_modes, dtype=object)[self.modes[keep]],
+            'Fare': fare[keep],
+            'Tickets': legs[keep],
+            'lat': self.lat[keep],
+            'lon': self.lon[keep],
+        })
+
+    def journey(self, origin, destination):
+        # Legs of the cheapest journey, in travel order; empty if unreachable
+        _, _, predecessors = self.search(origin)
+        node, path = self.node_ids[destination], []
+        while predecessors[node] >= 0:
+            path.append(self._edge(predecessors[node], node))
+            node = predecessors[node]
+        legs = self.edges.iloc[path[::-1]]
+        return pd.DataFrame({
+            'From': np.asarray(self.labels, dtype=object)[legs['source']],
+            'To': np.asarray(self.labels, dtype=object)[legs['target']],
+            'Mode': np.asarray(leg_modes, dtype=object)[legs['mode']],
+            'Detail': legs['detail'].to_numpy(),
+            'Fare': legs['fare'].to_numpy(),
+            'Metres': legs['metres'].to_numpy(),
+        })
+
+    def coords(self, label):
+        i = self.node_ids.get(label)
+        if i is None or np.isnan(self.lat[i]):
+            return None
+        return [self.lat[i], self.lon[i]]
+
+def journey_planner(passenger_type):
+    # Built once per passenger type and version of the rail and bus data, shared by all sessions
+    paths = [data_store.rail_od_path, data_store.rail_fares_path, data_store.bus_od_path, data_store.bus_fares_path,
+             data_store.bus_stage_coords_path] + data_store.shapefile_paths(data_store.rail_stations_path)
+    return data_store.cached(('index', 'journey', passenger_type), paths, lambda: JourneyPlanner(
+        fare_index.rail_fare_index(), fare_index.bus_fare_index(), passenger_type))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time cheapest-fare bus + rail searches from every origin.")
+    parser.add_argument('--passenger', choices=list(ticket_optimizer.rail_passenger_types), default='Adult')
+    parser.add_argument('--walk', type=float, default=default_walk_metres, help="walking transfer distance in metres")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    planner = JourneyPlanner(fare_index.rail_fare_index(), fare_index.bus_fare_index(), args.passenger, args.walk)
+    print(f"Built graph of {len(planner.labels):,} nodes and {len(planner.edges):,} edges "
+          f"({(planner.edges['mode'] == WALK).sum() // 2} walking links) in {time.perf_counter() - start:.2f}s",
+          file=sys.stderr)
+
+    times = []
+    for origin in planner.labels:
+        start = time.perf_counter()
+        planner.search(origin)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    print(f"Single-source search over {len(times)} origins: p50 {np.median(times):.2f}ms, "
+          f"p95 {np.percentile(times, 95):.2f}ms, max {times.max():.2f}ms", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
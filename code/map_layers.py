@@ -0,0 +1,102 @@
+import json
+import numpy as np
+import folium
+from folium.plugins import VectorGridProtobuf
+from folium.template import Template
+
+# Map layers built from whole columns at once rather than one folium object per row
+
+tooltip_fields = ['Origin', 'Destination', 'Fare', 'Fare Zone']
+
+def destination_features(origins, destinations, fares, fare_zones, colours, lats, lons):
+    # GeoJSON FeatureCollection with one point per destination; all properties
+    # are formatted column-wise before the features are assembled
+    fare_text = np.char.add('€', np.char.mod('%.2f', np.asarray(fares, dtype=float)))
+    columns = zip(np.broadcast_to(np.asarray(origins, dtype=object), len(fare_text)),
+                  np.asarray(destinations, dtype=object), fare_text.tolist(),
+                  np.asarray(fare_zones).astype(str).tolist(), np.asarray(colours, dtype=object),
+                  np.asarray(lons, dtype=float).tolist(), np.asarray(lats, dtype=float).tolist())
+    features = [
+        {
+            'type': 'Feature',
+            'id': i,
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {'Origin': origin, 'Destination': destination, 'Fare': fare,
+                           'Fare Zone': fare_zone, 'colour': colour},
+        }
+        for i, (origin, destination, fare, fare_zone, colour, lon, lat) in enumerate(columns)
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def destination_layer(features, radius=6, name=None, aliases=None):
+    # Single GeoJson layer of circle markers, coloured and tooltipped from feature properties;
+    # aliases relabels the tooltip fields
+    aliases = aliases or [f"{field}:" for field in tooltip_fields]
+    return folium.GeoJson(
+        features,
+        name=name,
+        marker=folium.CircleMarker(radius=radius),
+        style_function=lambda x: {
+            'color': '#4e4e4e',
+            'opacity': 0.6,
+            'weight': 1,
+            'fillColor': x['properties']['colour'],
+            'fillOpacity': 1,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=tooltip_fields, aliases=aliases),
+    )
+
+def cell_features(south, west, north, east, colours, properties):
+    # GeoJSON FeatureCollection of grid cells; properties is {name: column} of
+    # values already formatted for the tooltip
+    columns = zip(*(np.asarray(column, dtype=float).tolist() for column in (south, west, north, east)),
+                  np.asarray(colours, dtype=object), *(np.asarray(column, dtype=object) for column in properties.values()))
+    features = [
+        {
+            'type': 'Feature',
+            'id': i,
+            'geometry': {'type': 'Polygon', 'coordinates': [[[w, s], [e, s], [e, n], [w, n], [w, s]]]},
+            'properties': dict(zip(properties, values), colour=colour),
+        }
+        for i, (s, w, n, e, colour, *values) in enumerate(columns)
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def cell_layer(features, fields, aliases):
+    # Single GeoJson layer of grid cells filled with their 'colour' property
+    return folium.GeoJson(
+        features,
+        style_function=lambda x: {
+            'color': x['properties']['colour'],
+            'weight': 0.5,
+            'fillColor': x['properties']['colour'],
+            'fillOpacity': 0.6,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=fields, aliases=aliases),
+    )
+
+class VectorTiles(VectorGridProtobuf):
+    # Vector tile layer (see vector_tiles.py) drawing only the tile layers in
+    # styles, {tile layer: JavaScript style function of the feature properties}
+    # returning a Leaflet path style or [] to hide the feature. tooltip is a
+    # JavaScript expression of the hovered feature's properties
+    _template = Template("""
+        {% macro script(this, kwargs) -%}
+        var {{ this.get_name() }} = L.vectorGrid.protobuf('{{ this.url }}', {{ this.options }});
+        {%- if this.tooltip %}
+        {{ this.get_name() }}.bindTooltip(function(feature) {
+            var properties = feature.properties;
+            return {{ this.tooltip }};
+        }, {sticky: true});
+        {%- endif %}
+        {%- endmacro %}
+    """)
+
+    def __init__(self, url, styles, tile_layers, min_zoom, max_zoom, tooltip=None):
+        hidden = 'function(properties) { return []; }'
+        layer_styles = ',\n'.join(f'{json.dumps(name)}: {styles.get(name, hidden)}' for name in tile_layers)
+        options = (f'{{rendererFactory: L.canvas.tile, interactive: {json.dumps(tooltip is not None)}, '
+                   f'minNativeZoom: {min_zoom}, maxNativeZoom: {max_zoom}, '
+                   f'vectorTileLayerStyles: {{\n{layer_styles}\n}}}}')
+        super().__init__(url, options=options, control=False)
+        self.tooltip = tooltip
@@ -0,0 +1,241 @@
+import collections
+import importlib.metadata
+import os
+import threading
+import warnings
+import folium
+import streamlit as st
+import streamlit_folium
+from folium.elements import JSCSSMixin
+import timing
+
+# Process-wide LRU cache of serialized maps, shared by all sessions.
+# st_folium() turns the base map and the selection layer into JavaScript on
+# every rerun; here that output is kept as plain strings, keyed on the view and
+# selection, and handed straight to the st_folium component on a hit, so a
+# popular selection is served without building or rendering any folium objects.
+# Only the first render of a map sends the base map to the browser; after that
+# a rerun sends just the selection layer.
+# Entries are bounded by a byte budget (FARECALC_RENDER_CACHE_MB, default 64)
+# with least-recently-used eviction. Each view's entries carry the version of
+# its data files and are all dropped when that version changes.
+#
+# map_payload(), layer_payload() and st_folium() repeat what
+# streamlit_folium.st_folium() does, using its private helpers, so they are tied
+# to the streamlit_folium version pinned in requirements.txt. With any other
+# version, or without those helpers, they fall back to the public
+# streamlit_folium.st_folium(): the payloads are the folium objects themselves,
+# built on every rerun and never stored in the shared cache.
+
+streamlit_folium_version = '0.27.4'
+_private_helpers = ['_get_html', '_get_header', '_get_map_string', '_get_feature_group_string',
+                    '_component_func', 'generate_js_hash', 'get_full_id']
+
+def _compatible():
+    # Whether the installed streamlit_folium has the private helpers the payloads are built with
+    installed = importlib.metadata.version('streamlit_folium')
+    missing = [name for name in _private_helpers if not hasattr(streamlit_folium, name)]
+    if installed == streamlit_folium_version and not missing:
+        return True
+    reason = f"missing {', '.join(missing)}" if missing else f"{installed} is installed"
+    warnings.warn(f"render_cache is written against streamlit_folium {streamlit_folium_version} ({reason}); "
+                  f"maps are drawn with streamlit_folium.st_folium and not cached")
+    return False
+
+compatible = _compatible()
+
+default_max_bytes = int(float(os.environ.get('FARECALC_RENDER_CACHE_MB', 64)) * 2**20)
+
+def _size(value):
+    # Approximate bytes held by a payload of nested strings, lists and dicts
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, dict):
+        return sum(_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    return 8
+
+class RenderCache:
+    def __init__(self, max_bytes=default_max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()   # key -> (value, bytes), oldest first
+        self._versions = {}                         # view -> data version of its entries
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get_or_render(self, key, version, render):
+        # render() for key, a tuple starting with the view name, reusing the stored
+        # value while the view's data version is unchanged
+        view = key[0]
+        with self._lock:
+            self._invalidate(view, version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                timing.annotate(render_cache='hit')
+                return entry[0]
+
+        with timing.span('render'):
+            value = render()
+        size = _size(value)
+
+        with self._lock:
+            self._stats['misses'] += 1
+            timing.annotate(render_cache='miss')
+            self._invalidate(view, version)
+            if size <= self.max_bytes:
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)[1]
+                self._entries[key] = (value, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= evicted
+                    self._stats['evictions'] += 1
+        return value
+
+    def _invalidate(self, view, version):
+        # Drop the view's entries when its data version changes; caller holds the lock
+        if self._versions.get(view, version) != version:
+            for key in [key for key in self._entries if key[0] == view]:
+                self._bytes -= self._entries.pop(key)[1]
+                self._stats['invalidations'] += 1
+        self._versions[view] = version
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+            for key in self._stats:
+                self._stats[key] = 0
+
+# Nothing fits in a zero budget, so without the private helpers every map is built afresh
+shared = RenderCache() if compatible else RenderCache(max_bytes=0)
+
+def _links(element):
+    # CSS and JS links of element and its descendants, in tree order
+    css, js = [], []
+    if isinstance(element, JSCSSMixin):
+        css.extend(href for _, href in getattr(element, 'default_css', []))
+        js.extend(src for _, src in getattr(element, 'default_js', []))
+    for child in element._children.values():
+        child_css, child_js = _links(child)
+        css.extend(child_css)
+        js.extend(child_js)
+    return css, js
+
+def map_payload(m):
+    # What st_folium() sends to the browser for the base map m; rendered twice as st_folium() does
+    if not compatible:
+        return {'map': m}
+    m.get_root().render()
+    m.render()
+    html = streamlit_folium._get_html(m)
+    header = streamlit_folium._get_header(m)
+    css, js = _links(m)
+    southwest, northeast = m.get_bounds()
+    return {
+        'script': streamlit_folium._get_map_string(m),
+        'header': header,
+        'html': html,
+        'id': streamlit_folium.get_full_id(m),
+        'bounds': {'_southWest': {'lat': southwest[0], 'lng': southwest[1]},
+                   '_northEast': {'lat': northeast[0], 'lng': northeast[1]}},
+        'zoom': m.options.get('zoom'),
+        'css_links': css,
+        'js_links': js,
+    }
+
+def layer_payload(layer):
+    # What st_folium() sends to the browser for a feature_group_to_add layer.
+    # The layer is serialized against a stand-in map; its script only refers to
+    # the map as map_div
+    if not compatible:
+        return {'layer': layer}
+    css, js = _links(layer)
+    return {
+        'script': streamlit_folium._get_feature_group_string(layer, folium.Map(tiles=None)),
+        'css_links': css,
+        'js_links': js,
+    }
+
+def st_folium(base, layer, key, width=500, height=700, returned_objects=None, zoom=None, center=None):
+    # streamlit_folium.st_folium(m, feature_group_to_add=layer, ...) for payloads from
+    # map_payload() and layer_payload()
+    if not compatible:
+        return streamlit_folium.st_folium(base['map'], key=key, height=height, width=width,
+                                          returned_objects=returned_objects, zoom=zoom, center=center,
+                                          feature_group_to_add=layer['layer'])
+    defaults = {
+        'last_clicked': None,
+        'last_object_clicked': None,
+        'last_object_clicked_count': None,
+        'last_object_clicked_tooltip': None,
+        'last_object_clicked_popup': None,
+        'all_drawings': None,
+        'last_active_drawing': None,
+        'bounds': base['bounds'],
+        'zoom': base['zoom'],
+        'last_circle_radius': None,
+        'last_circle_polygon': None,
+        'selected_layers': None,
+        'selected_tags': None,
+        'last_geocoder_result': None,
+    }
+    defaults = {k: v for k, v in defaults.items() if returned_objects is None or k in returned_objects}
+    hash_key = streamlit_folium.generate_js_hash(base['script'], key, False)
+
+    # Once the component shows this base map, the browser keeps it and only reads
+    # the layer, so the map's script, html and links go with the first render only.
+    # The component's widget state is there from its first render until a rerun
+    # that does not draw it (another view), after which the base map is sent again
+    mounted = hash_key in st.session_state
+    base_args = _base_args(base, layer, mounted)
+
+    def on_change():
+        if key is not None:
+            st.session_state[key] = st.session_state.get(hash_key, {})
+
+    return streamlit_folium._component_func(
+        id=base['id'],
+        key=hash_key,
+        height=height,
+        width=width,
+        returned_objects=returned_objects,
+        default=defaults,
+        zoom=zoom,
+        center=center,
+        feature_group=layer['script'],
+        return_on_hover=False,
+        layer_control=None,
+        pixelated=False,
+        on_change=on_change,
+        wrap_longitude=False,
+        **base_args,
+    )
+
+def _base_args(base, layer, mounted=False):
+    # The base map's component arguments; empty once the browser has the map
+    if mounted:
+        return {'script': '', 'header': '', 'html': '', 'css_links': [], 'js_links': []}
+    return {
+        'script': base['script'],
+        'header': base['header'],
+        'html': base['html'],
+        'css_links': list(dict.fromkeys(base['css_links'] + layer['css_links'])),
+        'js_links': list(dict.fromkeys(base['js_links'] + layer['js_links'])),
+    }
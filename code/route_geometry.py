@@ -0,0 +1,120 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import data_store
+import fare_bundle
+
+# Bus route geometry pre-simplified for a set of zoom levels.
+# Each route is stored per level as ready-to-send [[lat, lon], ...] line lists,
+# simplified to about half a screen pixel at that zoom. The dashboard picks the
+# coarsest level that is still exact enough for the current zoom.
+# Run `python route_geometry.py` for a per-route size report.
+
+zoom_levels = [7, 9, 11, 13, 15]
+full_resolution = None
+
+def tolerance(zoom):
+    # Half a 256px web-mercator tile pixel at zoom, in degrees
+    return 360 / (256 * 2 ** zoom) / 2
+
+def level_for_zoom(zoom):
+    for level in zoom_levels:
+        if zoom is not None and zoom <= level:
+            return level
+    return full_resolution
+
+def _lines(geometry, decimals):
+    import shapely
+    parts = getattr(geometry, 'geoms', [geometry])
+    return [np.round(shapely.get_coordinates(part)[:, ::-1], decimals).tolist() for part in parts]
+
+def _level_name(level):
+    return 'full' if level is full_resolution else str(level)
+
+class RouteGeometryCache:
+    def __init__(self, routes_gdf):
+        # Built from the shapefile; a cache restored from a fare bundle never needs shapely
+        import shapely
+        self._packed = None
+        self.levels = {}
+        records = []
+        shapes = routes_gdf.groupby('route_name', sort=False).geometry
+        for level in zoom_levels + [full_resolution]:
+            routes = {}
+            for route, geometries in shapes:
+                if level is not full_resolution:
+                    geometries = shapely.simplify(geometries.to_numpy(), tolerance(level), preserve_topology=False)
+                lines = [line for geometry in geometries for line in _lines(geometry, 5 if level else 6)]
+                routes[route] = lines
+                records.append({
+                    'route_name': route,
+                    'level': 'full' if level is full_resolution else level,
+                    'vertices': sum(len(line) for line in lines),
+                    'bytes': len(json.dumps(lines)),
+                })
+            self.levels[level] = routes
+        self.stats = pd.DataFrame(records, columns=['route_name', 'level', 'vertices', 'bytes'])
+
+    def to_arrays(self):
+        # Per level: all vertices as one float array, with the end of each line
+        # and of each route's lines as cumulative counts
+        route_names = list(self.levels[full_resolution])
+        arrays = {'route_names': route_names, 'stats': self.stats.to_dict('records')}
+        for level, routes in self.levels.items():
+            lines = [line for route in route_names for line in routes[route]]
+            name = _level_name(level)
+            arrays[f'{name}/coords'] = np.array([point for line in lines for point in line], dtype=float).reshape(-1, 2)
+            arrays[f'{name}/line_ends'] = np.cumsum([len(line) for line in lines], dtype=np.int64)
+            arrays[f'{name}/route_ends'] = np.cumsum([len(routes[route]) for route in route_names], dtype=np.int64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # Restore from to_arrays(); each route's lines are unpacked on first use
+        cache = cls.__new__(cls)
+        cache.stats = pd.DataFrame(arrays['stats'])
+        cache.levels = {level: {} for level in zoom_levels + [full_resolution]}
+        cache._route_ids = {route: i for i, route in enumerate(arrays['route_names'])}
+        cache._packed = arrays
+        return cache
+
+    def _unpack(self, level, route):
+        name = _level_name(level)
+        i = self._route_ids[route]
+        line_ends = self._packed[f'{name}/line_ends']
+        route_ends = self._packed[f'{name}/route_ends']
+        first_line = route_ends[i - 1] if i else 0
+        ends = line_ends[first_line:route_ends[i]]
+        start = line_ends[first_line - 1] if first_line else 0
+        coords = self._packed[f'{name}/coords']
+        return [coords[a:b].tolist() for a, b in zip(np.concatenate([[start], ends[:-1]]), ends)]
+
+    def lines(self, route, zoom=None):
+        # [[lat, lon], ...] lines for route at the level suited to zoom
+        level = level_for_zoom(zoom)
+        routes = self.levels[level]
+        if route not in routes and self._packed is not None and route in self._route_ids:
+            routes[route] = self._unpack(level, route)
+        return routes.get(route, [])
+
+    def report(self):
+        # Vertex count and serialized size per route, full resolution vs each level
+        table = self.stats.pivot(index='route_name', columns='level', values=['vertices', 'bytes'])
+        return table.reindex(columns=[*zoom_levels, 'full'], level=1)
+
+def route_geometry_cache():
+    # No route lines at all when the routes shapefile is missing
+    if not os.path.exists(data_store.bus_routes_path):
+        return RouteGeometryCache(pd.DataFrame({'route_name': [], 'geometry': []}))
+    bundle = fare_bundle.load()
+    if bundle is not None and 'routes/route_names' in bundle:
+        return bundle.memo('routes', lambda: RouteGeometryCache.from_arrays(bundle.section('routes')))
+    return data_store.cached(('geometry', 'bus_routes'), data_store.shapefile_paths(data_store.bus_routes_path),
+                             lambda: RouteGeometryCache(data_store.bus_routes()))
+
+if __name__ == '__main__':
+    cache = route_geometry_cache()
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(cache.report())
+        print(cache.stats.groupby('level', sort=False)[['vertices', 'bytes']].sum())
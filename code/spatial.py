@@ -0,0 +1,134 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+import data_store
+import fare_index
+
+# Spatial lookups on the zone boundaries, rail stations and bus stages.
+# Everything is projected to Irish Transverse Mercator so distances are in
+# metres. Zones are classified with an STRtree over the boundary polygons and
+# nearest stops with an STRtree over the stop points; both take whole arrays.
+# Run `python spatial.py` for timings on random points.
+
+projected_crs = 'EPSG:2157'
+NO_ZONE = 0
+
+# The boundaries nest city < 33km < 43km < commuter (checked in
+# tests/test_spatial.py); a point's fare zone is the innermost boundary it falls in (Zone 1-4 on the map), NO_ZONE outside them all
+fare_zones = {'city': 1, '33km': 2, '43km': 3, 'commuter': 4}
+
+_to_projected = Transformer.from_crs('EPSG:4326', projected_crs, always_xy=True)
+
+def project(lat, lon):
+    x, y = _to_projected.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    return np.asarray(x), np.asarray(y)
+
+class StopTree:
+    # Nearest-stop lookups over named points; stops without coordinates are left out
+    def __init__(self, names, lat, lon):
+        keep = ~(np.isnan(lat) | np.isnan(lon))
+        self.names = np.asarray(names, dtype=object)[keep]
+        self.tree = shapely.STRtree(shapely.points(*project(lat[keep], lon[keep])))
+
+    def nearest(self, lat, lon):
+        # (names, distances in metres) for arrays of points
+        points = shapely.points(*project(np.atleast_1d(lat), np.atleast_1d(lon)))
+        (i, j), distance = self.tree.query_nearest(points, return_distance=True, all_matches=False)
+        names = np.empty(len(points), dtype=object)
+        distances = np.full(len(points), np.nan)
+        names[i], distances[i] = self.names[j], distance
+        return names, distances
+
+class SpatialIndex:
+    def __init__(self, zone_layers, rail_index, bus_index):
+        polygons, polygon_zones = [], []
+        for name, layer in zone_layers.items():
+            geometries = layer.to_crs(projected_crs).geometry.to_numpy()
+            polygons.extend(geometries)
+            polygon_zones.extend([name] * len(geometries))
+        self.zones = list(zone_layers)
+        self.zone_tree = shapely.STRtree(polygons)
+        self.polygon_zone = np.array([self.zones.index(name) for name in polygon_zones])
+        self.zone_numbers = np.array([fare_zones.get(name, NO_ZONE) for name in self.zones])
+
+        self.stations = StopTree(rail_index.origins, *_coords(rail_index, rail_index.station_ids, rail_index.origins))
+        self.bus_index = bus_index
+        self._stage_trees = {}
+        self._stage_trees_lock = threading.Lock()
+
+    def zone_membership(self, lat, lon):
+        # bool[n, zones]: whether each point lies in each boundary layer
+        x, y = project(np.atleast_1d(lat), np.atleast_1d(lon))
+        points, polygons = self.zone_tree.query(shapely.points(x, y), predicate='intersects')
+        membership = np.zeros((len(x), len(self.zones)), dtype=bool)
+        membership[points, self.polygon_zone[polygons]] = True
+        return membership
+
+    def classify(self, lat, lon):
+        # Fare zone and boundary membership for arrays of WGS84 coordinates
+        membership = self.zone_membership(lat, lon)
+        numbers = np.where(membership & (self.zone_numbers > 0), self.zone_numbers, np.iinfo(np.int16).max)
+        zone = numbers.min(axis=1, initial=np.iinfo(np.int16).max)
+        result = pd.DataFrame(membership, columns=self.zones)
+        result.insert(0, 'zone', np.where(zone == np.iinfo(np.int16).max, NO_ZONE, zone).astype(np.int16))
+        return result
+
+    def zone(self, lat, lon):
+        return int(self.classify([lat], [lon])['zone'].iloc[0])
+
+    def stage_tree(self, route='Any'):
+        # Built per route on first use; the index is shared by all sessions, so
+        # a tree is built once under the lock and then read without it
+        tree = self._stage_trees.get(route)
+        if tree is None:
+            with self._stage_trees_lock:
+                tree = self._stage_trees.get(route)
+                if tree is None:
+                    stages = self.bus_index.origins(route)
+                    tree = StopTree(stages, *_coords(self.bus_index, self.bus_index.stage_ids, stages))
+                    self._stage_trees[route] = tree
+        return tree
+
+    def nearest_station(self, lat, lon):
+        # (station, metres) for one point
+        names, distances = self.stations.nearest(lat, lon)
+        return names[0], distances[0]
+
+    def nearest_stage(self, lat, lon, route='Any'):
+        # (stage, metres) for one point, among the stages served by route
+        names, distances = self.stage_tree(route).nearest(lat, lon)
+        return names[0], distances[0]
+
+def _coords(index, ids, names):
+    i = np.array([ids[name] for name in names], dtype=np.int64)
+    return index.lat[i], index.lon[i]
+
+def spatial_index():
+    paths = [path for zone_path in data_store.zone_paths.values() for path in data_store.shapefile_paths(zone_path)]
+    paths += data_store.shapefile_paths(data_store.rail_stations_path) + [data_store.rail_od_path,
+                                                                          data_store.bus_od_path,
+                                                                          data_store.bus_stage_coords_path]
+    return data_store.cached(('index', 'spatial'), paths, lambda: SpatialIndex(
+        data_store.zone_layers(), fare_index.rail_fare_index(), fare_index.bus_fare_index()))
+
+if __name__ == '__main__':
+    index = spatial_index()
+    rng = np.random.default_rng(0)
+    n = 1_000_000
+    lat, lon = rng.uniform(52.9, 53.8, n), rng.uniform(-7.2, -5.9, n)
+
+    start = time.perf_counter()
+    zones = index.classify(lat, lon)
+    elapsed = time.perf_counter() - start
+    print(f"Classified {n:,} points in {elapsed:.2f}s ({n / elapsed:,.0f} points/s)")
+    print(zones['zone'].value_counts().sort_index().to_string())
+
+    for what, lookup in [('station', index.nearest_station), ('stage', index.nearest_stage)]:
+        start = time.perf_counter()
+        for i in range(10_000):
+            lookup(lat[i], lon[i])
+        elapsed = time.perf_counter() - start
+        print(f"Nearest {what}: {elapsed / 10_000 * 1e6:.0f}us per lookup, e.g. {lookup(53.3498, -6.2603)}")
@@ -0,0 +1,85 @@
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+import pandas as pd
+
+# Cold-start import profile of the dashboard. Runs a fresh interpreter with
+# `python -X importtime` over the modules FareCalcMap.py imports at the top
+# level, then reports import time per top-level package. Packages that should
+# only load when first needed (deferred_packages) are flagged if they show up.
+# With --budget MS the exit status is non-zero when the total import time
+# exceeds MS or a deferred package is imported, so cold start can be held to a
+# budget.
+#
+#   python startup_profile.py [--budget 2500] [--top 20]
+
+main_path = os.path.dirname(os.path.abspath(__file__))
+app_path = os.path.join(main_path, 'FareCalcMap.py')
+
+# Heavy packages kept off the import path of the dashboard; each is imported by
+# the function that first needs it
+deferred_packages = ['matplotlib', 'geopandas', 'shapely', 'pyproj', 'scipy']
+
+_importtime_line = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def app_imports(path=app_path):
+    # Modules imported at the top level of path, in order
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def import_times(modules):
+    # One row per module imported by a fresh interpreter importing modules
+    code = '\n'.join(f'import {module}' for module in modules)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=main_path,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {', '.join(modules)} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _importtime_line.match(line)
+        if match:
+            rows.append({'module': match[4], 'self_ms': int(match[1]) / 1000, 'cumulative_ms': int(match[2]) / 1000})
+    return pd.DataFrame(rows, columns=['module', 'self_ms', 'cumulative_ms'])
+
+def package_report(times):
+    # Import time per top-level package, slowest first
+    times = times.assign(package=times['module'].str.split('.').str[0])
+    report = times.groupby('package').agg(modules=('module', 'size'), ms=('self_ms', 'sum'))
+    report['%'] = report['ms'] / report['ms'].sum() * 100
+    report['deferred'] = report.index.isin(deferred_packages)
+    return report.sort_values('ms', ascending=False).reset_index()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time profile of the dashboard's cold start.")
+    parser.add_argument('--budget', type=float, help="fail if total import time exceeds this many milliseconds")
+    parser.add_argument('--top', type=int, default=20, help="packages to list")
+    args = parser.parse_args(argv)
+
+    report = package_report(import_times(app_imports()))
+    total = report['ms'].sum()
+    with pd.option_context('display.width', 200):
+        print(report.head(args.top).to_string(index=False, float_format='{:.1f}'.format))
+    print(f"\nTotal import time: {total:.0f} ms over {report['modules'].sum()} modules")
+
+    deferred = report.loc[report['deferred'], 'package'].tolist()
+    if deferred:
+        print(f"Imported at startup but should be deferred: {', '.join(deferred)}")
+    if args.budget is not None:
+        over = total > args.budget
+        print(f"Budget {args.budget:.0f} ms: {'EXCEEDED' if over else 'ok'}")
+        if over or deferred:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
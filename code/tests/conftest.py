@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the dashboard modules the way the dashboard does, from code/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
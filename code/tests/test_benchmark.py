@@ -0,0 +1,27 @@
+import pytest
+import benchmark
+import fare_index
+
+def test_rail_cases_include_central_station():
+    cases = list(benchmark.rail_cases(fare_index.rail_fare_index()))
+    assert benchmark.central_station in {case['origin'] for case in cases}
+
+def test_missing_benchmark_origin_raises(monkeypatch):
+    monkeypatch.setattr(benchmark, 'central_station', 'Connolly')
+    with pytest.raises(ValueError, match='Connolly'):
+        list(benchmark.rail_cases(fare_index.rail_fare_index()))
+
+def test_cold_start_rebuilds_indexes():
+    rail, bus = fare_index.rail_fare_index(), fare_index.bus_fare_index()
+    benchmark.cold_start()
+    assert fare_index.rail_live._live is None and fare_index.bus_live._live is None
+    assert fare_index.rail_fare_index() is not rail
+    assert fare_index.bus_fare_index() is not bus
+
+def test_cold_pass_times_the_index_build():
+    case = next(benchmark.rail_cases(fare_index.rail_fare_index()))
+    benchmark.cold_start()
+    cold, _, _ = benchmark._run(case, 1)
+    warm, _, _ = benchmark._run(case, 1)
+    # A real build, not a cache hit
+    assert cold['index'] > 10 * warm['index']
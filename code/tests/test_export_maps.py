@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+import export_maps
+
+def test_code_files_cover_every_local_import():
+    # Each module the pages are built with, directly or not, is in the page key
+    files = export_maps.code_files()
+    for name in ['export_maps.py', 'fare_maps.py', 'map_layers.py', 'fare_index.py', 'fare_bundle.py',
+                 'data_store.py', 'palettes.py', 'route_geometry.py', 'vector_tiles.py', 'timing.py']:
+        assert name in files
+    assert 'FareCalcMap.py' not in files
+
+def test_import_leaves_environment_alone():
+    # Importing export_maps must not switch the vector tiles off for the importer
+    env = dict(os.environ, FARECALC_VECTOR_TILES='1')
+    code = "import os, export_maps; print(os.environ['FARECALC_VECTOR_TILES'])"
+    output = subprocess.run([sys.executable, '-c', code], cwd=export_maps.main_path, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '1'
+
+def test_bus_pages_skipped_without_routes(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_maps.data_store, 'bus_routes_path', str(tmp_path / 'missing.shp'))
+    messages = []
+    manifest = export_maps.export(str(tmp_path / 'site'), workers=1, modes=('bus',), log=messages.append)
+    assert manifest == []
+    assert any('Skipping bus pages' in message for message in messages)
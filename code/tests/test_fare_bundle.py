@@ -0,0 +1,59 @@
+import json
+import numpy as np
+import pytest
+import data_store
+import fare_bundle
+import fare_index
+import fare_maps
+
+@pytest.fixture(scope='module')
+def bundle_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('bundle') / 'fare_bundle.bin')
+    fare_bundle.build(path)
+    return path
+
+def _assert_same(loaded, built):
+    assert set(loaded.__dict__) == set(built.__dict__)
+    for name, value in built.__dict__.items():
+        if isinstance(value, np.ndarray):
+            assert loaded.__dict__[name].dtype == value.dtype, name
+            assert np.array_equal(loaded.__dict__[name], value, equal_nan=value.dtype.kind == 'f'), name
+        else:
+            assert loaded.__dict__[name] == value, name
+
+def test_rail_round_trip(bundle_path):
+    bundle = fare_bundle.load(bundle_path)
+    built = fare_index.RailFareIndex(data_store.rail_od_pairs(), data_store.rail_fares(),
+                                     data_store.rail_period_fares(), data_store.rail_stations())
+    _assert_same(fare_index.RailFareIndex.from_arrays(bundle.section('rail')), built)
+
+def test_bus_round_trip(bundle_path):
+    bundle = fare_bundle.load(bundle_path)
+    built = fare_index.BusFareIndex(data_store.bus_od_pairs(), data_store.bus_fares(), data_store.bus_stage_coords())
+    _assert_same(fare_index.BusFareIndex.from_arrays(bundle.section('bus')), built)
+
+def test_zones_round_trip(bundle_path):
+    bundle = fare_bundle.Bundle(bundle_path)
+    assert json.loads(bundle.array('zones/geojson').tobytes()) == json.loads(json.dumps(fare_maps._zone_geojson()))
+
+def test_arrays_are_read_only_views(bundle_path):
+    bundle = fare_bundle.Bundle(bundle_path)
+    od_band = bundle.array('rail/od_band')
+    assert not od_band.flags.writeable
+    assert od_band.ctypes.data % fare_bundle.alignment == 0
+
+def test_stale_bundle_ignored(bundle_path, monkeypatch):
+    bundle = fare_bundle.Bundle(bundle_path)
+    assert bundle.is_current()
+    monkeypatch.setattr(fare_bundle, 'source_hashes', lambda: dict(bundle.header['sources'], changed='0'))
+    assert not bundle.is_current()
+    with pytest.warns(UserWarning, match='out of date'):
+        assert fare_bundle._open_current(bundle_path) is None
+
+def test_fixed_point_fares():
+    fares = np.array([[2.0, 3.65, np.nan], [0.01, 123.45, 0.0]])
+    cents = fare_bundle.to_fixed_point(fares)
+    assert cents.dtype == np.int32
+    assert np.array_equal(fare_bundle.from_fixed_point(cents), fares, equal_nan=True)
+    with pytest.raises(ValueError):
+        fare_bundle.to_fixed_point(np.array([2.005]))
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+import fare_engine
+import fare_index
+
+@pytest.fixture(scope='module')
+def rail():
+    return fare_index.rail_fare_index()
+
+@pytest.fixture(scope='module')
+def mixed_journeys(rail):
+    # Band-priced and period tickets in one batch, with some rows that cannot be priced
+    rng = np.random.default_rng(5)
+    n = 2000
+    products = list(rail.products) + [('Period', tt) for tt in rail.period_ticket_types]
+    product = rng.integers(len(products), size=n)
+    journeys = pd.DataFrame({
+        'Origin': rng.choice(rail.stations, n),
+        'Destination': rng.choice(rail.stations, n),
+        'TicketType': [products[i][1] for i in product],
+        'PaymentMeans': [products[i][0] for i in product],
+    })
+    journeys.loc[0, 'Origin'] = 'Nowhere'
+    journeys.loc[1, ['PaymentMeans', 'TicketType']] = ['Period', 'No Such Ticket']
+    journeys.loc[2, ['PaymentMeans', 'TicketType']] = ['Cash Fares', 'Adult Daily']
+    return journeys
+
+def _row_quotes(rail, journeys):
+    # fare_band is the pair's band (or zone) even when the ticket is unknown
+    bands, fares = [], []
+    for row in journeys.itertuples():
+        band, fare = None, np.nan
+        if row.Origin in rail.station_ids and row.Destination in rail.station_ids:
+            if row.PaymentMeans == 'Period':
+                band, _ = rail.quote_period(row.Origin, row.Destination, rail.period_ticket_types[0])
+                if row.TicketType in rail.period_ticket_types:
+                    _, fare = rail.quote_period(row.Origin, row.Destination, row.TicketType)
+            else:
+                band, _ = rail.quote(row.Origin, row.Destination, rail.payment_means[0], rail.ticket_types[0])
+                if row.TicketType in rail.ticket_types:
+                    _, fare = rail.quote(row.Origin, row.Destination, row.PaymentMeans, row.TicketType)
+        bands.append(None if band is None else str(band))
+        fares.append(fare)
+    return bands, np.array(fares)
+
+def _bands(result):
+    return [None if pd.isna(band) else band for band in result['fare_band']]
+
+def test_per_row_period_payment_means(rail, mixed_journeys):
+    result = fare_engine.quote_many(mixed_journeys['Origin'].to_numpy(dtype=object),
+                                    mixed_journeys['Destination'].to_numpy(dtype=object),
+                                    mixed_journeys['TicketType'].to_numpy(dtype=object),
+                                    mixed_journeys['PaymentMeans'].to_numpy(dtype=object))
+    bands, fares = _row_quotes(rail, mixed_journeys)
+    np.testing.assert_array_equal(result['fare'].to_numpy(), fares)
+    assert _bands(result) == bands
+    assert np.isnan(result['fare'].iloc[:3]).all()
+    assert (mixed_journeys['PaymentMeans'] == 'Period').sum() > 100
+
+def test_per_row_matches_scalar_quotes(rail, mixed_journeys):
+    # Each group of rows priced with scalar ticket type and payment means gives the same answer
+    result = fare_engine.quote_many(mixed_journeys['Origin'], mixed_journeys['Destination'],
+                                    mixed_journeys['TicketType'], mixed_journeys['PaymentMeans'])
+    for (ticket_type, payment_means), rows in mixed_journeys.iloc[3:].groupby(['TicketType', 'PaymentMeans']):
+        scalar = fare_engine.quote_many(rows['Origin'], rows['Destination'], ticket_type, payment_means)
+        np.testing.assert_array_equal(result['fare'].to_numpy()[rows.index], scalar['fare'].to_numpy())
+        assert [_bands(result)[i] for i in rows.index] == _bands(scalar)
+
+def test_scalar_ticket_type_with_period_rows():
+    # A single ticket type cannot be both a band and a period ticket
+    with pytest.raises(ValueError, match='period ticket type'):
+        fare_engine.quote_many(['Adamstown'] * 2, ['Wicklow'] * 2, 'Adult Single', ['Cash Fares', 'Period'])
+
+def test_quote_csv_with_payment_means_column(rail, mixed_journeys, tmp_path):
+    mixed_journeys.to_csv(tmp_path / 'in.csv', index=False)
+    rows, _ = fare_engine.quote_csv(tmp_path / 'in.csv', tmp_path / 'out.csv', 'rail', ticket_type_column='TicketType',
+                                    payment_means_column='PaymentMeans', chunksize=300, log=open(tmp_path / 'log', 'w'))
+    assert rows == len(mixed_journeys)
+    _, fares = _row_quotes(rail, mixed_journeys)
+    np.testing.assert_allclose(pd.read_csv(tmp_path / 'out.csv')['fare'].to_numpy(), fares)
+
+def test_view_helpers_use_the_snapshot_they_are_given(rail):
+    index, version = fare_engine.current('rail')
+    assert index is fare_index.rail_live.index() and version == fare_index.rail_live.current()[1]
+    assert fare_engine.band_fares('Cash Fares', 'Adult Single', index) == rail.band_fares('Cash Fares', 'Adult Single')
+    # A snapshot passed back in is what gets priced, not the live index
+    gpd = pytest.importorskip('geopandas')
+    import shapely
+    other = fare_index.RailFareIndex(
+        pd.DataFrame({'Origin': ['A'], 'Destination': ['B'], 'Value': ['R1'], 'Zone': [1]}),
+        pd.DataFrame({'PaymentMeans': ['Cash Fares'], 'TicketType': ['Adult Single'], 'FareZone': ['R1'], 'Fare': [9.0]}),
+        pd.DataFrame({'TicketType': ['Adult Weekly'], 'FareZone': [1], 'Fare': [30.0]}),
+        gpd.GeoDataFrame({'stop_name': ['A', 'B']}, geometry=[shapely.Point(-6.3, 53.3), shapely.Point(-6.2, 53.4)],
+                         crs='EPSG:4326'))
+    assert fare_engine.quote('A', 'B', 'Adult Single', 'Cash Fares', index=other) == ('R1', 9.0)
+    assert fare_engine.quote('A', 'B', 'Adult Weekly', 'Period', index=other) == ('1', 30.0)
+
+def test_view_helpers_match_the_indexes(rail):
+    pd.testing.assert_frame_equal(fare_engine.fares_from('Adamstown', 'Adult Single', 'Cash Fares'),
+                                  rail.fares_from('Adamstown', 'Cash Fares', 'Adult Single'))
+    bus, _ = fare_engine.current('bus')
+    ticket_types = fare_engine.bus_passenger_ticket_types['Adult']
+    route = bus.routes[0]
+    origin = bus.origins(route)[0]
+    pd.testing.assert_frame_equal(fare_engine.fares_from(origin, ticket_types, mode='bus', route=route, index=bus),
+                                  bus.fares_from(origin, ticket_types, route))
+    optimizer = fare_engine.cheapest_tickets('Adult', rail)
+    assert optimizer.index is rail
+
+def test_unknown_mode():
+    for call in [lambda: fare_engine.current('tram'), lambda: fare_engine.fares_from('x', 'y', mode='tram'),
+                 lambda: fare_engine.quote('x', 'y', 'Adult Single', 'Cash', mode='tram')]:
+        with pytest.raises(ValueError, match='tram'):
+            call()
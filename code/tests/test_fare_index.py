@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import pytest
+import data_store
+import fare_index
+
+# A fare index patched by updated() must be the index a full build of the same
+# tables gives. Band codes may be numbered differently, so band-coded arrays are
+# compared through the band names.
+
+rail_attributes = ['stations', 'origins', 'destinations', 'od_band', 'od_zone', 'fares', 'products',
+                   'period_ticket_types', 'period_fares', 'lat', 'lon']
+bus_attributes = ['stages', 'routes', 'od_band', 'stage_routes', 'arrival_bands', 'departure_bands', 'fares',
+                  'products', 'lat', 'lon']
+
+def _named(index, name):
+    values = getattr(index, name)
+    if name == 'od_band':
+        bands = np.asarray(index.bands, dtype=object)
+        return np.where(values >= 0, bands[np.maximum(values, 0)], values.astype(object))
+    if name in ('fares', 'arrival_bands', 'departure_bands'):
+        # Band axis last; one column per band name
+        return pd.DataFrame(np.moveaxis(values, -1, 0).reshape(len(index.bands), -1).T, columns=index.bands)
+    return values
+
+def assert_same(patched, full, attributes):
+    for name in attributes:
+        a, b = _named(patched, name), _named(full, name)
+        if isinstance(a, pd.DataFrame):
+            assert sorted(a.columns) == sorted(b.columns), name
+            assert np.array_equal(a.to_numpy(), b[a.columns].to_numpy(), equal_nan=True), name
+        elif isinstance(a, np.ndarray):
+            assert np.array_equal(a, b, equal_nan=a.dtype.kind == 'f'), name
+        else:
+            assert list(a) == list(b), name
+
+def reloaded(index, full, *tables):
+    # What LiveIndex does: patch when updated() can, else build from scratch
+    result = index.updated(*tables)
+    return (full(), None) if result is None else result
+
+@pytest.fixture(scope='module')
+def rail_tables():
+    return data_store.rail_od_pairs(), data_store.rail_fares(), data_store.rail_period_fares(), data_store.rail_stations()
+
+@pytest.fixture(scope='module')
+def rail(rail_tables):
+    return fare_index.RailFareIndex(*rail_tables)
+
+@pytest.fixture(scope='module')
+def bus_tables():
+    return data_store.bus_od_pairs(), data_store.bus_fares(), data_store.bus_stage_coords()
+
+@pytest.fixture(scope='module')
+def bus(bus_tables):
+    return fare_index.BusFareIndex(*bus_tables)
+
+def test_rail_fare_change(rail, rail_tables):
+    od_pairs, fares, period_fares, stations = rail_tables
+    fares = fares.copy()
+    fares.loc[fares['FareZone'] == fares['FareZone'].iloc[0], 'Fare'] += 0.1
+    period_fares = period_fares.copy()
+    period_fares.loc[0, 'Fare'] += 1
+
+    patched, changes = rail.updated(None, fares, period_fares)
+    assert changes['fares'] > 0 and changes['od'] == 0
+    assert patched.od_band is rail.od_band
+    assert_same(patched, fare_index.RailFareIndex(od_pairs, fares, period_fares, stations), rail_attributes)
+
+def test_rail_od_change(rail, rail_tables):
+    od_pairs, fares, period_fares, stations = rail_tables
+    od_pairs = od_pairs.copy()
+    bands = list(pd.unique(od_pairs['Value'].dropna()))
+    od_pairs.loc[3, 'Value'] = next(band for band in bands if band != od_pairs.loc[3, 'Value'])
+    od_pairs.loc[4, 'Zone'] = od_pairs['Zone'].max()
+    od_pairs = od_pairs.drop(index=[10, 11])
+
+    patched, changes = rail.updated(od_pairs)
+    assert changes['od'] >= 3
+    assert_same(patched, fare_index.RailFareIndex(od_pairs, fares, period_fares, stations), rail_attributes)
+
+def test_bus_od_change(bus, bus_tables):
+    od_pairs, fares, stage_coords = bus_tables
+    od_pairs = od_pairs.copy()
+    bands = list(pd.unique(od_pairs['Fare Band'].dropna()))
+    od_pairs.loc[5, 'Fare Band'] = next(band for band in bands if band != od_pairs.loc[5, 'Fare Band'])
+    od_pairs.loc[100, 'Fare Band'] = np.nan
+    od_pairs = od_pairs.drop(index=[200, 201, 202])
+
+    patched, changes = bus.updated(od_pairs)
+    assert changes['od'] >= 4
+    assert_same(patched, fare_index.BusFareIndex(od_pairs, fares, stage_coords), bus_attributes)
+
+def test_bus_fare_change(bus, bus_tables):
+    od_pairs, fares, stage_coords = bus_tables
+    fares = fares.copy()
+    fares.loc[fares['FareZone'] == fares['FareZone'].iloc[0], 'Fare'] += 0.1
+
+    patched, changes = bus.updated(None, fares)
+    assert changes['fares'] > 0
+    assert patched.od_band is bus.od_band
+    assert_same(patched, fare_index.BusFareIndex(od_pairs, fares, stage_coords), bus_attributes)
+
+def test_bus_route_dropped(bus, bus_tables):
+    # A route with no rows left must not stay selectable
+    od_pairs, fares, stage_coords = bus_tables
+    # One whose stages are all on other routes, so no stage goes with it
+    dropped = next(route for route in bus.routes if set(bus.stages) == set(
+        od_pairs.loc[od_pairs['Route'] != route, ['Origin', 'Destination']].stack()))
+    od_pairs = od_pairs[od_pairs['Route'] != dropped]
+    full = lambda: fare_index.BusFareIndex(od_pairs, fares, stage_coords)
+
+    assert bus.updated(od_pairs) is None
+    index, _ = reloaded(bus, full, od_pairs)
+    assert dropped not in index.routes
+    assert all(index.origins(route) for route in index.routes)
+    assert_same(index, full(), bus_attributes)
+
+def test_bus_routes_reordered(bus, bus_tables):
+    # Route order follows the OD table, so a reordered table is a new layout
+    od_pairs, fares, stage_coords = bus_tables
+    first = od_pairs['Route'] == bus.routes[0]
+    od_pairs = pd.concat([od_pairs[~first], od_pairs[first]], ignore_index=True)
+    full = lambda: fare_index.BusFareIndex(od_pairs, fares, stage_coords)
+
+    index, _ = reloaded(bus, full, od_pairs)
+    assert index.routes == full().routes
+    assert_same(index, full(), bus_attributes)
+
+# The compiled indexes against the per-selection pandas merges the dashboard
+# used to run, on every origin
+
+def assert_same_rows(compiled, merged, columns):
+    compiled, merged = (frame[columns].drop_duplicates().astype(str).sort_values(columns).reset_index(drop=True)
+                        for frame in (compiled, merged))
+    pd.testing.assert_frame_equal(compiled, merged)
+
+def test_rail_fares_from_matches_merges(rail, rail_tables):
+    od_pairs, fares, period_fares, stations = rail_tables
+    located = stations[~stations.geometry.is_empty & stations.geometry.notna()]
+    selections = [(pm, tt) for pm, tt in rail.products[:3]] + [('Period', rail.period_ticket_types[0])]
+    for payment_means, ticket_type in selections:
+        if payment_means == 'Period':
+            table = period_fares[period_fares['TicketType'] == ticket_type]
+            on = 'Zone'
+        else:
+            table = fares[(fares['PaymentMeans'] == payment_means) & (fares['TicketType'] == ticket_type)]
+            on = 'Value'
+        merged = od_pairs.merge(located, left_on='Destination', right_on='stop_name') \
+            .merge(table, left_on=on, right_on='FareZone').dropna(subset=['Value', 'Fare'])
+        compiled = pd.concat([rail.fares_from(origin, payment_means, ticket_type) for origin in rail.origins])
+        assert_same_rows(compiled, merged, ['Origin', 'Destination', 'Value', 'Fare'])
+
+def test_bus_fares_from_matches_merges(bus, bus_tables):
+    od_pairs, fares, stage_coords = bus_tables
+    located = stage_coords.dropna(subset=['Lat', 'Long'])
+    columns = ['Route', 'Origin', 'Destination', 'Fare Band', 'PaymentMeans', 'TicketType', 'Fare']
+    for ticket_types in fare_index.bus_passenger_ticket_types.values():
+        table = fares[fares['TicketType'].isin(ticket_types)]
+        for route in ['Any'] + bus.routes[:5]:
+            routes = od_pairs if route == 'Any' else od_pairs[od_pairs['Route'] == route]
+            merged = routes.merge(located, left_on='Destination', right_on='Stage') \
+                .merge(table, left_on='Fare Band', right_on='FareZone').dropna(subset=['Fare'])
+            compiled = pd.concat([bus.fares_from(origin, ticket_types, route) for origin in bus.origins(route)])
+            assert_same_rows(compiled, merged, columns)
@@ -0,0 +1,38 @@
+import copy
+import folium
+import fare_index
+import fare_maps
+
+def _marker_tooltips(layer):
+    tooltips = []
+    for child in layer._children.values():
+        tooltips += [tip.text for tip in child._children.values() if isinstance(tip, folium.Tooltip)]
+    return tooltips
+
+def _priced_pair(index):
+    # First origin/destination pair that is priced and has a location
+    for destination in index.stations[1:]:
+        if index.coords(destination) and index.band(index.stations[0], destination):
+            return index.stations[0], destination
+
+def test_rail_layer_prices_destination_from_its_index():
+    index = copy.copy(fare_index.rail_fare_index())
+    index.fares = index.fares * 2
+    origin, destination = _priced_pair(index)
+    payment_means = index.payment_means[0]
+    ticket_type = index.ticket_types_for(payment_means)[0]
+    _, fare = index.quote(origin, destination, payment_means, ticket_type)
+
+    tooltips = _marker_tooltips(fare_maps.rail_layer(index, origin, payment_means, ticket_type, destination))
+    assert any(destination in tooltip and f"€{fare:.2f}" in tooltip for tooltip in tooltips)
+
+def test_rail_layer_leaves_unpriced_destination_off():
+    index = copy.copy(fare_index.rail_fare_index())
+    origin, destination = _priced_pair(index)
+    index.od_band = index.od_band.copy()
+    index.od_band[index.station_ids[origin], index.station_ids[destination]] = fare_index.NO_PAIR
+    payment_means = index.payment_means[0]
+    ticket_type = index.ticket_types_for(payment_means)[0]
+
+    layer = fare_maps.rail_layer(index, origin, payment_means, ticket_type, destination)
+    assert not any(destination in tooltip for tooltip in _marker_tooltips(layer))
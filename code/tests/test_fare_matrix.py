@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+import fare_index
+import fare_matrix
+
+# FareMatrices against pricing each pair through the fare index, and the
+# isolines / fare grid against fares whose answer is known
+
+def test_rail_fares_match_quotes():
+    index = fare_index.rail_fare_index()
+    matrices = fare_matrix.FareMatrices(index)
+    assert matrices.products == list(index.products) + [('Period', tt) for tt in index.period_ticket_types]
+    for p, (payment_means, ticket_type) in enumerate(matrices.products):
+        expected = np.full((len(index.stations),) * 2, np.nan)
+        for o, origin in enumerate(index.stations):
+            for d, destination in enumerate(index.stations):
+                if payment_means == 'Period':
+                    _, expected[o, d] = index.quote_period(origin, destination, ticket_type)
+                else:
+                    _, expected[o, d] = index.quote(origin, destination, payment_means, ticket_type)
+        np.testing.assert_array_equal(matrices.fares[p], expected, err_msg=matrices.product_labels[p])
+
+def _bus_cheapest(index):
+    # {(product, origin id, destination id): cheapest fare over the routes that price the pair}
+    cheapest = {}
+    for r, o, d in zip(*np.nonzero(index.od_band >= 0)):
+        for p, (payment_means, ticket_type) in enumerate(index.products):
+            _, fare = index.quote(index.routes[r], index.stages[o], index.stages[d], payment_means, ticket_type)
+            if not np.isnan(fare):
+                cheapest[p, o, d] = min(cheapest.get((p, o, d), np.inf), fare)
+    return cheapest
+
+def _assert_bus_matches(index):
+    matrices = fare_matrix.FareMatrices(index)
+    assert matrices.products == list(index.products)
+    cheapest = _bus_cheapest(index)
+    expected = np.full(matrices.fares.shape, np.nan)
+    for key, fare in cheapest.items():
+        expected[key] = fare
+    np.testing.assert_array_equal(matrices.fares, expected)
+    return matrices
+
+def test_bus_fares_are_cheapest_route_quotes():
+    _assert_bus_matches(fare_index.bus_fare_index())
+
+def test_bus_unpriced_route_does_not_hide_a_priced_one():
+    # x -> y is on two routes, one in a band without an Adult Single fare; y -> z
+    # only in that band, so it has no Adult Single fare at all
+    od_pairs = pd.DataFrame([('1', 'x', 'y', 'B'), ('2', 'x', 'y', 'A'), ('1', 'y', 'z', 'B'), ('2', 'z', 'x', np.nan)],
+                            columns=['Route', 'Origin', 'Destination', 'Fare Band'])
+    fares = pd.DataFrame([('Cash', 'Adult Single', 'A', 2.0), ('Cash', 'Child Single', 'A', 1.0),
+                          ('Cash', 'Child Single', 'B', 0.5)],
+                         columns=['PaymentMeans', 'TicketType', 'FareZone', 'Fare'])
+    stage_coords = pd.DataFrame({'Stage': ['x', 'y', 'z'], 'Lat': [53.3, 53.4, 53.5], 'Long': [-6.2, -6.3, -6.4]})
+    index = fare_index.BusFareIndex(od_pairs, fares, stage_coords)
+    matrices = _assert_bus_matches(index)
+
+    x, y, z = (index.stage_ids[stage] for stage in 'xyz')
+    adult, child = (matrices.product_labels.index(f"{tt} (Cash)") for tt in ['Adult Single', 'Child Single'])
+    assert matrices.fares[adult, x, y] == 2.0 and matrices.fares[child, x, y] == 0.5
+    assert np.isnan(matrices.fares[adult, y, z]) and matrices.fares[child, y, z] == 0.5
+    assert np.isnan(matrices.fares[:, z, x]).all()
+
+def _linear_field(n=12):
+    # Jittered grid of places around Dublin with a fare linear in lat and lon
+    rng = np.random.default_rng(3)
+    lat, lon = np.meshgrid(np.linspace(53.1, 53.6, n), np.linspace(-6.6, -6.0, n))
+    lat = lat.ravel() + rng.uniform(-0.01, 0.01, n * n)
+    lon = lon.ravel() + rng.uniform(-0.01, 0.01, n * n)
+    fare = lambda lat, lon: 2 + 4 * (lat - 53.1) + 5 * (lon + 6.6)
+    return lat, lon, fare
+
+def test_isolines_of_linear_field_lie_on_their_level():
+    lat, lon, fare = _linear_field()
+    fares = fare(lat, lon)
+    levels = [3.0, 4.0, 5.0, 99.0]
+    lines = fare_matrix.isolines(lat, lon, fares, levels)
+    assert set(lines) == set(levels)
+    assert lines[99.0] == []
+    for level in levels[:-1]:
+        assert lines[level]
+        points = np.concatenate([np.array(line) for line in lines[level]])
+        np.testing.assert_allclose(fare(points[:, 0], points[:, 1]), level, atol=1e-9)
+        # One unbroken line across the triangulated area
+        assert len(lines[level]) == 1
+
+def test_isolines_degenerate_places():
+    levels = [1.0, 2.0]
+    # Fewer than three places
+    assert fare_matrix.isolines([53.3, 53.4], [-6.2, -6.3], [0.5, 2.5], levels) == {1.0: [], 2.0: []}
+    assert fare_matrix.isolines([], [], [], levels) == {1.0: [], 2.0: []}
+    # All places on one line
+    lat = np.linspace(53.2, 53.5, 6)
+    lon = -6.2 + (lat - 53.2)
+    assert fare_matrix.isolines(lat, lon, np.linspace(0, 3, 6), levels) == {1.0: [], 2.0: []}
+
+def test_isolines_skip_long_triangles():
+    # Two clusters 50 km apart: no triangle spans the gap, so no line crosses it
+    lat = np.array([53.30, 53.31, 53.30, 53.75, 53.76, 53.75])
+    lon = np.array([-6.30, -6.29, -6.28, -6.30, -6.29, -6.28])
+    lines = fare_matrix.isolines(lat, lon, np.array([1, 1, 1, 3, 3, 3.0]), [2.0])
+    assert lines == {2.0: []}
+
+def test_fare_grid_cell_means():
+    lat, lon, fare = _linear_field()
+    fares = fare(lat, lon)
+    grid = fare_matrix.fare_grid(lat, lon, fares, cell_km=5.0)
+    assert grid['Places'].sum() == len(fares)
+    assert ((grid['north'] > grid['south']) & (grid['east'] > grid['west'])).all()
+    for cell in grid.itertuples():
+        inside = (lat >= cell.south) & (lat < cell.north) & (lon >= cell.west) & (lon < cell.east)
+        assert inside.sum() == cell.Places
+        assert fares[inside].mean() == pytest.approx(cell.Fare)
+
+    empty = fare_matrix.fare_grid([], [], [])
+    assert empty.empty and list(empty.columns) == ['south', 'west', 'north', 'east', 'Fare', 'Places']
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import pytest
+import fare_index
+import fare_scenarios
+
+# The vectorised sweep against pricing every demand row one at a time with the
+# index's own quote(), applying each scenario as a plain function of
+# (payment means, ticket type, fare band or zone, fare)
+
+@pytest.fixture(scope='module')
+def rail():
+    return fare_index.rail_fare_index()
+
+@pytest.fixture(scope='module')
+def rail_demand(rail):
+    rng = np.random.default_rng(0)
+    n = 3000
+    products = [(pm, tt) for pm, tt in rail.products] + [('Period', tt) for tt in rail.period_ticket_types]
+    product = rng.integers(len(products), size=n)
+    demand = pd.DataFrame({
+        'Origin': rng.choice(rail.stations, n),
+        'Destination': rng.choice(rail.stations, n),
+        'PaymentMeans': [products[i][0] for i in product],
+        'TicketType': [products[i][1] for i in product],
+        'Journeys': rng.integers(0, 500, n).astype(float),
+    })
+    # Rows that cannot be priced are left out of every total
+    demand.loc[0, 'Origin'] = 'Nowhere'
+    demand.loc[1, 'TicketType'] = 'No Such Ticket'
+    return demand
+
+def _rail_row_loop(index, demand, scenario, merge=None, elasticity=0.0):
+    # (base revenue, revenue change per origin, per ticket) the slow way
+    base, origins, tickets = 0.0, {}, {}
+    for row in demand.itertuples():
+        if row.Journeys <= 0 or row.Origin not in index.station_ids or row.Destination not in index.station_ids:
+            continue
+        if row.PaymentMeans == 'Period':
+            if row.TicketType not in index.period_ticket_types:
+                continue
+            zone, fare = index.quote_period(row.Origin, row.Destination, row.TicketType)
+            if zone is None or np.isnan(fare):
+                continue
+            new_fare = scenario(row.PaymentMeans, row.TicketType, str(zone), fare)
+        else:
+            if (row.PaymentMeans, row.TicketType) not in index.products:
+                continue
+            band, fare = index.quote(row.Origin, row.Destination, row.PaymentMeans, row.TicketType)
+            if band is None or np.isnan(fare):
+                continue
+            band = (merge or {}).get(band, band)
+            new_fare = scenario(row.PaymentMeans, row.TicketType, band,
+                                index.fares[index.payment_means.index(row.PaymentMeans),
+                                            index.ticket_types.index(row.TicketType), index.bands.index(band)])
+        journeys = row.Journeys
+        if elasticity and new_fare > 0:
+            journeys = journeys * (new_fare / fare) ** elasticity
+        change = (0.0 if np.isnan(new_fare) else new_fare * journeys) - fare * row.Journeys
+        base += fare * row.Journeys
+        origins[row.Origin] = origins.get(row.Origin, 0.0) + change
+        ticket = f"{row.TicketType} ({row.PaymentMeans})"
+        tickets[ticket] = tickets.get(ticket, 0.0) + change
+    return base, origins, tickets
+
+def _rail_scenarios(rail):
+    # {name: (scenario rows, scenario function, merged bands)}
+    band, merged, target = rail.bands[0], rail.bands[1:3], rail.bands[3]
+    payment_means = rail.payment_means[0]
+    ticket_type = rail.ticket_types[0]
+    period_ticket_type = rail.period_ticket_types[0]
+    return {
+        f'{band} +10c': ([('add', '', '', band, 0.1, '')],
+                         lambda pm, tt, b, f: f + 0.1 if b == band else f, None),
+        'Merge': ([('merge', '', '', '|'.join(merged), np.nan, target)],
+                  lambda pm, tt, b, f: f, {b: target for b in merged}),
+        f'{payment_means} +5%': ([('scale', payment_means, '', '', 1.05, '')],
+                                 lambda pm, tt, b, f: f * 1.05 if pm == payment_means else f, None),
+        f'{ticket_type} at 3': ([('set', '', ticket_type, '', 3.0, '')],
+                                lambda pm, tt, b, f: (3.0 if not np.isnan(f) else f) if tt == ticket_type else f, None),
+        'Period zone 1 +1': ([('add', 'Period', period_ticket_type, '1', 1.0, '')],
+                             lambda pm, tt, b, f: f + 1 if pm == 'Period' and tt == period_ticket_type and b == '1'
+                             else f, None),
+    }
+
+def _scenario_file(path, scenarios):
+    rows = [(name, action, pm, tt, zone, value, target)
+            for name, (edits, _, _) in scenarios.items() for action, pm, tt, zone, value, target in edits]
+    pd.DataFrame(rows, columns=['Scenario', 'Action', 'PaymentMeans', 'TicketType', 'FareZone', 'Value', 'Target']) \
+        .to_csv(path, index=False)
+    return fare_scenarios.read_scenarios(path)
+
+@pytest.mark.parametrize('elasticity', [0.0, -0.3])
+def test_rail_sweep_matches_row_loop(rail, rail_demand, tmp_path, elasticity):
+    scenarios = _rail_scenarios(rail)
+    engine = fare_scenarios.ScenarioEngine(rail, rail_demand)
+    result = fare_scenarios.sweep(engine, _scenario_file(tmp_path / 'scenarios.csv', scenarios), elasticity)
+    assert engine.dropped >= 2
+
+    for name, (_, scenario, merge) in scenarios.items():
+        base, origins, tickets = _rail_row_loop(rail, rail_demand, scenario, merge, elasticity)
+        assert result.totals.loc[name, 'Revenue'] == pytest.approx(base)
+        assert result.totals.loc[name, 'Change'] == pytest.approx(sum(origins.values()), abs=1e-6)
+        changes = result.origins.loc[name]
+        assert changes[changes != 0].to_dict() == pytest.approx({o: c for o, c in origins.items() if c != 0}, abs=1e-6)
+        changes = result.products.loc[name]
+        assert changes[changes != 0].to_dict() == pytest.approx({t: c for t, c in tickets.items() if c != 0}, abs=1e-6)
+        assert result.pairs.loc[name].sum() == pytest.approx(result.totals.loc[name, 'Change'], abs=1e-6)
+
+def test_parallel_sweep_matches_serial(rail, rail_demand, tmp_path):
+    scenarios = _scenario_file(tmp_path / 'scenarios.csv', _rail_scenarios(rail))
+    # Enough scenarios for several chunks
+    scenarios = {f'{name} {i}': edits for i in range(4) for name, edits in scenarios.items()}
+    engine = fare_scenarios.ScenarioEngine(rail, rail_demand)
+    serial = fare_scenarios.sweep(engine, scenarios, workers=1)
+    parallel = fare_scenarios.sweep(engine, scenarios, workers=2)
+    pd.testing.assert_frame_equal(serial.totals, parallel.totals)
+    pd.testing.assert_frame_equal(serial.origins, parallel.origins)
+
+def test_bus_sweep_matches_row_loop(tmp_path):
+    bus = fare_index.bus_fare_index()
+    rng = np.random.default_rng(1)
+    routes, origins, destinations = np.nonzero(bus.od_band >= 0)
+    pick = rng.choice(len(routes), 2000)
+    product = rng.integers(len(bus.products), size=len(pick))
+    demand = pd.DataFrame({
+        'Route': np.asarray(bus.routes, dtype=object)[routes[pick]],
+        'Origin': np.asarray(bus.stages, dtype=object)[origins[pick]],
+        'Destination': np.asarray(bus.stages, dtype=object)[destinations[pick]],
+        'PaymentMeans': [bus.products[i][0] for i in product],
+        'TicketType': [bus.products[i][1] for i in product],
+        'Journeys': rng.integers(1, 100, len(pick)).astype(float),
+    })
+    # The most common band that has fares
+    counts = np.bincount(bus.od_band[bus.od_band >= 0], minlength=len(bus.bands))
+    band = bus.bands[int(np.argmax(np.where(np.isnan(bus.fares).all(axis=(0, 1)), 0, counts)))]
+    scenarios = {'Band +20c': ([('add', '', '', band, 0.2, '')], None, None)}
+    engine = fare_scenarios.ScenarioEngine(bus, demand)
+    result = fare_scenarios.sweep(engine, _scenario_file(tmp_path / 'scenarios.csv', scenarios))
+
+    base = change = 0.0
+    for row in demand.itertuples():
+        fare_band, fare = bus.quote(row.Route, row.Origin, row.Destination, row.PaymentMeans, row.TicketType)
+        if np.isnan(fare):
+            continue
+        base += fare * row.Journeys
+        change += 0.2 * row.Journeys if fare_band == band else 0.0
+    assert result.totals.loc['Band +20c', 'Revenue'] == pytest.approx(base)
+    assert result.totals.loc['Band +20c', 'Change'] == pytest.approx(change)
+    assert result.zones.loc['Band +20c', band] == pytest.approx(change)
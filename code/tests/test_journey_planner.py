@@ -0,0 +1,161 @@
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+import fare_index
+import journey_planner
+from journey_planner import node_label
+
+# A small bus + rail network, priced independently of the planner by trying every
+# journey of up to two tickets (or none, on foot), with free walks between a
+# station and a stage before, between and after them.
+#
+#   rail  E -> B, A <-> B <-> C, A <-> C (dearer than changing at B)
+#   bus   s1 <-> s2 on route 1 (and dearer on route 3), s2 <-> s4 on route 2
+#   walk  B - s1 about 300 m, C - s4 about 450 m; s3 is 600 m from C, unpriced
+#   E (origin only) and s3 can never be reached
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+def _offset(lat, lon, north=0.0, east=0.0):
+    # Point about north/east metres away
+    return lat + north / 111195, lon + east / (111195 * np.cos(np.radians(lat)))
+
+stations = {'A': (53.30, -6.30), 'B': (53.35, -6.26), 'C': (53.40, -6.22), 'E': (53.25, -6.40)}
+stages = {'s1': _offset(*stations['B'], north=300), 's2': (53.36, -6.10),
+          's3': _offset(*stations['C'], north=600), 's4': _offset(*stations['C'], east=450)}
+
+rail_od = [('A', 'B', 'R1'), ('B', 'A', 'R1'), ('B', 'C', 'R1'), ('C', 'B', 'R1'),
+           ('A', 'C', 'R3'), ('C', 'A', 'R3'), ('E', 'B', 'R1')]
+rail_fares = [('Cash Fares', 'Adult Single', 'R1', 2.5), ('Cash Fares', 'Adult Single', 'R3', 5.0),
+              ('Leap Fares', 'Adult Single', 'R1', 2.0),
+              ('Cash Fares', 'Adult Day Return', 'R1', 0.5),
+              ('Cash Fares', 'Child Single', 'R1', 1.0), ('Cash Fares', 'Child Single', 'R3', 1.5)]
+bus_od = [('1', 's1', 's2', 'B1'), ('1', 's2', 's1', 'B1'), ('2', 's2', 's4', 'B2'), ('2', 's4', 's2', 'B2'),
+          ('3', 's1', 's2', 'B2'), ('3', 's3', 's2', np.nan)]
+bus_fares = [('Cash', 'Adult Single', 'B1', 1.5), ('Cash', 'Adult Single', 'B2', 2.5),
+             ('Leap', 'Adult Single', 'B1', 1.4), ('Cash', 'Adult Return', 'B1', 0.1),
+             ('Cash', 'Child Single', 'B1', 0.8), ('Cash', 'Child Single', 'B2', 1.2)]
+
+@pytest.fixture(scope='module')
+def indexes():
+    gpd = pytest.importorskip('geopandas')
+    import shapely
+    rail = fare_index.RailFareIndex(
+        pd.DataFrame(rail_od, columns=['Origin', 'Destination', 'Value']).assign(Zone=1),
+        pd.DataFrame(rail_fares, columns=['PaymentMeans', 'TicketType', 'FareZone', 'Fare']),
+        pd.DataFrame({'TicketType': ['Adult Weekly'], 'FareZone': [1], 'Fare': [30.0]}),
+        gpd.GeoDataFrame({'stop_name': list(stations)},
+                         geometry=[shapely.Point(lon, lat) for lat, lon in stations.values()], crs='EPSG:4326'))
+    bus = fare_index.BusFareIndex(
+        pd.DataFrame(bus_od, columns=['Route', 'Origin', 'Destination', 'Fare Band']),
+        pd.DataFrame(bus_fares, columns=['PaymentMeans', 'TicketType', 'FareZone', 'Fare']),
+        pd.DataFrame([(stage, lat, lon) for stage, (lat, lon) in stages.items()], columns=['Stage', 'Lat', 'Long']))
+    return rail, bus
+
+def _brute_force(passenger_type, max_tickets=2):
+    # {(origin label, destination label): cheapest fare over journeys of 0..max_tickets tickets}
+    rail_types = [f"{p} Single" for p in journey_planner.ticket_optimizer.rail_passenger_types[passenger_type]]
+    bus_types = [t for t in fare_index.bus_passenger_ticket_types[passenger_type] if 'Return' not in t]
+    legs = {}
+    for origin, destination, band in rail_od:
+        fares = [fare for _, ticket_type, fare_band, fare in rail_fares if fare_band == band and ticket_type in rail_types]
+        if fares:
+            key = (node_label('Rail', origin), node_label('Rail', destination))
+            legs[key] = min(legs.get(key, np.inf), min(fares))
+    for _, origin, destination, band in bus_od:
+        fares = [fare for _, ticket_type, fare_band, fare in bus_fares if fare_band == band and ticket_type in bus_types]
+        if fares:
+            key = (node_label('Bus', origin), node_label('Bus', destination))
+            legs[key] = min(legs.get(key, np.inf), min(fares))
+
+    # Nodes reachable on foot from each node, itself included
+    nodes = [node_label('Rail', s) for s in stations] + [node_label('Bus', s) for s in stages]
+    walk = {node: {node} for node in nodes}
+    for (station, (lat1, lon1)), (stage, (lat2, lon2)) in itertools.product(stations.items(), stages.items()):
+        if _haversine(lat1, lon1, lat2, lon2) <= journey_planner.default_walk_metres:
+            walk[node_label('Rail', station)].add(node_label('Bus', stage))
+            walk[node_label('Bus', stage)].add(node_label('Rail', station))
+
+    # Cheapest fare to each node after 0, 1, 2 ... tickets, walking before and after each
+    best = {}
+    for origin in nodes:
+        frontier = {node: 0.0 for node in walk[origin]}
+        best.update({(origin, node): 0.0 for node in frontier if node != origin})
+        for _ in range(max_tickets):
+            reached = {}
+            for node, fare in frontier.items():
+                for (source, target), leg_fare in legs.items():
+                    if source == node:
+                        for end in walk[target]:
+                            reached[end] = min(reached.get(end, np.inf), fare + leg_fare)
+            for node, fare in reached.items():
+                if node != origin:
+                    best[origin, node] = min(best.get((origin, node), np.inf), fare)
+            frontier = reached
+    return nodes, best
+
+@pytest.mark.parametrize('passenger_type', ['Adult', 'Child'])
+def test_best_fares_match_brute_force(indexes, passenger_type):
+    planner = journey_planner.JourneyPlanner(*indexes, passenger_type)
+    nodes, best = _brute_force(passenger_type)
+    for origin in nodes:
+        fare, tickets, _ = planner.search(origin)
+        for destination in nodes:
+            if destination == origin:
+                continue
+            d = planner.node_ids[destination]
+            expected = best.get((origin, destination), np.nan)
+            # No journey in this network needs more than two tickets
+            assert fare[d] == pytest.approx(expected, nan_ok=True), (origin, destination)
+            if not np.isnan(fare[d]):
+                assert tickets[d] <= 2
+
+                # The legs chain from origin to destination and add up to the fare
+                legs = planner.journey(origin, destination)
+                assert legs['From'].iloc[0] == origin and legs['To'].iloc[-1] == destination
+                assert (legs['From'].iloc[1:].to_numpy() == legs['To'].iloc[:-1].to_numpy()).all()
+                assert legs['Fare'].sum() == pytest.approx(fare[d])
+                assert (legs['Mode'] != 'Walk').sum() == tickets[d]
+
+def test_changing_at_b_beats_the_direct_fare(indexes):
+    planner = journey_planner.JourneyPlanner(*indexes, 'Adult')
+    legs = planner.journey(node_label('Rail', 'A'), node_label('Rail', 'C'))
+    assert list(legs['To']) == [node_label('Rail', 'B'), node_label('Rail', 'C')]
+    assert list(legs['Fare']) == [2.0, 2.0]
+
+def test_walk_links_within_walking_distance(indexes):
+    planner = journey_planner.JourneyPlanner(*indexes, 'Adult')
+    walks = planner.edges[planner.edges['mode'] == journey_planner.WALK]
+    linked = {(planner.names[s], planner.names[t]) for s, t in zip(walks['source'], walks['target'])}
+    assert linked == {('B', 's1'), ('s1', 'B'), ('C', 's4'), ('s4', 'C')}
+    assert (walks['metres'] <= journey_planner.default_walk_metres).all()
+
+def test_real_network_walk_links():
+    planner = journey_planner.journey_planner('Adult')
+    walks = planner.edges[planner.edges['mode'] == journey_planner.WALK]
+    assert len(walks)
+    assert (walks['metres'] <= journey_planner.default_walk_metres).all()
+    # Measured on the ground too, not only in the planner's projection
+    source, target = walks['source'].to_numpy(), walks['target'].to_numpy()
+    metres = _haversine(planner.lat[source], planner.lon[source], planner.lat[target], planner.lon[target])
+    assert metres.max() <= journey_planner.default_walk_metres * 1.01
+    assert (planner.modes[source] != planner.modes[target]).all()
+
+def test_unreachable_destination(indexes):
+    planner = journey_planner.JourneyPlanner(*indexes, 'Adult')
+    origin = node_label('Rail', 'A')
+    fare, tickets, predecessors = planner.search(origin)
+    for unreachable in [node_label('Rail', 'E'), node_label('Bus', 's3')]:
+        i = planner.node_ids[unreachable]
+        assert np.isnan(fare[i]) and predecessors[i] < 0 and tickets[i] == 0
+        assert planner.journey(origin, unreachable).empty
+        assert unreachable not in set(planner.fares_from(origin)['Destination'])
+
+    # An origin with no way out reaches nothing but itself
+    fare, _, _ = planner.search(node_label('Bus', 's3'))
+    assert np.isnan(np.delete(fare, planner.node_ids[node_label('Bus', 's3')])).all()
+    assert planner.fares_from(node_label('Bus', 's3')).empty
@@ -0,0 +1,120 @@
+import json
+import itertools
+import branca.element
+import pytest
+import streamlit_folium
+import fare_index
+import fare_maps
+import render_cache
+
+@pytest.fixture
+def component_calls(monkeypatch):
+    # Keyword arguments of every call to the st_folium component
+    calls = []
+    monkeypatch.setattr(streamlit_folium, '_component_func', lambda **kwargs: calls.append(kwargs))
+    return calls
+
+def _rail_map(monkeypatch):
+    # Base map and selection layer with element ids numbered from 0, so two
+    # builds give the same JavaScript; rendering changes the folium objects, so
+    # each side needs a build of its own
+    ids = itertools.count()
+    monkeypatch.setattr(branca.element.Element, '_generate_id', lambda self: f'{next(ids):032x}')
+    index = fare_index.rail_fare_index()
+    payment_means = index.payment_means[0]
+    return fare_maps.base_map(), fare_maps.rail_layer(index, index.origins[0], payment_means,
+                                                      index.ticket_types_for(payment_means)[0])
+
+@pytest.mark.parametrize('returned_objects, zoom, center', [
+    (None, None, None),
+    (['zoom', 'center', 'last_clicked'], 11, (53.35, -6.26)),
+    ([], None, None),
+])
+def test_st_folium_sends_what_streamlit_folium_sends(component_calls, monkeypatch, returned_objects, zoom, center):
+    m, layer = _rail_map(monkeypatch)
+    render_cache.st_folium(render_cache.map_payload(m), render_cache.layer_payload(layer), 'map', width=1200,
+                           returned_objects=returned_objects, zoom=zoom, center=center)
+    m, layer = _rail_map(monkeypatch)
+    streamlit_folium.st_folium(m, key='map', width=1200, returned_objects=returned_objects, zoom=zoom,
+                               center=center, feature_group_to_add=layer)
+
+    cached, upstream = component_calls
+    assert callable(cached.pop('on_change')) and callable(upstream.pop('on_change'))
+    assert cached == upstream
+
+def test_fallback_sends_what_streamlit_folium_sends(component_calls, monkeypatch):
+    monkeypatch.setattr(render_cache, 'compatible', False)
+    m, layer = _rail_map(monkeypatch)
+    base, selected = render_cache.map_payload(m), render_cache.layer_payload(layer)
+    assert base == {'map': m} and selected == {'layer': layer}
+    render_cache.st_folium(base, selected, 'map', width=1200, returned_objects=['last_clicked'])
+    m, layer = _rail_map(monkeypatch)
+    streamlit_folium.st_folium(m, key='map', width=1200, returned_objects=['last_clicked'], feature_group_to_add=layer)
+
+    cached, upstream = component_calls
+    assert callable(cached.pop('on_change')) and callable(upstream.pop('on_change'))
+    assert cached == upstream
+
+@pytest.mark.parametrize('version, missing', [('0.28.0', None), ('0.27.4', '_get_map_string')])
+def test_other_streamlit_folium_falls_back(monkeypatch, version, missing):
+    monkeypatch.setattr(render_cache.importlib.metadata, 'version', lambda name: version)
+    if missing:
+        monkeypatch.delattr(streamlit_folium, missing)
+    with pytest.warns(UserWarning, match=missing or version):
+        assert not render_cache._compatible()
+    # The fallback's folium objects are never kept
+    cache = render_cache.RenderCache(max_bytes=0)
+    cache.get_or_render(('rail', 'base'), 0, lambda: {'map': object()})
+    assert cache.stats()['entries'] == 0
+
+def test_pinned_streamlit_folium_is_compatible():
+    assert render_cache.compatible and render_cache._compatible()
+
+def _rail_app():
+    # Rail map of the origin in session state, hidden while 'hide' is set
+    import streamlit as st
+    import fare_index
+    import fare_maps
+    import render_cache
+    index = fare_index.rail_fare_index()
+    payment_means = index.payment_means[0]
+    ticket_type = index.ticket_types_for(payment_means)[0]
+    if not st.session_state.get('hide'):
+        origin = st.session_state.get('origin', index.origins[0])
+        base = render_cache.shared.get_or_render(('payload_test', 'base'), 0,
+                                                 lambda: render_cache.map_payload(fare_maps.base_map()))
+        layer = render_cache.shared.get_or_render(('payload_test', origin), 0, lambda: render_cache.layer_payload(
+            fare_maps.rail_layer(index, origin, payment_means, ticket_type)))
+        render_cache.st_folium(base, layer, 'rail_map', width=1200)
+
+def _payload_bytes(call):
+    return len(json.dumps({k: v for k, v in call.items() if k != 'on_change'}))
+
+def test_reruns_send_only_the_layer(monkeypatch):
+    from streamlit.testing.v1 import AppTest
+    calls = []
+    component = streamlit_folium._component_func
+    monkeypatch.setattr(streamlit_folium, '_component_func', lambda **kwargs: calls.append(kwargs) or component(**kwargs))
+    index = fare_index.rail_fare_index()
+
+    at = AppTest.from_function(_rail_app)
+    at.run()
+    for origin in index.origins[1:3]:
+        at.session_state['origin'] = origin
+        at.run()
+    at.session_state['hide'] = True
+    at.run()
+    at.session_state['hide'] = False
+    at.run()
+    assert not at.exception
+    first, second, third, remount = calls
+
+    # The first render carries the base map; later ones the layer and a few hundred bytes besides
+    assert first['script'] and first['js_links']
+    for call in [second, third]:
+        assert call['script'] == call['html'] == call['header'] == '' and call['js_links'] == call['css_links'] == []
+        assert call['key'] == first['key'] and call['feature_group'] != first['feature_group']
+        assert _payload_bytes(call) < len(json.dumps(call['feature_group'])) + 1000
+        assert _payload_bytes(call) < _payload_bytes(first) - len(first['script'])
+    # After a rerun without the map, the browser needs the base map again
+    assert remount['script'] == first['script'] and _payload_bytes(remount) > _payload_bytes(second)
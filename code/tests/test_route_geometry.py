@@ -0,0 +1,35 @@
+import folium
+import pytest
+import shapely
+import data_store
+import fare_index
+import fare_maps
+import route_geometry
+
+def _polylines(layer):
+    return [child for child in layer._children.values() if isinstance(child, folium.PolyLine)]
+
+def test_missing_routes_shapefile_gives_no_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_store, 'bus_routes_path', str(tmp_path / 'missing.shp'))
+    cache = route_geometry.route_geometry_cache()
+    assert cache.lines('115') == [] and cache.lines('115', 11) == []
+    assert cache.report().empty
+
+    # The bus map is drawn, just without route lines
+    index = fare_index.bus_fare_index()
+    route = index.routes[0]
+    origin = index.origins(route)[0]
+    ticket_types = fare_index.bus_passenger_ticket_types['Adult']
+    layer = fare_maps.bus_layer(index, cache, ticket_types, route, origin)
+    assert _polylines(layer) == []
+
+def test_routes_shapefile_lines(tmp_path, monkeypatch):
+    gpd = pytest.importorskip('geopandas')
+    path = tmp_path / 'routes.shp'
+    line = shapely.LineString([(-6.3, 53.3), (-6.25, 53.31), (-6.2, 53.35)])
+    gpd.GeoDataFrame({'route_name': ['115']}, geometry=[line], crs='EPSG:4326').to_file(path)
+    monkeypatch.setattr(data_store, 'bus_routes_path', str(path))
+
+    cache = route_geometry.route_geometry_cache()
+    assert cache.lines('115') == [[[lat, lon] for lon, lat in line.coords]]
+    assert cache.lines('missing') == []
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import shapely
+import data_store
+import spatial
+
+def test_fare_zones_nest():
+    # Each boundary lies inside the next, so the innermost one a point falls in is its zone
+    layers = data_store.zone_layers()
+    assert set(spatial.fare_zones) <= set(layers)
+    boundaries = [shapely.union_all(layers[name].to_crs(spatial.projected_crs).geometry.to_numpy())
+                  for name in sorted(spatial.fare_zones, key=spatial.fare_zones.get)]
+    for inner, outer in zip(boundaries, boundaries[1:]):
+        assert inner.within(outer)
+
+def test_classify_follows_nesting():
+    # A point in a zone lies in that boundary and every one outside it, and none inside it
+    index = spatial.spatial_index()
+    rng = np.random.default_rng(0)
+    zones = index.classify(rng.uniform(52.9, 53.8, 20_000), rng.uniform(-7.2, -5.9, 20_000))
+    names = sorted(spatial.fare_zones, key=spatial.fare_zones.get)
+    for number, name in enumerate(names, start=1):
+        inside = zones['zone'] == number
+        assert inside.any()
+        assert zones.loc[inside, names[number - 1:]].all().all()
+        assert not zones.loc[inside, names[:number - 1]].any().any()
+    assert not zones.loc[zones['zone'] == spatial.NO_ZONE, names].any().any()
+
+def test_stage_tree_built_once_across_threads():
+    index = spatial.SpatialIndex({}, spatial.fare_index.rail_fare_index(), spatial.fare_index.bus_fare_index())
+    routes = ['Any'] + index.bus_index.routes[:3]
+    with ThreadPoolExecutor(16) as executor:
+        trees = list(executor.map(index.stage_tree, routes * 16))
+    for i, route in enumerate(routes):
+        assert all(tree is index.stage_tree(route) for tree in trees[i::len(routes)])
@@ -0,0 +1,78 @@
+import copy
+import numpy as np
+import pytest
+import fare_index
+import ticket_optimizer
+
+# cheapest_all() against costing every option for every OD pair one at a time
+# with the index's own quote() / quote_period()
+
+patterns = [(1, 1), (7, 1), (5, 2), (7, 3), (0, 1), (3, 0)]
+
+@pytest.fixture(scope='module')
+def rail():
+    # Zone 4 loses its period fares, so its pairs have no period product at all
+    index = copy.copy(fare_index.rail_fare_index())
+    index.period_fares = index.period_fares.copy()
+    index.period_fares[:, 4] = np.nan
+    return index
+
+def _pair_loop(index, optimizer, days_per_week, return_trips_per_day):
+    n = len(index.stations)
+    options = list(optimizer.options.itertuples())
+    best, cost, singles = np.full((n, n), -1), np.full((n, n), np.nan), np.full((n, n), np.nan)
+    for o, origin in enumerate(index.stations):
+        for d, destination in enumerate(index.stations):
+            for i, option in enumerate(options):
+                if option.PaymentMeans == 'Period':
+                    _, fare = index.quote_period(origin, destination, option.TicketType)
+                else:
+                    _, fare = index.quote(origin, destination, option.PaymentMeans, option.TicketType)
+                if np.isnan(fare):
+                    continue
+                weekly = fare * ticket_optimizer.tickets_per_week(option.Kind, days_per_week, return_trips_per_day)
+                # First option wins a tie, as argmin does
+                if best[o, d] < 0 or weekly < cost[o, d]:
+                    best[o, d], cost[o, d] = i, weekly
+                if option.Kind == 'Single' and not weekly >= singles[o, d]:
+                    singles[o, d] = weekly
+    return best, cost, singles
+
+@pytest.mark.parametrize('passenger_type', list(ticket_optimizer.rail_passenger_types))
+@pytest.mark.parametrize('days_per_week, return_trips_per_day', patterns)
+def test_cheapest_all_matches_pair_loop(rail, passenger_type, days_per_week, return_trips_per_day):
+    optimizer = ticket_optimizer.TicketOptimizer(rail, passenger_type)
+    # Every product of the passenger's fare types is an option, and nothing else
+    fare_types = ticket_optimizer.rail_passenger_types[passenger_type]
+    sold = [(pm, tt) for pm, tt in rail.products] + [('Period', tt) for tt in rail.period_ticket_types]
+    assert sorted(zip(optimizer.options['PaymentMeans'], optimizer.options['TicketType'])) == \
+        sorted((pm, tt) for pm, tt in sold if ticket_optimizer.ticket_kind(tt)[0] in fare_types)
+
+    best, cost, singles = optimizer.cheapest_all(days_per_week, return_trips_per_day)
+    expected_best, expected_cost, expected_singles = _pair_loop(rail, optimizer, days_per_week, return_trips_per_day)
+
+    assert best.dtype == np.int16
+    np.testing.assert_array_equal(best, expected_best)
+    np.testing.assert_allclose(cost, expected_cost, rtol=1e-12)
+    np.testing.assert_allclose(singles, expected_singles, rtol=1e-12)
+
+def test_zone_without_period_product(rail):
+    optimizer = ticket_optimizer.TicketOptimizer(rail, 'Adult')
+    best, cost, _ = optimizer.cheapest_all(5)
+    zone_4 = rail.od_zone == 4
+    assert zone_4.any()
+    kinds = optimizer.options['Kind'].to_numpy()[best[zone_4 & (best >= 0)]]
+    assert set(kinds) <= {'Single', 'Day Return'}
+    # Nothing at all is sold where there is neither a band nor a zone
+    unpriced = (rail.od_band < 0) & (rail.od_zone < 0)
+    assert (best[unpriced] == -1).all() and np.isnan(cost[unpriced]).all()
+
+def test_cheapest_matches_compare(rail):
+    # The per-journey table's first row is the batch's choice
+    optimizer = ticket_optimizer.TicketOptimizer(rail, 'Young Adult')
+    best, cost, _ = optimizer.cheapest_all(4, 2)
+    o, d = np.argwhere(best >= 0)[::97].T
+    for i, j in zip(o, d):
+        table = optimizer.compare(rail.stations[i], rail.stations[j], 4, 2)
+        assert table['Weekly'].iloc[0] == pytest.approx(cost[i, j])
+        assert table['Ticket'].iloc[0] == optimizer.options['Ticket'].iloc[best[i, j]]
@@ -0,0 +1,214 @@
+import glob
+import json
+import os
+import threading
+import numpy as np
+import pytest
+import shapely
+import data_store
+import vector_tiles
+
+def _built(path):
+    # Metadata of tiles current for the sources, without cutting any tiles
+    metadata = {'version': 'test', 'min_zoom': 6, 'max_zoom': 14, 'layers': ['zones'],
+                'sources': vector_tiles._source_hashes()}
+    with open(path / 'metadata.json', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+    return str(path)
+
+def test_tiles_off_unless_url_set(tmp_path, monkeypatch):
+    path = _built(tmp_path)
+    monkeypatch.delenv('FARECALC_TILE_URL', raising=False)
+    threads = threading.active_count()
+    assert vector_tiles.tile_url(path) is None
+    assert vector_tiles.version(path) is None
+    # No server is started behind the dashboard's back
+    assert threading.active_count() == threads
+
+def test_tile_url_from_config(tmp_path, monkeypatch):
+    path = _built(tmp_path)
+    monkeypatch.setenv('FARECALC_TILE_URL', 'https://tiles.example.org/fares/')
+    assert vector_tiles.tile_url(path) == 'https://tiles.example.org/fares/{z}/{x}/{y}.pbf?v=test'
+    monkeypatch.setenv('FARECALC_VECTOR_TILES', '0')
+    assert vector_tiles.tile_url(path) is None
+
+def test_serve_reports_bind_failure(tmp_path, capsys):
+    taken = vector_tiles.server(str(tmp_path), 0)
+    try:
+        port = taken.server_address[1]
+        with pytest.raises(SystemExit):
+            vector_tiles.main(['serve', '--path', str(tmp_path), '--port', str(port)])
+        assert f"cannot serve on 127.0.0.1:{port}" in capsys.readouterr().err
+    finally:
+        taken.server_close()
+
+# Tiles decoded with the protobuf library from the published vector_tile.proto
+# schema (version 2), not with anything in vector_tiles.py
+
+@pytest.fixture(scope='module')
+def Tile():
+    pytest.importorskip('google.protobuf')
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    field = descriptor_pb2.FieldDescriptorProto
+    packed = descriptor_pb2.FieldOptions(packed=True)
+    proto = descriptor_pb2.FileDescriptorProto(name='vector_tile.proto', package='vector_tile', syntax='proto2')
+    tile = proto.message_type.add(name='Tile')
+    value = tile.nested_type.add(name='Value')
+    value.field.add(name='string_value', number=1, type=field.TYPE_STRING, label=field.LABEL_OPTIONAL)
+    feature = tile.nested_type.add(name='Feature')
+    feature.field.add(name='id', number=1, type=field.TYPE_UINT64, label=field.LABEL_OPTIONAL)
+    feature.field.add(name='tags', number=2, type=field.TYPE_UINT32, label=field.LABEL_REPEATED, options=packed)
+    feature.field.add(name='type', number=3, type=field.TYPE_ENUM, type_name='.vector_tile.Tile.GeomType',
+                      label=field.LABEL_OPTIONAL)
+    feature.field.add(name='geometry', number=4, type=field.TYPE_UINT32, label=field.LABEL_REPEATED, options=packed)
+    geom_type = tile.enum_type.add(name='GeomType')
+    for number, name in enumerate(['UNKNOWN', 'POINT', 'LINESTRING', 'POLYGON']):
+        geom_type.value.add(name=name, number=number)
+    layer = tile.nested_type.add(name='Layer')
+    layer.field.add(name='version', number=15, type=field.TYPE_UINT32, label=field.LABEL_REQUIRED)
+    layer.field.add(name='name', number=1, type=field.TYPE_STRING, label=field.LABEL_REQUIRED)
+    layer.field.add(name='features', number=2, type=field.TYPE_MESSAGE, type_name='.vector_tile.Tile.Feature',
+                    label=field.LABEL_REPEATED)
+    layer.field.add(name='keys', number=3, type=field.TYPE_STRING, label=field.LABEL_REPEATED)
+    layer.field.add(name='values', number=4, type=field.TYPE_MESSAGE, type_name='.vector_tile.Tile.Value',
+                    label=field.LABEL_REPEATED)
+    layer.field.add(name='extent', number=5, type=field.TYPE_UINT32, label=field.LABEL_OPTIONAL)
+    tile.field.add(name='layers', number=3, type=field.TYPE_MESSAGE, type_name='.vector_tile.Tile.Layer',
+                   label=field.LABEL_REPEATED)
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName('vector_tile.Tile'))
+
+def _parse(Tile, data):
+    tile = Tile()
+    tile.ParseFromString(data)
+    return tile
+
+def _parts(commands):
+    # Geometry command stream -> [[(x, y), ...]] in tile coordinates; closed rings repeat their first point
+    parts, cursor, i = [], np.zeros(2, dtype=np.int64), 0
+    while i < len(commands):
+        command, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+        if command == vector_tiles.CLOSE_PATH:
+            parts[-1].append(parts[-1][0])
+            continue
+        for _ in range(count):
+            cursor = cursor + [(value >> 1) ^ -(value & 1) for value in commands[i:i + 2]]
+            i += 2
+            if command == vector_tiles.MOVE_TO:
+                parts.append([tuple(cursor)])
+            else:
+                parts[-1].append(tuple(cursor))
+    return parts
+
+def _properties(layer, feature):
+    return {layer.keys[k]: layer.values[v].string_value for k, v in zip(feature.tags[::2], feature.tags[1::2])}
+
+def test_encode_tile_round_trip(Tile):
+    line = np.array([[0, 0], [10, 5], [300, 4095], [4200, -60]])
+    exterior = np.array([[100, 100], [200, 100], [200, 200], [100, 200]])
+    hole = np.array([[120, 120], [120, 180], [180, 180], [180, 120]])
+    big = 2 ** 20
+    tile = _parse(Tile, vector_tiles.encode_tile({
+        'routes': [({'route': '115'}, vector_tiles.LINESTRING, [line, line[::-1] + big])],
+        'zones': [({'zone': 'city', 'kind': 'boundary'}, vector_tiles.POLYGON, [exterior, hole]),
+                  ({'zone': '33km'}, vector_tiles.POLYGON, [exterior + 1000])],
+    }))
+
+    routes, zones = tile.layers
+    assert (routes.name, routes.version, routes.extent) == ('routes', 2, vector_tiles.extent)
+    assert routes.features[0].type == vector_tiles.LINESTRING
+    assert _properties(routes, routes.features[0]) == {'route': '115'}
+    assert _parts(list(routes.features[0].geometry)) == [list(map(tuple, line)),
+                                                         list(map(tuple, line[::-1] + big))]
+
+    assert [feature.id for feature in zones.features] == [1, 2]
+    assert _properties(zones, zones.features[0]) == {'zone': 'city', 'kind': 'boundary'}
+    assert _properties(zones, zones.features[1]) == {'zone': '33km'}
+    assert _parts(list(zones.features[0].geometry)) == [list(map(tuple, ring)) + [tuple(ring[0])]
+                                                        for ring in (exterior, hole)]
+
+@pytest.fixture(scope='module')
+def built_tiles(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('tiles') / 'tiles')
+    vector_tiles.build(path, range(10, 11), log=lambda message: None)
+    return path
+
+def _tiles(path):
+    for name in sorted(glob.glob(os.path.join(path, '*', '*', '*.pbf'))):
+        z, x, y = (int(part) for part in os.path.relpath(name, path)[:-len('.pbf')].split(os.sep))
+        with open(name, 'rb') as f:
+            yield (z, x, y), f.read()
+
+def _to_mercator(parts, zoom, x, y):
+    minx, _, _, maxy = vector_tiles.tile_bounds(zoom, x, y)
+    scale = vector_tiles.tile_span(zoom) / vector_tiles.extent
+    return [np.column_stack([minx + np.array(part)[:, 0] * scale, maxy - np.array(part)[:, 1] * scale])
+            for part in parts]
+
+def _decoded(Tile, data, zoom, x, y):
+    # {(layer, name): (geometry type, [web-mercator parts])}, all features of a name together
+    decoded = {}
+    for layer in _parse(Tile, data).layers:
+        assert layer.version == 2 and layer.extent == vector_tiles.extent
+        for feature in layer.features:
+            (name,) = _properties(layer, feature).values()
+            geometry_type, parts = decoded.setdefault((layer.name, name), (feature.type, []))
+            assert feature.type == geometry_type
+            parts += _to_mercator(_parts(list(feature.geometry)), zoom, x, y)
+    return decoded
+
+def _distances(coords, lines):
+    # Distance from each point to the nearest of lines, over an STRtree of their segments
+    parts = [shapely.get_coordinates(part) for part in shapely.get_parts(lines)]
+    segments = np.concatenate([np.stack([part[:-1], part[1:]], axis=1) for part in parts if len(part) > 1])
+    _, distances = shapely.STRtree(shapely.linestrings(segments)).query_nearest(
+        shapely.points(coords), return_distance=True, all_matches=False)
+    return distances
+
+def test_built_tiles_decode_to_source_geometry(Tile, built_tiles):
+    sources = {}
+    for layer, parts in vector_tiles.sources().items():
+        for path, key, value in parts:
+            frame = data_store.read_shapefile(path, encoding='unicode_escape').to_crs('EPSG:3857')
+            names = frame[value].astype(str) if key == 'route' else [value] * len(frame)
+            for name, geometry in zip(names, frame.geometry):
+                sources.setdefault((layer, name), []).append(geometry)
+    sources = {key: shapely.union_all(geometries) for key, geometries in sources.items()}
+
+    seen = set()
+    for (zoom, x, y), data in _tiles(built_tiles):
+        bounds = vector_tiles.tile_bounds(zoom, x, y)
+        box = shapely.box(*bounds)
+        clipped = {key: shapely.clip_by_rect(source, *bounds) for key, source in sources.items()}
+        # Simplified by half a tile unit, then rounded to whole units
+        tolerance = (0.5 + 2 ** -0.5) * vector_tiles.tile_span(zoom) / vector_tiles.extent
+        decoded = _decoded(Tile, data, zoom, x, y)
+        assert {key for key, source in clipped.items() if source.length > tolerance} <= set(decoded)
+        for key, (geometry_type, parts) in decoded.items():
+            source = sources[key]
+            if geometry_type == vector_tiles.POLYGON:
+                # Exteriors wind clockwise on screen, each followed by its holes
+                polygons = []
+                for ring in parts:
+                    if shapely.LinearRing(ring).is_ccw:
+                        polygons[-1][1].append(ring)
+                    else:
+                        polygons.append((ring, []))
+                geometry = shapely.make_valid(shapely.MultiPolygon(polygons))
+                # Inside the tile the edges move by at most the tolerance
+                difference = geometry.intersection(box).symmetric_difference(clipped[key])
+                assert difference.area <= tolerance * max(source.boundary.intersection(box).length, tolerance)
+            else:
+                # Every decoded vertex lies on the source lines and every source vertex
+                # in the tile on a decoded line; tiles are cut with a buffer, so lines
+                # leaving the tile are covered up to its edge
+                geometry = shapely.MultiLineString(parts)
+                nearby = shapely.clip_by_rect(source, *box.buffer(4 * vector_tiles.buffer * tolerance).bounds)
+                assert _distances(shapely.get_coordinates(geometry), nearby).max() <= tolerance * 1.001
+                inside = shapely.get_coordinates(clipped[key])
+                if len(inside):
+                    assert _distances(inside, geometry).max() <= tolerance * 1.001
+            seen.add(key[0])
+    assert seen == set(vector_tiles.sources())
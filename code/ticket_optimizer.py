@@ -0,0 +1,173 @@
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+import fare_index
+
+# Cheapest way to pay for regular rail travel. A travel pattern (return trips
+# per travel day, travel days per week) is costed per week for every ticket a
+# passenger type can buy: singles and day returns on each payment means, and
+# daily, weekly, monthly and annual period tickets, with the longer periods
+# spread over the weeks they cover. Costs are arrays over destinations (or the
+# whole OD matrix), so the cheapest ticket for every journey is one argmin.
+# Run `python ticket_optimizer.py --help` for the whole-network batch.
+
+weeks_per_year = 52
+
+# Ticket types end in one of these; the words before it are the passenger type
+ticket_kinds = ['Single', 'Day Return', 'Daily', 'Weekly', 'Monthly', 'Annual']
+
+# Rail fare types open to each passenger type
+rail_passenger_types = {
+    'Adult': ['Adult'],
+    'Young Adult': ['Young Adult', 'Adult'],
+    'Child': ['Child'],
+}
+
+def ticket_kind(ticket_type):
+    # (passenger type, kind), e.g. 'Young Adult Day Return' -> ('Young Adult', 'Day Return')
+    for kind in ticket_kinds:
+        if ticket_type.endswith(' ' + kind):
+            return ticket_type[:-len(kind) - 1], kind
+    return None, None
+
+def tickets_per_week(kind, days_per_week, return_trips_per_day=1):
+    # Tickets of a kind needed for one week of the pattern
+    return {
+        'Single': 2 * return_trips_per_day * days_per_week,
+        'Day Return': return_trips_per_day * days_per_week,
+        'Daily': days_per_week,
+        'Weekly': 1,
+        'Monthly': 12 / weeks_per_year,
+        'Annual': 1 / weeks_per_year,
+    }[kind]
+
+class TicketOptimizer:
+    def __init__(self, index, passenger_type):
+        # index is a fare_index.RailFareIndex
+        self.index = index
+        self.passenger_type = passenger_type
+        fare_types = rail_passenger_types[passenger_type]
+
+        # Options priced by fare band come first, then those priced by zone
+        options, band_rows, zone_rows = [], [], []
+        for payment_means, ticket_type in index.products:
+            passenger, kind = ticket_kind(ticket_type)
+            if passenger in fare_types:
+                options.append((payment_means, ticket_type, kind, f"{ticket_type} ({payment_means})"))
+                band_rows.append(index.fares[index.payment_means.index(payment_means),
+                                             index.ticket_types.index(ticket_type)])
+        for ticket_type in index.period_ticket_types:
+            passenger, kind = ticket_kind(ticket_type)
+            if passenger in fare_types:
+                options.append(('Period', ticket_type, kind, ticket_type))
+                zone_rows.append(index.period_fares[index.period_ticket_types.index(ticket_type)])
+
+        self.options = pd.DataFrame(options, columns=['PaymentMeans', 'TicketType', 'Kind', 'Ticket'])
+        self.band_fares = np.array(band_rows).reshape(len(band_rows), len(index.bands))
+        self.zone_fares = np.array(zone_rows).reshape(len(zone_rows), index.period_fares.shape[1])
+        self.singles = (self.options['Kind'] == 'Single').to_numpy()
+
+    def tickets_per_week(self, days_per_week, return_trips_per_day=1):
+        return np.array([tickets_per_week(kind, days_per_week, return_trips_per_day) for kind in self.options['Kind']])
+
+    def weekly_costs(self, bands, zones, days_per_week, return_trips_per_day=1):
+        # float[options, *bands.shape]: a week of travel on each option, NaN where it is not sold
+        bands, zones = np.asarray(bands, dtype=np.int64), np.asarray(zones, dtype=np.int64)
+        fares = np.concatenate([fare_index._lookup(self.band_fares, bands), fare_index._lookup(self.zone_fares, zones)])
+        per_week = self.tickets_per_week(days_per_week, return_trips_per_day)
+        return fares * per_week.reshape((-1,) + (1,) * bands.ndim)
+
+    def cheapest(self, bands, zones, days_per_week, return_trips_per_day=1):
+        # (option id, weekly cost, cheapest singles weekly cost) per journey; option -1 where nothing is sold
+        costs = self.weekly_costs(bands, zones, days_per_week, return_trips_per_day)
+        filled = np.where(np.isnan(costs), np.inf, costs)
+        best = np.argmin(filled, axis=0)
+        cost = np.take_along_axis(filled, best[None], axis=0)[0]
+        singles = filled[self.singles].min(axis=0, initial=np.inf)
+        priced = np.isfinite(cost)
+        return (np.where(priced, best, -1), np.where(priced, cost, np.nan),
+                np.where(np.isfinite(singles), singles, np.nan))
+
+    def cheapest_from(self, origin, days_per_week, return_trips_per_day=1):
+        # Cheapest option to every priced destination from origin that has a location on the map
+        index = self.index
+        o = index.station_ids[origin]
+        bands, zones = index.od_band[o].astype(np.int64), index.od_zone[o].astype(np.int64)
+        best, cost, singles = self.cheapest(bands, zones, days_per_week, return_trips_per_day)
+        keep = np.flatnonzero((best >= 0) & ~np.isnan(index.lat) & (bands >= 0))
+        options = self.options.iloc[best[keep]]
+        return pd.DataFrame({
+            'Origin': origin,
+            'Destination': np.asarray(index.stations, dtype=object)[keep],
+            'Value': np.asarray(index.bands, dtype=object)[bands[keep]],
+            'Zone': zones[keep],
+            'Ticket': options['Ticket'].to_numpy(),
+            'PaymentMeans': options['PaymentMeans'].to_numpy(),
+            'TicketType': options['TicketType'].to_numpy(),
+            'Kind': options['Kind'].to_numpy(),
+            'Weekly': cost[keep],
+            'Singles': singles[keep],
+            'Saving': singles[keep] - cost[keep],
+            'lat': index.lat[keep],
+            'lon': index.lon[keep],
+        })
+
+    def compare(self, origin, destination, days_per_week, return_trips_per_day=1):
+        # Every option sold for one journey, cheapest first
+        o, d = self.index.station_ids[origin], self.index.station_ids[destination]
+        costs = self.weekly_costs(self.index.od_band[o, d], self.index.od_zone[o, d],
+                                  days_per_week, return_trips_per_day)
+        table = self.options.assign(Tickets=self.tickets_per_week(days_per_week, return_trips_per_day), Weekly=costs)
+        table['Yearly'] = table['Weekly'] * weeks_per_year
+        return table.dropna(subset=['Weekly']).sort_values('Weekly', kind='stable').reset_index(drop=True)
+
+    def cheapest_all(self, days_per_week, return_trips_per_day=1):
+        # Batch form over the whole OD matrix: (option id int16[n, n], weekly cost, singles cost)
+        best, cost, singles = self.cheapest(self.index.od_band, self.index.od_zone, days_per_week, return_trips_per_day)
+        return best.astype(np.int16), cost, singles
+
+    def cheapest_pairs(self, days_per_week, return_trips_per_day=1):
+        # cheapest_all() as one row per priced origin/destination pair
+        best, cost, singles = self.cheapest_all(days_per_week, return_trips_per_day)
+        o, d = np.nonzero(best >= 0)
+        stations = np.asarray(self.index.stations, dtype=object)
+        options = self.options.iloc[best[o, d]]
+        return pd.DataFrame({
+            'Origin': stations[o],
+            'Destination': stations[d],
+            'Ticket': options['Ticket'].to_numpy(),
+            'Kind': options['Kind'].to_numpy(),
+            'Weekly': cost[o, d],
+            'Singles': singles[o, d],
+            'Saving': singles[o, d] - cost[o, d],
+        })
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cheapest rail ticket for a travel pattern, for every OD pair.")
+    parser.add_argument('--passenger', choices=list(rail_passenger_types), default='Adult')
+    parser.add_argument('--days', type=int, default=5, help="travel days per week (1-7)")
+    parser.add_argument('--trips', type=int, default=1, help="return trips per travel day")
+    parser.add_argument('--out', help="write the cheapest ticket for every pair to this CSV")
+    args = parser.parse_args(argv)
+    if not 1 <= args.days <= 7:
+        parser.error("--days must be between 1 and 7")
+
+    optimizer = TicketOptimizer(fare_index.rail_fare_index(), args.passenger)
+    repeats = 100
+    start = time.perf_counter()
+    for _ in range(repeats):
+        best, _, _ = optimizer.cheapest_all(args.days, args.trips)
+    elapsed = (time.perf_counter() - start) / repeats
+    pairs = int((best >= 0).sum())
+    print(f"{pairs:,} OD pairs x {len(optimizer.options)} options in {elapsed * 1000:.2f}ms "
+          f"({pairs / elapsed:,.0f} pairs/s)", file=sys.stderr)
+
+    table = optimizer.cheapest_pairs(args.days, args.trips)
+    print(table.groupby('Ticket')['Weekly'].agg(['count', 'mean']).to_string(float_format='{:.2f}'.format))
+    if args.out:
+        table.to_csv(args.out, index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+import pandas as pd
+
+# Timing spans for the dashboard's hot path. A trace covers one rerun of a view;
+# span() marks a stage within it and may be called from any module (fare_maps,
+# data_store, ...) - it is a shared no-op when no trace is active, so the cost
+# when disabled is one context variable lookup.
+#
+# With FARECALC_TIMING=1 every trace is logged as one JSON line on the
+# 'farecalc.timing' logger (stderr unless logging is configured elsewhere):
+#   {"ts": ..., "view": "rail", "params": {...}, "total_ms": ..., "spans": {"map.zones": ..., ...}}
+# `python timing.py LOGFILE...` aggregates those lines into p50/p95 per stage.
+
+logger = logging.getLogger('farecalc.timing')
+log_enabled = os.environ.get('FARECALC_TIMING', '').lower() in ('1', 'true', 'yes')
+
+_current = contextvars.ContextVar('timing_trace', default=None)
+_disabled = contextlib.nullcontext()
+
+if log_enabled and not logger.handlers and not logging.getLogger().handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+class Trace:
+    def __init__(self, view, params):
+        self.view = view
+        self.params = params
+        self.spans = {}
+        self.total = None
+        self._stack = []
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        # Nested spans are named parent.child; repeated stages accumulate
+        self._stack.append(stage)
+        name = '.'.join(self._stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+            self._stack.pop()
+
+    def table(self):
+        # Stages in the order they started, with milliseconds and share of the total
+        table = pd.DataFrame({'stage': list(self.spans), 'ms': [s * 1000 for s in self.spans.values()]})
+        table['%'] = table['ms'] / (self.total * 1000) * 100 if self.total else float('nan')
+        return table
+
+    def record(self):
+        return {
+            'ts': time.time(),
+            'view': self.view,
+            'params': self.params,
+            'total_ms': round(self.total * 1000, 3),
+            'spans': {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()},
+        }
+
+@contextlib.contextmanager
+def trace(view, enabled=False, **params):
+    # Trace one rerun of view when enabled (e.g. for the debug panel) or logging
+    # is on; yields the Trace, or None when disabled
+    if not (enabled or log_enabled):
+        yield None
+        return
+    current = Trace(view, params)
+    token = _current.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.total = time.perf_counter() - start
+        _current.reset(token)
+        if log_enabled:
+            logger.info(json.dumps(current.record(), default=str))
+
+def span(stage):
+    current = _current.get()
+    return _disabled if current is None else current.span(stage)
+
+def annotate(**params):
+    # Add selection parameters to the active trace
+    current = _current.get()
+    if current is not None:
+        current.params.update(params)
+
+def read_log(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('{'):
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+    return records
+
+def summarise(records):
+    # p50/p95/max milliseconds per view and stage, with 'total' for the whole rerun
+    rows = [{'view': r['view'], 'stage': stage, 'ms': ms} for r in records
+            for stage, ms in [('total', r['total_ms']), *r['spans'].items()]]
+    if not rows:
+        return pd.DataFrame(columns=['view', 'stage', 'count', 'p50', 'p95', 'max'])
+    grouped = pd.DataFrame(rows).groupby(['view', 'stage'])['ms']
+    return pd.DataFrame({
+        'count': grouped.count(),
+        'p50': grouped.quantile(0.5),
+        'p95': grouped.quantile(0.95),
+        'max': grouped.max(),
+    }).reset_index()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("usage: python timing.py LOGFILE...")
+    with pd.option_context('display.width', 200, 'display.max_rows', 500):
+        print(summarise(read_log(sys.argv[1:])).to_string(index=False, float_format='{:.1f}'.format))
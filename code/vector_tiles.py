@@ -0,0 +1,322 @@
+import argparse
+import functools
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+import data_store
+
+# Mapbox Vector Tiles of the bus routes, rail routes and zone boundaries, so the
+# browser fetches only the geometry in view instead of every line inline in the
+# map HTML. `python vector_tiles.py build` cuts the layers into
+# data/tiles/{z}/{x}/{y}.pbf for zoom_levels, each simplified to the tile's
+# resolution and clipped with a small buffer, plus a metadata.json with the
+# sha256 of every source. The maps use the tiles only when FARECALC_TILE_URL
+# gives the base URL browsers fetch them from, e.g. a static file host or
+# `python vector_tiles.py serve` run next to the dashboard; otherwise, and when
+# the tiles' sources have changed since they were built, the maps draw the
+# geometry inline.
+#
+#   python vector_tiles.py build [--min-zoom 6] [--max-zoom 14]
+#   python vector_tiles.py serve [--host 127.0.0.1] [--port 8765]
+
+default_tiles_path = os.path.join(data_store.data_path, 'tiles')
+min_zoom, max_zoom = 6, 14
+extent = 4096          # tile coordinate range
+buffer = 64            # clip buffer around each tile, in tile units
+world = 20037508.342789244   # half the web-mercator world width in metres
+tile_port = int(os.environ.get('FARECALC_TILE_PORT', 8765))
+
+routes_int_path = os.path.join(data_store.gis_path, "routesint.shp")
+
+def sources():
+    # Tile layer -> [(shapefile, property, column or fixed value)]; routes are
+    # named by their 'route_name' and zones by their key in data_store.zone_paths
+    layers = {'zones': [(path, 'zone', name) for name, path in data_store.zone_paths.items()]}
+    if os.path.exists(data_store.bus_routes_path):
+        layers['routes'] = [(data_store.bus_routes_path, 'route', 'route_name')]
+    if os.path.exists(routes_int_path):
+        layers['rail_routes'] = [(routes_int_path, 'route', 'route_name')]
+    return layers
+
+def _source_paths():
+    return [path for layer in sources().values() for shapefile, _, _ in layer
+            for path in data_store.shapefile_paths(shapefile)]
+
+def _source_hashes():
+    hashes = {}
+    for path in _source_paths():
+        with open(path, 'rb') as f:
+            hashes[os.path.relpath(path, os.path.join(data_store.main_path, '..')).replace(os.sep, '/')] = \
+                hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+# Protobuf encoding of the vector tile schema (vector_tile.proto, version 2)
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _field(number, payload):
+    # Length-delimited field
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+def _packed(values):
+    # Packed varints, all values at once: 7-bit groups with a continuation bit on all but the last
+    values = np.asarray(values, dtype=np.uint64)
+    groups = (values[:, None] >> (7 * np.arange(5, dtype=np.uint64))) & np.uint64(0x7f)
+    count = 1 + sum((values >= np.uint64(1 << (7 * k))).astype(np.int64) for k in range(1, 5))
+    position = np.arange(5)[None, :]
+    groups = np.where(position < (count - 1)[:, None], groups | np.uint64(0x80), groups)
+    return groups[position < count[:, None]].astype(np.uint8).tobytes()
+
+def _zigzag(values):
+    return (values << 1) ^ (values >> 31)
+
+def _command(command, count):
+    return command & 0x7 | count << 3
+
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+LINESTRING, POLYGON = 2, 3
+
+def _geometry(parts, closed):
+    # Command stream for parts (int arrays of tile coordinates); closed parts are polygon rings
+    stream, cursor = [], np.zeros(2, dtype=np.int64)
+    for part in parts:
+        deltas = np.diff(np.vstack([cursor, part]), axis=0)
+        cursor = part[-1]
+        stream.append([_command(MOVE_TO, 1), *_zigzag(deltas[0])])
+        stream.append([_command(LINE_TO, len(part) - 1)])
+        stream.append(_zigzag(deltas[1:]).ravel())
+        if closed:
+            stream.append([_command(CLOSE_PATH, 1)])
+    return np.concatenate([np.asarray(chunk, dtype=np.int64) for chunk in stream])
+
+def _ring_area(ring):
+    # Shoelace area in tile coordinates; positive is clockwise on screen (y down)
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2
+
+def _tile_parts(geometry, transform):
+    # (geometry type, [int arrays]) of a clipped geometry in tile coordinates;
+    # polygon exteriors clockwise and holes anticlockwise, rings left open
+    import shapely
+    if geometry.geom_type in ('Polygon', 'MultiPolygon'):
+        parts = []
+        for polygon in getattr(geometry, 'geoms', [geometry]):
+            for i, ring in enumerate([polygon.exterior, *polygon.interiors]):
+                coords = _dedupe(transform(shapely.get_coordinates(ring)))
+                if len(coords) < 4:
+                    if i == 0:
+                        break
+                    continue
+                if (_ring_area(coords) > 0) != (i == 0):
+                    coords = coords[::-1]
+                parts.append(coords[:-1])
+        return POLYGON, parts
+    lines = getattr(geometry, 'geoms', [geometry])
+    parts = [_dedupe(transform(shapely.get_coordinates(line))) for line in lines
+             if line.geom_type == 'LineString']
+    return LINESTRING, [part for part in parts if len(part) >= 2]
+
+def _dedupe(coords):
+    # Rounded tile coordinates without consecutive repeats
+    coords = np.round(coords).astype(np.int64)
+    keep = np.concatenate([[True], (np.diff(coords, axis=0) != 0).any(axis=1)])
+    return coords[keep]
+
+def encode_tile(layers):
+    # layers: {name: [(properties dict, geometry type, parts)]} -> tile bytes
+    tile = b''
+    for name, features in layers.items():
+        keys, values, encoded = {}, {}, []
+        for i, (properties, geometry_type, parts) in enumerate(features):
+            tags = []
+            for key, value in properties.items():
+                tags += [keys.setdefault(key, len(keys)), values.setdefault(str(value), len(values))]
+            encoded.append(_field(2, _varint(1 << 3) + _varint(i + 1) + _field(2, _packed(tags))
+                                  + _varint(3 << 3) + _varint(geometry_type)
+                                  + _field(4, _packed(_geometry(parts, geometry_type == POLYGON)))))
+        layer = _varint(15 << 3) + _varint(2) + _field(1, name.encode('utf-8')) + b''.join(encoded)
+        layer += b''.join(_field(3, key.encode('utf-8')) for key in keys)
+        layer += b''.join(_field(4, _field(1, value.encode('utf-8'))) for value in values)
+        layer += _varint(5 << 3) + _varint(extent)
+        tile += _field(3, layer)
+    return tile
+
+# Tiling
+
+def tile_span(zoom):
+    return 2 * world / 2 ** zoom
+
+def tile_bounds(zoom, x, y):
+    # (minx, miny, maxx, maxy) of a tile in web-mercator metres
+    span = tile_span(zoom)
+    return -world + x * span, world - (y + 1) * span, -world + (x + 1) * span, world - y * span
+
+def tile_range(zoom, bounds):
+    # x and y tile ranges covering web-mercator bounds
+    span = tile_span(zoom)
+    minx, miny, maxx, maxy = bounds
+    last = 2 ** zoom - 1
+    xs = int(np.clip((minx + world) // span, 0, last)), int(np.clip((maxx + world) // span, 0, last))
+    ys = int(np.clip((world - maxy) // span, 0, last)), int(np.clip((world - miny) // span, 0, last))
+    return range(xs[0], xs[1] + 1), range(ys[0], ys[1] + 1)
+
+def _read_layers():
+    # {layer: (properties list, web-mercator geometry array)}
+    layers = {}
+    for name, parts in sources().items():
+        properties, geometries = [], []
+        for path, key, value in parts:
+            frame = data_store.read_shapefile(path, encoding='unicode_escape').to_crs('EPSG:3857')
+            if key == 'route':
+                properties += [{key: str(route)} for route in frame[value]]
+            else:
+                properties += [{key: value}] * len(frame)
+            geometries.append(frame.geometry.to_numpy())
+        layers[name] = (properties, np.concatenate(geometries))
+    return layers
+
+def build(path=default_tiles_path, zooms=range(min_zoom, max_zoom + 1), log=print):
+    # Write every non-empty tile of every zoom level, replacing any earlier build
+    import shapely
+    start = time.perf_counter()
+    hashes = _source_hashes()
+    layers = _read_layers()
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+    tiles, total_bytes = 0, 0
+    for zoom in zooms:
+        span = tile_span(zoom)
+        # Half a tile unit at this zoom; anything finer is lost to rounding
+        simplified = {name: (properties, shapely.simplify(geometries, span / extent / 2))
+                      for name, (properties, geometries) in layers.items()}
+        trees = {name: shapely.STRtree(geometries) for name, (_, geometries) in simplified.items()}
+        bounds = np.array([shapely.total_bounds(geometries) for _, geometries in simplified.values()])
+        xs, ys = tile_range(zoom, (*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0)))
+        for x in xs:
+            for y in ys:
+                minx, miny, maxx, maxy = tile_bounds(zoom, x, y)
+                pad = span * buffer / extent
+                box = (minx - pad, miny - pad, maxx + pad, maxy + pad)
+                scale = extent / span
+                transform = lambda xy: np.column_stack([(xy[:, 0] - minx) * scale, (maxy - xy[:, 1]) * scale])
+                content = {}
+                for name, (properties, geometries) in simplified.items():
+                    hits = trees[name].query(shapely.box(*box))
+                    features = []
+                    for i, clipped in zip(hits, shapely.clip_by_rect(geometries[hits], *box)):
+                        if clipped.is_empty:
+                            continue
+                        geometry_type, parts = _tile_parts(clipped, transform)
+                        if parts:
+                            features.append((properties[i], geometry_type, parts))
+                    if features:
+                        content[name] = features
+                if content:
+                    data = encode_tile(content)
+                    os.makedirs(os.path.join(tmp_path, str(zoom), str(x)), exist_ok=True)
+                    with open(os.path.join(tmp_path, str(zoom), str(x), f'{y}.pbf'), 'wb') as f:
+                        f.write(data)
+                    tiles += 1
+                    total_bytes += len(data)
+
+    metadata = {
+        'version': hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()[:12],
+        'built': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'min_zoom': min(zooms),
+        'max_zoom': max(zooms),
+        'layers': list(layers),
+        'sources': hashes,
+    }
+    with open(os.path.join(tmp_path, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    log(f"Built {tiles:,} tiles ({total_bytes:,} bytes) for zooms {min(zooms)}-{max(zooms)} "
+        f"in {time.perf_counter() - start:.1f}s")
+    return metadata
+
+def _read_current(path):
+    with open(os.path.join(path, 'metadata.json'), encoding='utf-8') as f:
+        metadata = json.load(f)
+    return metadata if metadata['sources'] == _source_hashes() else None
+
+def metadata(path=default_tiles_path):
+    # Metadata of the built tiles if the maps use them and they match the sources,
+    # else None; rechecked when any file changes
+    metadata_path = os.path.join(path, 'metadata.json')
+    if not os.environ.get('FARECALC_TILE_URL') or os.environ.get('FARECALC_VECTOR_TILES') == '0' \
+            or not os.path.exists(metadata_path):
+        return None
+    return data_store.cached(('tiles', os.path.abspath(path)), [metadata_path] + _source_paths(),
+                             lambda: _read_current(path))
+
+def version(path=default_tiles_path):
+    # Version of the current tiles, None when maps draw the geometry inline
+    current = metadata(path)
+    return current['version'] if current else None
+
+# Serving
+
+class _TileHandler(http.server.SimpleHTTPRequestHandler):
+    extensions_map = {'.pbf': 'application/x-protobuf', '.json': 'application/json', '': 'application/octet-stream'}
+
+    def end_headers(self):
+        # The map page is served by Streamlit on another origin
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'public, max-age=86400')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def server(path=default_tiles_path, port=tile_port, host='127.0.0.1'):
+    return http.server.ThreadingHTTPServer((host, port), functools.partial(_TileHandler, directory=path))
+
+def tile_url(path=default_tiles_path):
+    # URL template of the current tiles under FARECALC_TILE_URL, None when the
+    # maps do not use tiles. The version query makes browsers fetch tiles again
+    # after a rebuild
+    current = metadata(path)
+    if current is None:
+        return None
+    base = os.environ['FARECALC_TILE_URL']
+    return f"{base.rstrip('/')}/{{z}}/{{x}}/{{y}}.pbf?v={current['version']}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or serve vector tiles of the route and zone geometry.")
+    parser.add_argument('command', choices=['build', 'serve'])
+    parser.add_argument('--path', default=default_tiles_path)
+    parser.add_argument('--min-zoom', type=int, default=min_zoom)
+    parser.add_argument('--max-zoom', type=int, default=max_zoom)
+    parser.add_argument('--host', default='127.0.0.1', help="address to serve on, 0.0.0.0 for all interfaces")
+    parser.add_argument('--port', type=int, default=tile_port)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build(args.path, range(args.min_zoom, args.max_zoom + 1))
+    else:
+        try:
+            tile_server = server(args.path, args.port, args.host)
+        except OSError as error:
+            parser.error(f"cannot serve on {args.host}:{args.port}: {error}")
+        print(f"Serving {args.path} on http://{args.host}:{args.port}/{{z}}/{{x}}/{{y}}.pbf; "
+              f"point the dashboard at it with FARECALC_TILE_URL")
+        tile_server.serve_forever()
+
+if __name__ == '__main__':
+    sys.exit(main())